@@ -0,0 +1,135 @@
+import os
+import time
+import numpy as np
+
+# Cache settings, uvicorn_wrapper.py sets these from its command line arguments
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "0") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "512"))
+# How often (seconds) the chunks table is checked for changes that invalidate cached answers
+ANSWER_CACHE_VERSION_INTERVAL = float(os.environ.get("ANSWER_CACHE_VERSION_INTERVAL", "30"))
+
+class SemanticAnswerCache:
+    """Serves a previous answer when a new query embedding is close enough to a cached one.
+
+    Query embeddings live in one preallocated, L2-normalized float32 matrix so a lookup is a
+    single matrix-vector product over every slot. Entries expire after the TTL, the least
+    recently used entry is evicted when the cache is full, and everything is dropped when
+    the chunks table changes.
+
+    Answers are only served within the scope they were put in, any hashable key: the wiki plus
+    whatever else changes the answer to the same question (see rag_query.answer_cache_scope).
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, threshold=ANSWER_CACHE_THRESHOLD,
+                 ttl=ANSWER_CACHE_TTL, version_interval=ANSWER_CACHE_VERSION_INTERVAL):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._matrix = None  # allocated on first put, once the embedding dimension is known
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._scope_ids = np.full(max_entries, -1, dtype=np.int32)
+        self._scopes = {}
+        self._next_scope_id = 0
+        self._entries = [None] * max_entries
+        self._corpus_version = None
+        self._version_checked = float("-inf")
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _scope_id(self, scope):
+        if scope not in self._scopes:
+            if len(self._scopes) >= self.max_entries:
+                # Forget scopes no valid entry uses, ids are never reused so stale slots can't match
+                live = set(self._scope_ids[self._valid].tolist())
+                self._scopes = {key: scope_id for key, scope_id in self._scopes.items() if scope_id in live}
+            self._scopes[scope] = self._next_scope_id
+            self._next_scope_id += 1
+        return self._scopes[scope]
+
+    def lookup(self, embedding, scope):
+        now = time.monotonic()
+        self._valid &= self._expires > now
+        scope_id = self._scopes.get(scope)
+        if self._matrix is None or scope_id is None:
+            self.misses += 1
+            return None
+        candidates = self._valid & (self._scope_ids == scope_id)
+        if not candidates.any():
+            self.misses += 1
+            return None
+        sims = self._matrix @ self._normalize(embedding)
+        sims[~candidates] = -np.inf
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._last_used[best] = now
+        return dict(self._entries[best], similarity=float(sims[best]))
+
+    def put(self, embedding, scope, query, chunk_ids, answer):
+        vector = self._normalize(embedding)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        free = np.flatnonzero(~self._valid)
+        if free.size:
+            slot = int(free[0])
+        else:
+            slot = int(np.argmin(self._last_used))
+            self.evictions += 1
+        now = time.monotonic()
+        self._matrix[slot] = vector
+        self._valid[slot] = True
+        self._expires[slot] = now + self.ttl
+        self._last_used[slot] = now
+        self._scope_ids[slot] = self._scope_id(scope)
+        self._entries[slot] = {"query": query, "chunk_ids": list(chunk_ids), "answer": answer}
+
+    def invalidate(self):
+        if self._valid.any():
+            self.invalidations += 1
+        self._valid[:] = False
+
+    async def check_corpus_version(self, fetch_version):
+        """Drop every entry when fetch_version() reports a change, at most once per interval."""
+        now = time.monotonic()
+        if now - self._version_checked < self.version_interval:
+            return
+        self._version_checked = now
+        version = await fetch_version()
+        if self._corpus_version is not None and version != self._corpus_version:
+            self.invalidate()
+        self._corpus_version = version
+
+    def stats(self):
+        return {"entries": int(self._valid.sum()), "max_entries": self.max_entries, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions, "invalidations": self.invalidations}
+
+_cache = None
+
+def init_answer_cache(**kwargs):
+    global _cache
+    if _cache is None and ANSWER_CACHE_ENABLED:
+        _cache = SemanticAnswerCache(**kwargs)
+    return _cache
+
+def get_answer_cache():
+    # The cache is optional, callers skip it when it is disabled
+    return _cache
+
+def close_answer_cache():
+    global _cache
+    _cache = None
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# A local stand-in for a Fandom wiki's api.php, enough for scrape_fandom_wiki.py to run against:
+#   action=query&generator=allpages&prop=revisions  (with continuation)
+#   action=parse&page=<title>&prop=text|revid
+# Pages come from a scraped JSONL file (title + html) or are generated. --latency and --fail-rate
+# exercise the scraper's rate limiting and retry handling.
+
+def load_pages(corpus, count):
+    pages = {}
+    if corpus:
+        with open(corpus, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                pages[record["title"]] = record.get("html") or f"<p>{record.get('text', '')}</p>"
+    for i in range(count):
+        title = f"Page {i:05d}"
+        pages[title] = f"<p>{title} is a generated article.</p>" * 20
+    return dict(sorted(pages.items()))
+
+def make_handler(pages, revids, latency, fail_rate, page_size):
+    titles = list(pages)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.endswith("api.php"):
+                self.send_json({"error": "not found"}, 404)
+                return
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if latency:
+                time.sleep(random.uniform(0.5, 1.5) * latency)
+            if fail_rate and random.random() < fail_rate:
+                self.send_json({"error": "simulated failure"}, 503)
+                return
+            if params.get("action") == "query" and params.get("generator") == "allpages":
+                start = int(params.get("gapcontinue", 0))
+                batch = titles[start:start + page_size]
+                payload = {"query": {"pages": [
+                    {"title": t, "revisions": [{"revid": revids[t], "timestamp": "2025-01-01T00:00:00Z"}]}
+                    for t in batch
+                ]}}
+                if start + page_size < len(titles):
+                    payload["continue"] = {"gapcontinue": str(start + page_size), "continue": "gapcontinue||"}
+                self.send_json(payload)
+            elif params.get("action") == "parse":
+                title = params.get("page")
+                if title not in pages:
+                    self.send_json({"error": {"code": "missingtitle", "info": "The page you specified doesn't exist."}})
+                    return
+                self.send_json({"parse": {"title": title, "revid": revids[title], "text": pages[title]}})
+            else:
+                self.send_json({"error": {"code": "badvalue", "info": "unsupported request"}})
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in MediaWiki API.")
+    parser.add_argument("--corpus", help="JSONL file with title and html (e.g. an earlier scrape)")
+    parser.add_argument("--pages", type=int, default=0, help="Number of generated pages to add")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    parser.add_argument("--page-size", type=int, default=500, help="Titles per allpages response")
+    args = parser.parse_args()
+    pages = load_pages(args.corpus, args.pages)
+    revids = {title: 1000 + i for i, title in enumerate(pages)}
+    server = ThreadingHTTPServer(("127.0.0.1", args.port),
+                                 make_handler(pages, revids, args.latency, args.fail_rate, args.page_size))
+    print(f"Serving {len(pages)} pages at http://127.0.0.1:{args.port}/api.php")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
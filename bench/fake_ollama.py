@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+# A local stand-in for the Ollama API, enough for chunk_embed_insert.py and rag_api.py to run against:
+#   POST /api/embeddings  {"model", "prompt"}            -> {"embedding": [...]}
+#   POST /api/embed       {"model", "input": [...]}      -> {"embeddings": [[...], ...]}
+#   POST /api/generate    {"model", "prompt", "stream"}  -> NDJSON stream (or one message)
+#   POST /api/chat        {"model", "messages", "stream"}
+#   POST /api/show, GET /api/tags, GET /api/version
+# Embeddings are deterministic: every word maps to a fixed random vector and a text embeds as
+# the normalized sum of its words, so texts sharing words are close and retrieval is meaningful.
+# Latency is modelled as fixed + per-item embedding time, prompt processing at --prefill-tps and
+# generation at --eval-tps, with at most --parallel generations running at once like Ollama.
+
+WORD_RE = re.compile(r"\w+")
+FILLER = ("the", "expedition", "reached", "a", "painted", "city", "where", "every", "answer", "waits")
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+def make_embedder(dim):
+    @lru_cache(maxsize=65536)
+    def word_vector(word):
+        seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+    def embed(text):
+        vector = np.zeros(dim, dtype=np.float32)
+        for word in WORD_RE.findall(text.lower()):
+            vector += word_vector(word)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return np.round(vector, 6).tolist()
+
+    return embed
+
+def make_handler(args):
+    embed = make_embedder(args.dim)
+    generation_slots = threading.BoundedSemaphore(args.parallel)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Streamed messages are small writes, Nagle's algorithm would hold each one back ~40ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def start_stream(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def send_chunk(self, payload):
+            data = (json.dumps(payload) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def end_stream(self):
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self.send_json({"models": [{"name": args.model, "model": args.model, "size": 0}]})
+            elif self.path == "/api/version":
+                self.send_json({"version": "0.0.0-fake"})
+            else:
+                self.send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            data = self.read_json()
+            if self.path == "/api/embeddings":
+                time.sleep(args.embed_latency + args.embed_item_latency)
+                self.send_json({"embedding": embed(data.get("prompt", ""))})
+            elif self.path == "/api/embed":
+                texts = data.get("input", [])
+                texts = [texts] if isinstance(texts, str) else texts
+                time.sleep(args.embed_latency + args.embed_item_latency * len(texts))
+                self.send_json({"model": data.get("model"), "embeddings": [embed(t) for t in texts]})
+            elif self.path == "/api/generate":
+                self.generate(data, estimate_tokens(data.get("prompt", "")), chat=False)
+            elif self.path == "/api/chat":
+                prompt = "".join(m.get("content", "") for m in data.get("messages", []))
+                self.generate(data, estimate_tokens(prompt), chat=True)
+            elif self.path == "/api/show":
+                self.send_json({
+                    "modelfile": "# fake",
+                    "parameters": f"num_ctx {args.num_ctx}",
+                    "details": {"family": "qwen3"},
+                    "model_info": {"general.architecture": "qwen3", "qwen3.context_length": args.num_ctx}
+                })
+            else:
+                self.send_json({"error": "not found"}, 404)
+
+        def generate(self, data, prompt_tokens, chat):
+            model = data.get("model", args.model)
+            stream = data.get("stream", True)
+
+            def message(text, done, **extra):
+                payload = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "done": done}
+                if chat:
+                    payload["message"] = {"role": "assistant", "content": text}
+                else:
+                    payload["response"] = text
+                payload.update(extra)
+                return payload
+
+            started = time.perf_counter_ns()
+            with generation_slots:
+                queued = time.perf_counter_ns() - started
+                prefill = prompt_tokens / args.prefill_tps
+                time.sleep(prefill)
+                if stream:
+                    self.start_stream()
+                words = []
+                for i in range(args.tokens):
+                    time.sleep(1 / args.eval_tps)
+                    word = FILLER[i % len(FILLER)] + " "
+                    words.append(word)
+                    if stream:
+                        self.send_chunk(message(word, False))
+                eval_duration = int(args.tokens / args.eval_tps * 1e9)
+                stats = {
+                    "done_reason": "stop",
+                    "total_duration": time.perf_counter_ns() - started,
+                    "load_duration": queued,
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(prefill * 1e9),
+                    "eval_count": args.tokens,
+                    "eval_duration": eval_duration
+                }
+                if stream:
+                    self.send_chunk(message("", True, **stats))
+                    self.end_stream()
+                else:
+                    self.send_json(message("".join(words), True, **stats))
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in Ollama API.")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--model", default="fake-model", help="Model name reported by /api/tags")
+    parser.add_argument("--dim", type=int, default=4096, help="Embedding dimensions")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds added to every embedding request")
+    parser.add_argument("--embed-item-latency", type=float, default=0.0, help="Seconds added per embedded text")
+    parser.add_argument("--prefill-tps", type=float, default=2000.0, help="Prompt tokens processed per second")
+    parser.add_argument("--eval-tps", type=float, default=50.0, help="Tokens generated per second")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens generated per answer")
+    parser.add_argument("--parallel", type=int, default=1, help="Generations served at the same time, the rest wait")
+    parser.add_argument("--num-ctx", type=int, default=40960, help="Context length reported by /api/show")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args))
+    server.daemon_threads = True
+    print(f"Serving a fake Ollama at http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+from html import escape
+
+# Writes a synthetic Fandom-style scrape (title, url, revid, html per line) for benchmarks. Pages
+# have an infobox, a few sections of prose mentioning other pages, a navbox and, for a fraction
+# of them, a stub notice, so the file exercises extract_text.py the way a real scrape does. Enemy
+# pages are also in Category:Stubborn_enemies, which must not be taken for a stub category. The
+# same --seed always produces the same corpus.
+
+SYLLABLES = ("ka", "ren", "oi", "mael", "lu", "ne", "ver", "so", "gus", "ta", "ve", "cla", "ir", "ob", "scu", "ra",
+             "es", "qui", "e", "mo", "no", "co", "sci", "el", "le", "pic", "tos", "lu", "mi", "na")
+KINDS = ("Character", "Location", "Weapon", "Pictos", "Enemy", "Quest", "Skill", "Item")
+VERBS = ("fights alongside", "was found near", "is weak against", "can be upgraded with", "guards",
+         "was painted by", "drops", "teaches", "is required for", "travels to")
+NOUNS = ("the Paintress", "the Monolith", "the expedition", "a Gommage", "chroma", "lumina points",
+         "the Continent", "a Nevron", "the Manor", "free aim shots", "a parry", "the Gestral village")
+
+def make_name(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+def make_page(rng, title, kind, others, paragraphs, stub):
+    def links():
+        other = escape(rng.choice(others))
+        return f'<a href="/wiki/{other.replace(" ", "_")}" title="{other}">{other}</a>'
+
+    parts = ['<div class="mw-parser-output">']
+    parts.append(
+        f'<aside class="portable-infobox"><h2>{escape(title)}</h2>'
+        f'<div class="pi-item"><h3>Type</h3><div>{kind}</div></div>'
+        f'<div class="pi-item"><h3>Level</h3><div>{rng.randint(1, 99)}</div></div></aside>'
+    )
+    if stub:
+        parts.append('<p>This article is a <a href="/wiki/Category:Stubs" title="Category:Stubs">stub</a>. '
+                     'You can help the wiki by expanding it.</p>')
+    parts.append(f"<p><b>{escape(title)}</b> is a {kind.lower()} in Clair Obscur: Expedition 33.</p>")
+    for section in range(paragraphs):
+        parts.append(f'<h2><span class="mw-headline">Section {section + 1}</span>'
+                     f'<span class="mw-editsection">[edit]</span></h2>')
+        sentences = [
+            f"{escape(title)} {rng.choice(VERBS)} {links()} and {rng.choice(NOUNS)}."
+            for _ in range(rng.randint(4, 10))
+        ]
+        parts.append(f"<p>{' '.join(sentences)}</p>")
+    parts.append(f'<table class="navbox"><tr><td>{" · ".join(links() for _ in range(8))}</td></tr></table>')
+    categories = [f"{kind}s"] + (["Stubborn_enemies"] if kind == "Enemy" else []) + ([f"{kind}_stubs"] if stub else [])
+    parts.append('<div class="catlinks">' + " ".join(
+        f'<a href="/wiki/Category:{category}" title="Category:{category.replace("_", " ")}">{category.replace("_", " ")}</a>'
+        for category in categories) + "</div>")
+    parts.append("</div>")
+    return "".join(parts)
+
+def generate(path, pages, paragraphs=6, stub_rate=0.05, seed=33, base_url="https://bench.fandom.com"):
+    rng = random.Random(seed)
+    titles = {}
+    while len(titles) < pages:
+        title = f"{make_name(rng)} {make_name(rng)}" if rng.random() < 0.5 else make_name(rng)
+        titles.setdefault(title, None)
+    titles = list(titles)
+    kinds = {title: rng.choice(KINDS) for title in titles}
+    with open(path, "w", encoding="utf-8") as out:
+        for i, title in enumerate(titles):
+            html = make_page(rng, title, kinds[title], titles, rng.randint(1, paragraphs), rng.random() < stub_rate)
+            record = {"title": title, "url": f"{base_url}/wiki/{title.replace(' ', '_')}", "revid": 1000 + i,
+                      "html": html}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return titles
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Fandom-style scrape JSONL file.")
+    parser.add_argument("output", help="JSONL file to write")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--paragraphs", type=int, default=6, help="Maximum sections per page")
+    parser.add_argument("--stub-rate", type=float, default=0.05, help="Fraction of pages marked as stubs")
+    parser.add_argument("--seed", type=int, default=33)
+    args = parser.parse_args()
+    generate(args.output, args.pages, args.paragraphs, args.stub_rate, args.seed)
+    print(f"Wrote {args.pages} pages to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+# Benchmark scenarios, each writes one JSON document (environment, parameters, results) so runs
+# can be diffed with the compare command:
+#   ingest   chunks/sec of chunk_embed_insert.run_pipeline (needs postgres and an Ollama, e.g. fake_ollama.py)
+#   query    p50/p95/p99 latency of /api/chat and /rag_query under N concurrent clients (needs a running API)
+#   cpu      CPU time of context packing, chunk selection and chunking (chunking needs the tokenizer)
+#   compare  percent change between two result files
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from make_corpus import generate
+
+DEFAULT_QUESTIONS = ("Who is the Paintress?", "What does the Monolith do?", "Where can I find chroma?",
+                     "What is a Gommage?", "How do I parry?")
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"git_commit": commit or None, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+def summarize(values):
+    """Latency summary in milliseconds of a list of seconds."""
+    if not values:
+        return None
+    ms = np.asarray(values) * 1000
+    return {"count": len(ms), "mean": round(float(ms.mean()), 3), "p50": round(float(np.percentile(ms, 50)), 3),
+            "p95": round(float(np.percentile(ms, 95)), 3), "p99": round(float(np.percentile(ms, 99)), 3),
+            "max": round(float(ms.max()), 3)}
+
+def write_result(path, benchmark, params, results):
+    document = {"benchmark": benchmark, "timestamp": datetime.now(timezone.utc).isoformat(),
+                "environment": environment(), "params": params, "results": results}
+    text = json.dumps(document, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+        print(f"✅ Results written to {path}")
+    else:
+        print(text)
+
+def text_corpus(args, workdir):
+    """Return a text JSONL for ingest, generating and extracting a synthetic one if none was given."""
+    from extract_text import extract_file
+    if args.input_file:
+        return args.input_file, {}
+    raw = os.path.join(workdir, "corpus.jsonl")
+    text = os.path.join(workdir, "corpus-text.jsonl")
+    generate(raw, args.pages, seed=args.seed)
+    started = time.perf_counter()
+    counts = extract_file(raw, text, workers=args.extract_workers)
+    elapsed = time.perf_counter() - started
+    return text, {"extract_seconds": round(elapsed, 3), "extract_records_per_sec": round(counts["total"] / elapsed, 1)}
+
+def bench_ingest(args):
+    from chunk_embed_insert import run_pipeline
+    db_params = dict(dbname=args.db_name, user=args.db_user, password=args.db_pass, host=args.db_host)
+    with tempfile.TemporaryDirectory() as workdir:
+        input_file, results = text_corpus(args, workdir)
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        stats = run_pipeline(input_file, db_params, args.wiki, batch_size=args.batch_size,
+                             concurrency=args.concurrency, hosts=args.ollama_host or ["http://127.0.0.1:11434"],
+                             chunking=dict(workers=args.tokenize_workers))
+        elapsed = time.perf_counter() - started
+    results.update({
+        "seconds": round(elapsed, 3),
+        "main_process_cpu_seconds": round(time.process_time() - cpu_started, 3),
+        "articles": stats.articles,
+        "chunks": stats.chunks,
+        "failed_chunks": stats.failed_chunks,
+        "articles_per_sec": round(stats.articles / elapsed, 2),
+        "chunks_per_sec": round(stats.chunks / elapsed, 2)
+    })
+    return results
+
+def load_questions(args):
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            return [f"What is {json.loads(line)['title']}?" for line in f if line.strip()]
+    return list(DEFAULT_QUESTIONS)
+
+async def _chat_request(client, args, question):
+    payload = {"model": args.model, "messages": [{"role": "user", "content": question}], "stream": True}
+    started = time.perf_counter()
+    first = None
+    async with client.stream("POST", "/api/chat", json=payload) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line:
+                continue
+            message = json.loads(line)
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            if first is None and message.get("message", {}).get("content"):
+                first = time.perf_counter() - started
+    return time.perf_counter() - started, first
+
+async def _rag_query_request(client, args, question):
+    started = time.perf_counter()
+    resp = await client.post("/rag_query", json={"query": question, "wiki": args.model})
+    resp.raise_for_status()
+    return time.perf_counter() - started, None
+
+async def run_load(endpoint, args, questions):
+    import httpx
+    request = _chat_request if endpoint == "chat" else _rag_query_request
+    rng = random.Random(args.seed)
+    latencies, first_tokens, errors = [], [], []
+    remaining = args.warmup + args.requests
+    measured_from = None
+    lock = asyncio.Lock()
+
+    async def client_loop(client):
+        nonlocal remaining, measured_from
+        while True:
+            async with lock:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+                warmup = remaining >= args.requests
+                if not warmup and measured_from is None:
+                    measured_from = time.perf_counter()
+            try:
+                latency, first = await request(client, args, rng.choice(questions))
+            except Exception as e:
+                if not warmup:
+                    errors.append(str(e))
+                continue
+            if not warmup:
+                latencies.append(latency)
+                if first is not None:
+                    first_tokens.append(first)
+
+    timeout = httpx.Timeout(args.timeout, connect=10)
+    limits = httpx.Limits(max_connections=args.clients)
+    async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(args.clients)))
+    elapsed = time.perf_counter() - (measured_from or time.perf_counter())
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "latency_ms": summarize(latencies),
+        "first_token_ms": summarize(first_tokens)
+    }
+
+def bench_query(args):
+    questions = load_questions(args)
+    endpoints = ["chat", "rag_query"] if args.endpoint == "both" else [args.endpoint]
+    results = {}
+    for endpoint in endpoints:
+        print(f"Running {args.requests} {endpoint} requests with {args.clients} clients...")
+        results[endpoint] = asyncio.run(run_load(endpoint, args, questions))
+    return results
+
+def synthetic_chunks(rng, count=300, articles=40, chunk_tokens=512, overlap=128, dim=None):
+    """Retrieval-shaped chunk rows: several neighbouring, overlapping chunks per article."""
+    chunks = []
+    for chunk_id in range(count):
+        article_id = rng.randrange(articles)
+        index = rng.randrange(12)
+        start = index * (chunk_tokens - overlap)
+        words = [f"w{article_id}_{i}" for i in range(start, start + chunk_tokens)]
+        chunk = {"chunk_id": chunk_id, "article_id": article_id, "chunk_index": index,
+                 "chunk_start_token": start, "chunk_end_token": start + chunk_tokens,
+                 "token_count": chunk_tokens, "content": " ".join(words)}
+        if dim:
+            chunk["embedding"] = np.random.default_rng(chunk_id).standard_normal(dim).astype(np.float32)
+        chunks.append(chunk)
+    # Retrieval returns every chunk once
+    unique = {}
+    for chunk in chunks:
+        unique.setdefault((chunk["article_id"], chunk["chunk_index"]), chunk)
+    return list(unique.values())
+
+def time_calls(fn, iterations):
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return {"iterations": iterations,
+            "wall_ms_per_call": round((time.perf_counter() - started) / iterations * 1000, 4),
+            "cpu_ms_per_call": round((time.process_time() - cpu_started) / iterations * 1000, 4)}
+
+def bench_cpu(args):
+    from rag_query import trim_chunks_to_fit
+    from context_budget import FALLBACK_CONTEXT_WINDOW, ANSWER_RESERVE_TOKENS
+    from chunk_selection import select_chunks, DEFAULT_SETTINGS
+    rng = random.Random(args.seed)
+    results = {}
+    chunks = synthetic_chunks(rng)
+    query = "Who is the Paintress and where can I find her?"
+    results["trim_chunks_to_fit"] = dict(time_calls(lambda: trim_chunks_to_fit(chunks, query, FALLBACK_CONTEXT_WINDOW - ANSWER_RESERVE_TOKENS), args.iterations),
+                                         chunks=len(chunks))
+    embedded = synthetic_chunks(rng, dim=args.dim)
+    query_embedding = np.random.default_rng(args.seed).standard_normal(args.dim).astype(np.float32)
+    # No cutoffs, MMR orders every candidate (the worst case)
+    settings = DEFAULT_SETTINGS.with_overrides({"enabled": True, "min_relative_similarity": 0, "score_gap": 0})
+    results["select_chunks"] = dict(time_calls(lambda: select_chunks(embedded, query_embedding, settings),
+                                               max(1, args.iterations // 10)), chunks=len(embedded))
+    try:
+        from chunker import chunk_tokens, get_tokenizer, tokenize_batch, chunks_from_spans
+        tokenizer = get_tokenizer()
+    except Exception as e:
+        results["chunking"] = {"skipped": f"tokenizer unavailable: {e}"}
+        return results
+    from extract_text import extract_lines
+    with tempfile.TemporaryDirectory() as workdir:
+        raw = os.path.join(workdir, "corpus.jsonl")
+        generate(raw, args.pages, seed=args.seed)
+        with open(raw, encoding="utf-8") as f:
+            texts = [json.loads(line)["text"] for status, line in extract_lines(f.readlines()) if status == "ok"]
+    tokens = sum(len(tokenizer.encode(t, add_special_tokens=False)) for t in texts)
+
+    def legacy():
+        for text in texts:
+            chunk_tokens(tokenizer.encode(text, add_special_tokens=False))
+
+    def offsets():
+        for text, (_, spans) in zip(texts, tokenize_batch(texts)):
+            chunks_from_spans(text, spans)
+
+    for name, fn in (("chunk_tokens", legacy), ("tokenize_batch", offsets)):
+        timing = time_calls(fn, 1)
+        seconds = timing["cpu_ms_per_call"] / 1000
+        results[name] = dict(timing, articles=len(texts), tokens=tokens,
+                             tokens_per_cpu_sec=round(tokens / seconds, 1) if seconds else None)
+    return results
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}{key}.")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix[:-1], value
+
+def _higher_is_better(key):
+    return any(word in key for word in ("per_sec", "throughput", "rps"))
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = dict(_flatten(json.load(f)["results"]))
+    with open(args.current) as f:
+        current = dict(_flatten(json.load(f)["results"]))
+    regressions = 0
+    print(f"{'metric':60} {'baseline':>14} {'current':>14} {'change':>9}")
+    for key in sorted(baseline.keys() & current.keys()):
+        old, new = baseline[key], current[key]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if _higher_is_better(key) else change
+        # Counts (requests, chunks, iterations) are reported but never regressions
+        tracked = key.endswith(("_ms", "seconds", "per_call", "p50", "p95", "p99", "mean", "max")) or _higher_is_better(key)
+        flag = ""
+        if tracked and worse > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key:60} {old:>14.4g} {new:>14.4g} {change:>+8.1f}%{flag}")
+    if regressions:
+        print(f"\n❌ {regressions} metrics regressed by more than {args.threshold}%")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run fandom-rag benchmarks and write machine-readable results.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Measure chunk_embed_insert.py throughput")
+    ingest.add_argument("--db-host", required=True)
+    ingest.add_argument("--db-name", required=True)
+    ingest.add_argument("--db-user", required=True)
+    ingest.add_argument("--db-pass", required=True)
+    ingest.add_argument("--wiki", default="bench", help="Wiki the benchmark articles are ingested as")
+    ingest.add_argument("--input-file", help="Text JSONL to ingest (a synthetic corpus is generated when omitted)")
+    ingest.add_argument("--pages", type=int, default=500, help="Pages of the generated corpus")
+    ingest.add_argument("--ollama-host", action="append", help="Ollama (or bench/fake_ollama.py) url, repeat for a pool")
+    ingest.add_argument("--batch-size", type=int, default=16)
+    ingest.add_argument("--concurrency", type=int, default=4)
+    ingest.add_argument("--tokenize-workers", type=int, default=min(4, os.cpu_count() or 1))
+    ingest.add_argument("--extract-workers", type=int, default=0)
+
+    query = subparsers.add_parser("query", help="Measure API latency under concurrent clients")
+    query.add_argument("--url", default="http://127.0.0.1:8000", help="Base url of the running rag_api")
+    query.add_argument("--model", default="bench", help="Wiki / model name to query")
+    query.add_argument("--endpoint", choices=["chat", "rag_query", "both"], default="both")
+    query.add_argument("--clients", type=int, default=8, help="Concurrent clients")
+    query.add_argument("--requests", type=int, default=100, help="Measured requests per endpoint")
+    query.add_argument("--warmup", type=int, default=5, help="Requests sent before measuring")
+    query.add_argument("--questions", help="File with one question per line")
+    query.add_argument("--corpus", help="JSONL corpus, asks 'What is <title>?' for its titles")
+    query.add_argument("--timeout", type=float, default=600)
+
+    cpu = subparsers.add_parser("cpu", help="Measure CPU cost of packing, selection and chunking")
+    cpu.add_argument("--iterations", type=int, default=200)
+    cpu.add_argument("--pages", type=int, default=100, help="Pages chunked by the chunking benchmark")
+    cpu.add_argument("--dim", type=int, default=4096, help="Embedding dimensions for the selection benchmark")
+
+    for sub in (ingest, query, cpu):
+        sub.add_argument("--seed", type=int, default=33)
+        sub.add_argument("--output", help="Write the results JSON here instead of stdout")
+
+    diff = subparsers.add_parser("compare", help="Compare two result files")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--threshold", type=float, default=10.0, help="Percent change counted as a regression")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.command == "compare":
+        sys.exit(1 if compare(args) else 0)
+    scenarios = {"ingest": bench_ingest, "query": bench_query, "cpu": bench_cpu}
+    params = {k: v for k, v in vars(args).items() if k not in ("command", "output", "db_pass")}
+    results = scenarios[args.command](args)
+    write_result(args.output, args.command, params, results)
+
+if __name__ == "__main__":
+    main()
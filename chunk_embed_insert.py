@@ -1,48 +1,25 @@
-from transformers import AutoTokenizer
 import requests
 import json
-import psycopg2
-from typing import List
+from typing import List, Optional
 import jsonlines
-from dataclasses import dataclass
+from chunk_writer import ChunkWriter
+from chunker import ArticleChunk, tokenize_articles, CHUNK_SIZE, CHUNK_OVERLAP, MIN_TAIL_TOKENS
+from vector_index import export_index, wiki_index_path
+from ollama_pool import OllamaPool, DEFAULT_OLLAMA_HOST, parse_host
+from corpus_snapshot import SnapshotEmbeddings, find_embeddings
+from dataclasses import dataclass, field
 import argparse
+import hashlib
+import os
+import queue
+import threading
+import time
 
-# Load the Qwen3 tokenizer
-tokenizer = AutoTokenizer.from_pretrained("Qwen/Qwen3-Embedding-8B")
-
-@dataclass
-class ArticleChunk:
-    start_token: int
-    end_token: int
-    text: str
-
-# Chunk token ids into 512-token chunks with 128-token overlap
-def chunk_tokens(input_ids: List[int], max_tokens: int = 512, overlap: int = 128) -> List[ArticleChunk]:
-    step = max_tokens - overlap
-    chunks = []
-    i = 0
-    while i < len(input_ids):
-        chunk_ids = input_ids[i:i + max_tokens]
-        chunk_text = tokenizer.decode(chunk_ids, skip_special_tokens=True)
-        if not chunks:
-            # Always append the first chunk
-            chunks.append(ArticleChunk(start_token=i, end_token=i + len(chunk_ids), text=chunk_text))
-        elif len(chunk_ids) <= 15:
-            # Merge this chunk into the previous chunk using the full token range for decoding
-            prev = chunks[-1]
-            merged_start = prev.start_token
-            merged_end = i + len(chunk_ids)
-            merged_ids = input_ids[merged_start:merged_end]
-            merged_text = tokenizer.decode(merged_ids, skip_special_tokens=True)
-            chunks[-1] = ArticleChunk(start_token=merged_start, end_token=merged_end, text=merged_text)
-        else:
-            # Normal chunk
-            chunks.append(ArticleChunk(start_token=i, end_token=i + len(chunk_ids), text=chunk_text))
-        i += step
-    return chunks
+OLLAMA_EMBEDDING_MODEL = "dengcao/Qwen3-Embedding-8B:Q8_0"
+OLLAMA_HOST = DEFAULT_OLLAMA_HOST
 
 # Get embedding from local Ollama
-def get_embedding_ollama(text: str, model: str = "dengcao/Qwen3-Embedding-8B:Q8_0", host: str = "http://fnordstation.home.arpa:11434") -> List[float]:
+def get_embedding_ollama(text: str, model: str = OLLAMA_EMBEDDING_MODEL, host: str = OLLAMA_HOST) -> List[float]:
     response = requests.post(
         f"{host}/api/embeddings",
         headers={"Content-Type": "application/json"},
@@ -54,38 +31,258 @@ def get_embedding_ollama(text: str, model: str = "dengcao/Qwen3-Embedding-8B:Q8_
     response.raise_for_status()
     return response.json()["embedding"]
 
-# PostgreSQL connection helper
-def get_pg_connection(db_params):
-    return psycopg2.connect(**db_params)
-
-# Insert chunk + embedding into Postgres
-def insert_into_postgres(article_id: int, chunk_index: int, start_token: int, end_token: int,
-                         content: str, embedding: List[float], token_count: int, db_params=None):
-    conn = get_pg_connection(db_params)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO chunks (article_id, chunk_index, chunk_start_token, chunk_end_token,
-                                 content, embedding, token_count)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    """, (article_id, chunk_index, start_token, end_token, content, embedding, token_count))
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def insert_article(title: str, content: str, token_count: int, metadata: dict, db_params=None) -> int:
-    """Insert article and return its ID"""
-    conn = get_pg_connection(db_params)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO articles (title, full_content, token_count, metadata)
-        VALUES (%s, %s, %s, %s)
-        RETURNING article_id
-    """, (title, content, token_count, json.dumps(metadata)))
-    article_id = cursor.fetchone()[0]
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return article_id
+# Get embeddings for a batch of texts in one request via the batch /api/embed endpoint
+def get_embeddings_ollama(texts: List[str], model: str = OLLAMA_EMBEDDING_MODEL, host: str = OLLAMA_HOST,
+                          session: Optional[requests.Session] = None) -> List[List[float]]:
+    post = session.post if session is not None else requests.post
+    response = post(
+        f"{host}/api/embed",
+        headers={"Content-Type": "application/json"},
+        data=json.dumps({
+            "model": model,
+            "input": texts
+        })
+    )
+    response.raise_for_status()
+    embeddings = response.json()["embeddings"]
+    if len(embeddings) != len(texts):
+        raise ValueError(f"Expected {len(texts)} embeddings from Ollama, got {len(embeddings)}")
+    return embeddings
+
+# --- Pipelined ingest ---
+# Stage 1 tokenizes and chunks articles, stage 2 embeds chunk batches with several
+# requests in flight, stage 3 writes the results. Bounded queues sit between the stages
+# so a slow stage applies back-pressure instead of buffering the whole wiki in memory.
+
+@dataclass
+class IngestArticle:
+    title: str
+    text: str
+    token_count: int
+    metadata: dict
+    chunks: List[ArticleChunk]
+    # article_ids of stored versions this article replaces (sync mode)
+    replaces: Optional[List[int]] = None
+    # Embedded chunk rows, held until every chunk of the article has come back
+    pending_rows: list = field(default_factory=list)
+    received: int = 0
+    failed: int = 0
+
+@dataclass
+class EmbedBatch:
+    items: List[tuple]  # (IngestArticle, chunk_index)
+    embeddings: Optional[List[List[float]]] = None
+    error: Optional[Exception] = None
+    # Chunks whose embedding came from a snapshot
+    reused: int = 0
+
+@dataclass
+class IngestStats:
+    articles: int = 0
+    chunks: int = 0
+    failed_chunks: int = 0
+    unchanged: int = 0
+    replaced: int = 0
+    deleted: int = 0
+    reused: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.chunks / elapsed if elapsed > 0 else 0.0
+        print(f"\nIngested {self.articles} articles and {self.chunks} chunks in {elapsed:.1f}s "
+              f"({rate:.1f} chunks/sec), {self.failed_chunks} chunks failed")
+        if self.unchanged or self.replaced or self.deleted:
+            print(f"Sync: {self.unchanged} unchanged, {self.replaced} replaced, {self.deleted} deleted")
+        if self.reused:
+            print(f"Reused {self.reused} embeddings from snapshots")
+
+_STOP = object()
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def tokenize_stage(input_file, embed_queue, write_queue, batch_size, concurrency, stats,
+                   existing=None, seen_titles=None, chunking=None):
+    """Chunk every article of input_file and queue its chunks for embedding.
+
+    With existing ({title: [(article_id, content_hash)]}, sync mode), articles whose text hash
+    matches the stored version are skipped before tokenizing, and changed ones are marked as
+    replacing the stored rows. chunking is passed through to chunker.tokenize_articles.
+    """
+    def articles_to_chunk(reader):
+        for article in reader:
+            title = article['title']
+            text = article['text']
+            digest = content_hash(text)
+            replaces = None
+            if seen_titles is not None:
+                seen_titles.add(title)
+            if existing is not None and title in existing:
+                stored = existing[title]
+                if len(stored) == 1 and stored[0][1] == digest:
+                    stats.unchanged += 1
+                    continue
+                replaces = [article_id for article_id, _ in stored]
+            yield (article, digest, replaces), text
+
+    batch = []
+    try:
+        with jsonlines.open(input_file) as reader:
+            for (article, digest, replaces), token_count, chunks in tokenize_articles(articles_to_chunk(reader), **(chunking or {})):
+                # Create metadata with url, revision and content hash for later syncs
+                metadata = {'url': article['url'], 'revid': article.get('revid'), 'content_hash': digest}
+                ingest_article = IngestArticle(
+                    title=article['title'],
+                    text=article['text'],
+                    token_count=token_count,
+                    metadata=metadata,
+                    chunks=chunks,
+                    replaces=replaces
+                )
+                # The article always reaches the writer before any of its chunks
+                write_queue.put(ingest_article)
+                for idx in range(len(ingest_article.chunks)):
+                    batch.append((ingest_article, idx))
+                    if len(batch) >= batch_size:
+                        embed_queue.put(EmbedBatch(items=batch))
+                        batch = []
+        if batch:
+            embed_queue.put(EmbedBatch(items=batch))
+    finally:
+        for _ in range(concurrency):
+            embed_queue.put(_STOP)
+
+def embed_stage(embed_queue, write_queue, model, pool, snapshots=()):
+    session = requests.Session()
+    try:
+        while True:
+            batch = embed_queue.get()
+            if batch is _STOP:
+                break
+            texts = [article.chunks[idx].text for article, idx in batch.items]
+            # Chunks with the same text and model in a snapshot keep their embedding, only the rest go to Ollama
+            embeddings = find_embeddings(snapshots, texts, model)
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            batch.reused = len(texts) - len(missing)
+            if missing:
+                try:
+                    # Least busy embed host, failing over to the others if it errors
+                    fetched = pool.call("embed", lambda host: get_embeddings_ollama([texts[i] for i in missing], model=model,
+                                                                                    host=host, session=session))
+                    for i, embedding in zip(missing, fetched):
+                        embeddings[i] = embedding
+                except Exception as e:
+                    batch.error = e
+            batch.embeddings = embeddings
+            write_queue.put(batch)
+    finally:
+        session.close()
+        write_queue.put(_STOP)
+
+def _chunk_row(article, idx, embedding):
+    chunk = article.chunks[idx]
+    return (idx, chunk.start_token, chunk.end_token, chunk.text, embedding, chunk.end_token - chunk.start_token)
+
+def _complete_article(article, stats, writer):
+    metadata = article.metadata
+    if article.failed:
+        # The stored version is only swapped out when every new chunk embedded successfully
+        if article.replaces:
+            print(f"Keeping the stored version of {article.title}, {article.failed} chunks failed to embed")
+            return
+        # Without its content hash the next --sync sees the article as changed and embeds it again
+        metadata = {key: value for key, value in metadata.items() if key != 'content_hash'}
+    ref = writer.add_article(article.title, article.text, article.token_count, metadata,
+                             replaces=article.replaces)
+    writer.add_chunks(ref, article.pending_rows)
+    article.pending_rows = []
+    if article.replaces:
+        stats.replaced += 1
+    stats.chunks += len(article.chunks) - article.failed
+
+def write_stage(write_queue, concurrency, stats, writer):
+    running = concurrency
+    while running:
+        item = write_queue.get()
+        if item is _STOP:
+            running -= 1
+        elif isinstance(item, IngestArticle):
+            stats.articles += 1
+            print(f"Processing article: {item.title} ({len(item.chunks)} chunks)")
+            if not item.chunks:
+                _complete_article(item, stats, writer)
+        else:
+            embeddings = item.embeddings or [None] * len(item.items)
+            stats.reused += item.reused
+            if item.error is not None:
+                failed = [article.title for (article, _), embedding in zip(item.items, embeddings) if embedding is None]
+                stats.failed_chunks += len(failed)
+                print(f"Error embedding batch of {len(failed)} chunks for {', '.join(sorted(set(failed)))}: {item.error}")
+            for (article, idx), embedding in zip(item.items, embeddings):
+                article.received += 1
+                if embedding is None:
+                    article.failed += 1
+                else:
+                    article.pending_rows.append(_chunk_row(article, idx, embedding))
+                if article.received == len(article.chunks):
+                    _complete_article(article, stats, writer)
+
+def run_pipeline(input_file, db_params, wiki, batch_size=16, concurrency=4, queue_size=8,
+                 model=OLLAMA_EMBEDDING_MODEL, hosts=OLLAMA_HOST, flush_size=512, sync=False, prune=False,
+                 chunking=None, wiki_title=None, snapshots=None):
+    """Ingest input_file into wiki. With sync, only new or changed articles are chunked and
+    embedded; with prune as well, stored articles of the wiki missing from input_file are deleted.
+
+    hosts is an ollama_pool host list, concurrency embedding requests are kept in flight per
+    embed host so throughput grows with the number of hosts. snapshots lists corpus_snapshot
+    directories whose embeddings are reused for chunks with the same text and model."""
+    if prune and not sync:
+        raise ValueError("prune only works together with sync.")
+    stats = IngestStats()
+    pool = OllamaPool(hosts)
+    if not pool.with_role("embed"):
+        raise ValueError("No Ollama host serves embed requests, give at least one --ollama-host without =generate.")
+    snapshots = [SnapshotEmbeddings(path) for path in snapshots or ()]
+    for snapshot in snapshots:
+        if snapshot.model != model:
+            print(f"⚠️ Snapshot {snapshot.path} was embedded with {snapshot.model}, not {model}, its embeddings won't be reused")
+    embed_workers = concurrency * len(pool.with_role("embed"))
+    embed_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    with ChunkWriter(db_params, wiki, flush_size=flush_size, wiki_title=wiki_title) as writer:
+        existing = writer.existing_articles() if sync else None
+        seen_titles = set() if sync else None
+
+        def run_tokenizer():
+            try:
+                tokenize_stage(input_file, embed_queue, write_queue, batch_size, embed_workers, stats,
+                               existing=existing, seen_titles=seen_titles, chunking=chunking)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run_tokenizer, name="tokenize", daemon=True)]
+        threads += [
+            threading.Thread(target=embed_stage, args=(embed_queue, write_queue, model, pool, snapshots), name=f"embed-{n}", daemon=True)
+            for n in range(embed_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        # The writer runs on the main thread until every embed worker has signalled completion
+        write_stage(write_queue, embed_workers, stats, writer)
+        for thread in threads:
+            thread.join()
+        if prune and not errors:
+            stale = [article_id for title, stored in existing.items() if title not in seen_titles
+                     for article_id, _ in stored]
+            writer.delete_articles(stale)
+            stats.deleted = len(stale)
+    stats.report()
+    if errors:
+        raise errors[0]
+    return stats
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Insert article chunks and embeddings into Postgres.")
@@ -94,16 +291,45 @@ def parse_args():
     parser.add_argument('--db-user', required=True, help='PostgreSQL user')
     parser.add_argument('--db-pass', required=True, help='PostgreSQL password')
     parser.add_argument('--input-file', default='data.jsonl', help='Input JSONL file')
+    parser.add_argument('--wiki', help='Wiki the articles belong to, served as a model of that name (e.g. clair-obscur)')
+    parser.add_argument('--wiki-title', help='Name of the wiki used in prompts (defaults to --wiki)')
+    parser.add_argument('--batch-size', type=int, default=16, help='Number of chunks sent to Ollama per embedding request')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of embedding requests kept in flight per Ollama host')
+    parser.add_argument('--queue-size', type=int, default=8, help='Maximum number of batches buffered between pipeline stages')
+    parser.add_argument('--flush-size', type=int, default=512, help='Number of buffered chunks written per COPY transaction')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Tokens per chunk')
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP, help='Tokens shared by consecutive chunks')
+    parser.add_argument('--min-tail', type=int, default=MIN_TAIL_TOKENS, help='Trailing chunks this short are merged into the previous chunk')
+    parser.add_argument('--tokenize-workers', type=int, default=min(4, os.cpu_count() or 1), help='Processes used for tokenization (0 tokenizes in the pipeline thread)')
+    parser.add_argument('--tokenize-batch-size', type=int, default=32, help='Articles per batched tokenizer call')
+    parser.add_argument('--sync', action='store_true', help='Only chunk and embed articles that are new or whose text changed')
+    parser.add_argument('--prune', action='store_true', help='With --sync, delete stored articles that are not in the input file')
+    parser.add_argument('--vector-index', help='Refresh the memory-mapped vector index in this directory after ingest')
+    parser.add_argument('--ollama-host', action='append', help='Ollama base url, repeat to spread embedding over several hosts (=generate marks a host that does not embed)')
+    parser.add_argument('--embedding-model', default=OLLAMA_EMBEDDING_MODEL, help='Ollama embedding model')
+    parser.add_argument('--reuse-snapshot', action='append', help='Corpus snapshot directory whose embeddings are reused for identical chunks, repeat for several')
     args = parser.parse_args()
     # Custom error handling for missing arguments
     missing = []
-    for arg in ['db_host', 'db_name', 'db_user', 'db_pass']:
+    for arg in ['db_host', 'db_name', 'db_user', 'db_pass', 'wiki']:
         if not getattr(args, arg):
             missing.append(arg)
     if missing:
         print("\nERROR: Missing required arguments: " + ", ".join(missing))
         print("\nSample usage:")
-        print("python chunk_embed_insert.py --db-host <host> --db-name <dbname> --db-user <user> --db-pass <password> --input-file data.jsonl")
+        print("python chunk_embed_insert.py --db-host <host> --db-name <dbname> --db-user <user> --db-pass <password> --wiki <wiki> --input-file data.jsonl")
+        exit(1)
+    if min(args.batch_size, args.concurrency, args.queue_size, args.flush_size, args.tokenize_batch_size) < 1:
+        print("\nERROR: --batch-size, --concurrency, --queue-size, --flush-size and --tokenize-batch-size must be at least 1")
+        exit(1)
+    if not 0 <= args.chunk_overlap < args.chunk_size:
+        print("\nERROR: --chunk-overlap must be smaller than --chunk-size")
+        exit(1)
+    if args.prune and not args.sync:
+        print("\nERROR: --prune only works together with --sync")
+        exit(1)
+    if args.ollama_host and not any("embed" in parse_host(host)[1] for host in args.ollama_host):
+        print("\nERROR: at least one --ollama-host must serve embed requests (no =generate)")
         exit(1)
     return args
 
@@ -111,7 +337,7 @@ def parse_args():
 if __name__ == "__main__":
     # Print sample command for user
     print("Sample usage:")
-    print("python chunk_embed_insert.py --db-host <host> --db-name <dbname> --db-user <user> --db-pass <password> --input-file data.jsonl")
+    print("python chunk_embed_insert.py --db-host <host> --db-name <dbname> --db-user <user> --db-pass <password> --wiki <wiki> --input-file data.jsonl")
     args = parse_args()
     pg_conn_params = dict(
         dbname=args.db_name,
@@ -119,30 +345,29 @@ if __name__ == "__main__":
         password=args.db_pass,
         host=args.db_host
     )
-    input_file = args.input_file
-    
-    with jsonlines.open(input_file) as reader:
-        for article in reader:
-            # Insert the article first
-            title = article['title']
-            text = article['text']
-            # Get token ids and token count for full article
-            input_ids = tokenizer.encode(text, add_special_tokens=False)
-            token_count = len(input_ids)
-            
-            # Create metadata with url and any other fields
-            metadata = {'url': article['url']}
-            
-            # Insert article and get its ID
-            article_id = insert_article(title, text, token_count, metadata, pg_conn_params)
-            print(f"Processing article: {title} (ID: {article_id})")
-            
-            # Now process chunks
-            chunks = chunk_tokens(input_ids)
-            for idx, chunk in enumerate(chunks):
-                try:
-                    embedding = get_embedding_ollama(chunk.text)
-                    insert_into_postgres(article_id, idx, chunk.start_token, chunk.end_token, chunk.text, embedding, chunk.end_token - chunk.start_token, pg_conn_params)
-                    print(f"  Inserted chunk {idx+1}/{len(chunks)}")
-                except Exception as e:
-                    print(f"Error processing chunk {idx} for article {title}: {e}")
+    stats = run_pipeline(
+        args.input_file,
+        pg_conn_params,
+        args.wiki,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        queue_size=args.queue_size,
+        model=args.embedding_model,
+        hosts=args.ollama_host or OLLAMA_HOST,
+        flush_size=args.flush_size,
+        sync=args.sync,
+        prune=args.prune,
+        chunking=dict(
+            workers=args.tokenize_workers,
+            batch_size=args.tokenize_batch_size,
+            max_tokens=args.chunk_size,
+            overlap=args.chunk_overlap,
+            min_tail=args.min_tail
+        ),
+        wiki_title=args.wiki_title,
+        snapshots=args.reuse_snapshot
+    )
+    if args.vector_index:
+        # Appending only covers new chunk ids, rebuild when a sync replaced or removed chunks
+        export_index(pg_conn_params, wiki_index_path(args.vector_index, args.wiki), wiki=args.wiki,
+                     full=bool(stats.replaced or stats.deleted))
@@ -0,0 +1,122 @@
+import math
+import os
+from dataclasses import dataclass, fields, replace
+import numpy as np
+
+# Optional stage between retrieval and prompt packing. Retrieved chunks are cut off where their
+# similarity to the query drops away, then re-ordered with maximal marginal relevance so near
+# duplicates don't crowd out other evidence. uvicorn_wrapper.py sets these from its command line
+# arguments, and every setting can be overridden per request.
+SELECTION_ENABLED = os.environ.get("SELECTION_ENABLED", "0") == "1"
+# 1.0 ranks by query similarity only, lower values penalize similarity to chunks already selected
+MMR_LAMBDA = float(os.environ.get("MMR_LAMBDA", "0.7"))
+# Drop candidates whose similarity is below this fraction of the best candidate's
+MIN_RELATIVE_SIMILARITY = float(os.environ.get("MIN_RELATIVE_SIMILARITY", "0.8"))
+# Cut the ranking at the first drop in similarity larger than this between neighbouring candidates
+SCORE_GAP = float(os.environ.get("SCORE_GAP", "0.1"))
+# The cutoffs never leave fewer candidates than this
+MIN_SELECTED = int(os.environ.get("MIN_SELECTED", "5"))
+# Upper bound on selected chunks, 0 for no limit beyond the context budget
+MAX_SELECTED = int(os.environ.get("MAX_SELECTED", "0"))
+
+@dataclass(frozen=True)
+class SelectionSettings:
+    enabled: bool = SELECTION_ENABLED
+    mmr_lambda: float = MMR_LAMBDA
+    min_relative_similarity: float = MIN_RELATIVE_SIMILARITY
+    score_gap: float = SCORE_GAP
+    min_selected: int = MIN_SELECTED
+    max_selected: int = MAX_SELECTED
+
+    def with_overrides(self, overrides):
+        """Return a copy with the non-None values of an overrides dict. Raises ValueError for
+        unknown keys and for values that aren't of the setting's type (numbers may be strings)."""
+        if not overrides:
+            return self
+        if not isinstance(overrides, dict):
+            raise ValueError("Selection overrides must be an object of settings.")
+        types = {field.name: field.type for field in fields(self)}
+        unknown = set(overrides) - set(types)
+        if unknown:
+            raise ValueError(f"Unknown selection setting(s) {', '.join(sorted(unknown))}, use {', '.join(types)}.")
+        return replace(self, **{k: _coerce(k, types[k], v) for k, v in overrides.items() if v is not None})
+
+EXPECTED = {bool: "true or false", float: "a number", int: "a whole number"}
+
+def _coerce(name, kind, value):
+    # Overrides come from request JSON, they are hashed into cache keys and end up in NumPy math
+    if kind is bool:
+        if isinstance(value, bool):
+            return value
+    elif isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        try:
+            number = float(value)
+        except ValueError:
+            number = math.nan
+        if math.isfinite(number) and (kind is float or number.is_integer()):
+            return kind(number)
+    raise ValueError(f"Selection setting {name} must be {EXPECTED[kind]}, got {value!r}.")
+
+DEFAULT_SETTINGS = SelectionSettings()
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+def adaptive_cutoff(similarities, min_relative_similarity, score_gap, min_selected=1):
+    """Number of leading candidates to keep, given similarities sorted best first."""
+    n = len(similarities)
+    if n <= min_selected:
+        return n
+    keep = n
+    best = similarities[0]
+    if min_relative_similarity > 0 and best > 0:
+        keep = int(np.count_nonzero(similarities >= best * min_relative_similarity))
+    if score_gap > 0:
+        gaps = np.flatnonzero(similarities[:-1] - similarities[1:] > score_gap)
+        if len(gaps):
+            keep = min(keep, int(gaps[0]) + 1)
+    return max(keep, min_selected)
+
+def mmr_order(query, candidates, mmr_lambda, limit=None):
+    """Indices of candidates in maximal marginal relevance order.
+
+    query and candidates must be L2-normalized. The candidate Gram matrix is computed once and
+    each step only updates a running maximum of similarity to the selected set.
+    """
+    n = len(candidates)
+    limit = n if not limit else min(limit, n)
+    relevance = candidates @ query
+    gram = candidates @ candidates.T
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    order = []
+    for _ in range(limit):
+        if order:
+            scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        chosen = int(np.argmax(scores))
+        order.append(chosen)
+        available[chosen] = False
+        np.maximum(redundancy, gram[chosen], out=redundancy)
+    return order
+
+def select_chunks(chunks, query_embedding, settings=DEFAULT_SETTINGS):
+    """Apply the adaptive cutoff and MMR to retrieved chunks, which must carry an "embedding".
+
+    Chunks come back in the order they should be packed into the prompt, each with its query
+    similarity as "score".
+    """
+    if not chunks:
+        return []
+    matrix = _normalize(np.asarray([chunk["embedding"] for chunk in chunks], dtype=np.float32))
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+    similarities = matrix @ query
+    ranking = np.argsort(-similarities, kind="stable")
+    keep = adaptive_cutoff(similarities[ranking], settings.min_relative_similarity, settings.score_gap,
+                           settings.min_selected)
+    ranking = ranking[:keep]
+    order = mmr_order(query, matrix[ranking], settings.mmr_lambda, settings.max_selected)
+    return [dict(chunks[ranking[i]], score=float(similarities[ranking[i]])) for i in order]
@@ -0,0 +1,222 @@
+import io
+import json
+import re
+import struct
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from vector_codec import encode_vector, encode_halfvec, reduce_embedding
+
+# Binary COPY framing, see https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+_NULL = struct.pack(">i", -1)
+
+CHUNK_COLUMNS = ("wiki", "article_id", "chunk_index", "chunk_start_token", "chunk_end_token",
+                 "content", "embedding", "token_count")
+# Filled alongside embedding when the database has been migrated for ANN retrieval
+ANN_COLUMN = "embedding_ann"
+
+def _int4(value):
+    return _NULL if value is None else struct.pack(">ii", 4, value)
+
+def _bytes(value):
+    return _NULL if value is None else struct.pack(">i", len(value)) + value
+
+def _text(value):
+    return _NULL if value is None else _bytes(value.encode("utf-8"))
+
+def chunk_copy_buffer(wiki, rows, with_ann):
+    """Binary COPY data for CHUNK_COLUMNS (plus ANN_COLUMN when with_ann) from rows of
+    (article_id, chunk_index, start_token, end_token, content, embedding, token_count)."""
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    field_count = struct.pack(">h", len(CHUNK_COLUMNS) + (1 if with_ann else 0))
+    wiki = _text(wiki)
+    for article_id, chunk_index, start_token, end_token, content, embedding, token_count in rows:
+        buf.write(field_count)
+        buf.write(wiki)
+        buf.write(_int4(article_id))
+        buf.write(_int4(chunk_index))
+        buf.write(_int4(start_token))
+        buf.write(_int4(end_token))
+        buf.write(_text(content))
+        buf.write(_bytes(encode_vector(embedding)))
+        buf.write(_int4(token_count))
+        if with_ann:
+            buf.write(_bytes(encode_halfvec(reduce_embedding(embedding))))
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+# Column order of article_copy_buffer
+ARTICLE_COLUMNS = ("article_id", "wiki", "title", "full_content", "token_count", "metadata")
+
+def article_copy_buffer(wiki, rows):
+    """Binary COPY data for ARTICLE_COLUMNS from rows of (article_id, title, full_content, token_count, metadata_json)."""
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    field_count = struct.pack(">h", len(ARTICLE_COLUMNS))
+    wiki = _text(wiki)
+    for article_id, title, content, token_count, metadata in rows:
+        buf.write(field_count)
+        buf.write(_int4(article_id))
+        buf.write(wiki)
+        buf.write(_text(title))
+        buf.write(_text(content))
+        buf.write(_int4(token_count))
+        # jsonb's binary format is a version byte followed by the json text
+        buf.write(_NULL if metadata is None else _bytes(b"\x01" + metadata.encode("utf-8")))
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+def partition_name(wiki):
+    # chunks is list-partitioned by wiki, one chunks_<wiki> table per wiki
+    slug = re.sub(r"[^a-z0-9]+", "_", wiki.lower()).strip("_")
+    if not slug:
+        raise ValueError(f"Wiki name '{wiki}' has no letters or digits.")
+    return f"chunks_{slug}"[:63]
+
+def register_wiki(cur, wiki, title=None):
+    """Add wiki to the wikis table and create its chunks partition if needed. Returns the partition name."""
+    partition = partition_name(wiki)
+    cur.execute("SELECT wiki FROM wikis WHERE chunk_partition = %s AND wiki <> %s", (partition, wiki))
+    clash = cur.fetchone()
+    if clash:
+        raise ValueError(f"Wiki '{wiki}' would share the chunks partition {partition} with wiki '{clash[0]}'.")
+    cur.execute("""
+        INSERT INTO wikis (wiki, title, chunk_partition) VALUES (%s, %s, %s)
+        ON CONFLICT (wiki) DO UPDATE SET title = COALESCE(%s, wikis.title)
+    """, (wiki, title or wiki, partition, title))
+    cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF chunks FOR VALUES IN ({})").format(
+        sql.Identifier(partition), sql.Literal(wiki)))
+    return partition
+
+def has_column(conn, table, column):
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                (table, column)
+            )
+            return cur.fetchone() is not None
+
+class ArticleRef:
+    """Handle for a buffered article, article_id is filled in when the article is flushed."""
+    __slots__ = ("article_id",)
+
+    def __init__(self):
+        self.article_id = None
+
+class ChunkWriter:
+    """Buffers articles and chunks and writes them over one persistent connection.
+
+    Articles are inserted with a single multi-row INSERT ... RETURNING per flush, chunks are
+    streamed with binary COPY, and both happen in the same transaction. An article that
+    replaces existing rows keeps the first existing article_id; its old chunks are deleted in
+    the same transaction that copies the new ones, as long as they are added together with
+    add_chunks. A writer belongs to one wiki, whose chunks partition is created when needed.
+    """
+
+    def __init__(self, db_params, wiki, flush_size=512, wiki_title=None):
+        self.conn = psycopg2.connect(**db_params)
+        self.wiki = wiki
+        self.flush_size = flush_size
+        with self.conn:
+            with self.conn.cursor() as cur:
+                register_wiki(cur, wiki, wiki_title)
+        self.columns = CHUNK_COLUMNS + ((ANN_COLUMN,) if has_column(self.conn, "chunks", ANN_COLUMN) else ())
+        self._articles = []
+        self._chunks = []
+        self._deleted_articles = []
+
+    def existing_articles(self):
+        """Return {title: [(article_id, content_hash), ...]} for the articles of this wiki already stored."""
+        existing = {}
+        with self.conn:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT article_id, title, metadata->>'content_hash' FROM articles WHERE wiki = %s ORDER BY article_id",
+                            (self.wiki,))
+                for article_id, title, content_hash in cur:
+                    existing.setdefault(title, []).append((article_id, content_hash))
+        return existing
+
+    def add_article(self, title, content, token_count, metadata, replaces=None) -> ArticleRef:
+        ref = ArticleRef()
+        self._articles.append((ref, title, content, token_count, metadata, list(replaces or ())))
+        # A replacement must not be flushed apart from its chunks, see add_chunks
+        if not replaces and len(self._articles) >= self.flush_size:
+            self.flush()
+        return ref
+
+    def add_chunk(self, ref, chunk_index, start_token, end_token, content, embedding, token_count):
+        self.add_chunks(ref, [(chunk_index, start_token, end_token, content, embedding, token_count)])
+
+    def add_chunks(self, ref, rows):
+        """Buffer rows of (chunk_index, start_token, end_token, content, embedding, token_count)."""
+        self._chunks.extend((ref, *row) for row in rows)
+        if len(self._chunks) >= self.flush_size or len(self._articles) >= self.flush_size:
+            self.flush()
+
+    def delete_articles(self, article_ids):
+        # Chunks go with them through ON DELETE CASCADE
+        self._deleted_articles.extend(article_ids)
+
+    def flush(self):
+        """Write everything buffered in one transaction, returns (articles, chunks) written."""
+        if not self._articles and not self._chunks and not self._deleted_articles:
+            return 0, 0
+        articles, chunks, deleted = self._articles, self._chunks, self._deleted_articles
+        new_articles = [a for a in articles if not a[5]]
+        replacements = [a for a in articles if a[5]]
+        with self.conn:
+            with self.conn.cursor() as cur:
+                stale = deleted + [article_id for *_, replaces in replacements for article_id in replaces[1:]]
+                if stale:
+                    cur.execute("DELETE FROM articles WHERE article_id = ANY(%s)", (stale,))
+                if new_articles:
+                    ids = execute_values(
+                        cur,
+                        "INSERT INTO articles (wiki, title, full_content, token_count, metadata) VALUES %s RETURNING article_id",
+                        [(self.wiki, title, content, token_count, json.dumps(metadata)) for _, title, content, token_count, metadata, _ in new_articles],
+                        page_size=len(new_articles),
+                        fetch=True
+                    )
+                    for (ref, *_), (article_id,) in zip(new_articles, ids):
+                        ref.article_id = article_id
+                if replacements:
+                    for ref, title, content, token_count, metadata, replaces in replacements:
+                        ref.article_id = replaces[0]
+                        cur.execute(
+                            "UPDATE articles SET title = %s, full_content = %s, token_count = %s, metadata = %s WHERE article_id = %s",
+                            (title, content, token_count, json.dumps(metadata), ref.article_id)
+                        )
+                    cur.execute("DELETE FROM chunks WHERE wiki = %s AND article_id = ANY(%s)",
+                                (self.wiki, [ref.article_id for ref, *_ in replacements]))
+                if chunks:
+                    cur.copy_expert(
+                        f"COPY chunks ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT binary)",
+                        self._encode_chunks(chunks)
+                    )
+        self._articles, self._chunks, self._deleted_articles = [], [], []
+        return len(articles), len(chunks)
+
+    def _encode_chunks(self, chunks):
+        rows = ((ref.article_id, *row) for ref, *row in chunks)
+        return chunk_copy_buffer(self.wiki, rows, ANN_COLUMN in self.columns)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.close()
@@ -0,0 +1,118 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+from transformers import AutoTokenizer
+
+TOKENIZER_NAME = "Qwen/Qwen3-Embedding-8B"
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 128
+# A trailing window this short is folded into the previous chunk instead of becoming its own chunk
+MIN_TAIL_TOKENS = 15
+
+@lru_cache(maxsize=None)
+def get_tokenizer():
+    # Loaded on first use, so pool workers each load their own copy
+    return AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+
+@dataclass
+class ArticleChunk:
+    start_token: int
+    end_token: int
+    text: str
+    # Character range of text within the article, when chunked from offsets
+    start_char: Optional[int] = None
+    end_char: Optional[int] = None
+
+def chunk_spans(n_tokens: int, max_tokens: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                min_tail: int = MIN_TAIL_TOKENS) -> List[tuple]:
+    """Return the (start_token, end_token) windows for an article of n_tokens tokens."""
+    step = max_tokens - overlap
+    spans = []
+    i = 0
+    while i < n_tokens:
+        end = min(i + max_tokens, n_tokens)
+        if spans and end - i <= min_tail:
+            # Merge the short tail into the previous chunk
+            spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+        else:
+            spans.append((i, end))
+        i += step
+    return spans
+
+# Chunk token ids into 512-token chunks with 128-token overlap, decoding every window.
+# Kept for callers that only have token ids, ingest uses the offset-mapped tokenize_articles.
+def chunk_tokens(input_ids: List[int], max_tokens: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                 min_tail: int = MIN_TAIL_TOKENS) -> List[ArticleChunk]:
+    tokenizer = get_tokenizer()
+    return [
+        ArticleChunk(start_token=start, end_token=end,
+                     text=tokenizer.decode(input_ids[start:end], skip_special_tokens=True))
+        for start, end in chunk_spans(len(input_ids), max_tokens, overlap, min_tail)
+    ]
+
+def tokenize_batch(texts: List[str], max_tokens: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                   min_tail: int = MIN_TAIL_TOKENS) -> List[tuple]:
+    """Tokenize texts in one batched call and return (token_count, spans) per text.
+
+    Each span is (start_token, end_token, start_char, end_char), the character range comes from
+    the fast tokenizer's offset mapping so chunk text can be sliced out of the source string.
+    """
+    encodings = get_tokenizer()(texts, add_special_tokens=False, return_offsets_mapping=True,
+                                return_attention_mask=False)
+    results = []
+    for offsets in encodings["offset_mapping"]:
+        spans = chunk_spans(len(offsets), max_tokens, overlap, min_tail)
+        results.append((len(offsets), [(start, end, offsets[start][0], offsets[end - 1][1]) for start, end in spans]))
+    return results
+
+def chunks_from_spans(text: str, spans: List[tuple]) -> List[ArticleChunk]:
+    return [
+        ArticleChunk(start_token=start, end_token=end, text=text[start_char:end_char],
+                     start_char=start_char, end_char=end_char)
+        for start, end, start_char, end_char in spans
+    ]
+
+def tokenize_articles(items, workers=0, batch_size=32, max_tokens=CHUNK_SIZE, overlap=CHUNK_OVERLAP,
+                      min_tail=MIN_TAIL_TOKENS):
+    """Yield (payload, token_count, chunks) for every (payload, text) of an iterable, in input order.
+
+    Texts are tokenized in batches. With workers > 0 the batches run on a process pool, with at
+    most two batches per worker in flight so a large input file is never fully buffered. Only
+    the texts are sent to the workers, payloads stay in this process.
+    """
+    def batches():
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def emit(batch, results):
+        for (payload, text), (token_count, spans) in zip(batch, results):
+            yield payload, token_count, chunks_from_spans(text, spans)
+
+    def texts(batch):
+        return [text for _, text in batch]
+
+    if workers <= 0:
+        for batch in batches():
+            yield from emit(batch, tokenize_batch(texts(batch), max_tokens, overlap, min_tail))
+        return
+
+    # spawn keeps the Rust tokenizer's thread pool out of forked children
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        in_flight = deque()
+        for batch in batches():
+            in_flight.append((batch, pool.submit(tokenize_batch, texts(batch), max_tokens, overlap, min_tail)))
+            if len(in_flight) >= workers * 2:
+                done_batch, future = in_flight.popleft()
+                yield from emit(done_batch, future.result())
+        while in_flight:
+            done_batch, future = in_flight.popleft()
+            yield from emit(done_batch, future.result())
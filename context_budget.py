@@ -0,0 +1,158 @@
+import asyncio
+import math
+import os
+import re
+import time
+from dataclasses import dataclass
+from metrics import PREFILL_RATE_ESTIMATE
+
+# Sizes each query's context from the model's real context window and a latency target instead
+# of always filling a fixed 39k tokens. The window comes from Ollama's /api/show, prefill speed
+# is learned from the stats of finished generations, and a target of N seconds to the first
+# token becomes a context of about N * prefill speed tokens. uvicorn_wrapper.py sets these from
+# its command line arguments.
+
+# Used when /api/show doesn't report a context window
+FALLBACK_CONTEXT_WINDOW = int(os.environ.get("FALLBACK_CONTEXT_WINDOW", "40960"))
+# Tokens of the window left free for the answer, at most a quarter of a small window
+ANSWER_RESERVE_TOKENS = int(os.environ.get("ANSWER_RESERVE_TOKENS", "2000"))
+# Smallest num_ctx a request may ask for, room for the prompt template, the question, a chunk and a short answer
+MIN_NUM_CTX = 1024
+# Never plan a context smaller than this, however tight the target, unless the window itself is smaller
+MIN_CONTEXT_TOKENS = int(os.environ.get("MIN_CONTEXT_TOKENS", "2000"))
+# Prefill tokens/second assumed until generations have been observed
+PREFILL_TPS = float(os.environ.get("PREFILL_TPS", "1000"))
+# Named latency targets, seconds to the first token (0 fills the whole window)
+FAST_TARGET_SECONDS = float(os.environ.get("FAST_TARGET_SECONDS", "5"))
+THOROUGH_TARGET_SECONDS = float(os.environ.get("THOROUGH_TARGET_SECONDS", "0"))
+DEFAULT_LATENCY_TARGET = os.environ.get("DEFAULT_LATENCY_TARGET", "thorough")
+# Chunks retrieved per chunk that fits the context, the rest leave room for selection and skipping
+RETRIEVAL_OVERSAMPLE = float(os.environ.get("RETRIEVAL_OVERSAMPLE", "3"))
+MAX_TOP_K = int(os.environ.get("MAX_TOP_K", "300"))
+
+# A 512 token chunk adds ~384 tokens once its 128 token overlap with a neighbour is merged
+TOKENS_PER_CHUNK_ESTIMATE = 384
+# Prompts shorter than this are dominated by per-request overhead and say little about throughput
+MIN_PREFILL_SAMPLE_TOKENS = 256
+PREFILL_TPS_SMOOTHING = 0.2
+# A failed /api/show is retried after this many seconds, the fallback window is used meanwhile
+SHOW_RETRY_SECONDS = 60
+
+NUM_CTX_RE = re.compile(r"^\s*num_ctx\s+(\d+)", re.MULTILINE)
+
+def context_window(show):
+    """num_ctx of an /api/show response: the Modelfile parameter, else the model's trained context length."""
+    match = NUM_CTX_RE.search(show.get("parameters") or "")
+    if match:
+        return int(match.group(1))
+    for key, value in (show.get("model_info") or {}).items():
+        if key.endswith(".context_length"):
+            return int(value)
+    return None
+
+@dataclass(frozen=True)
+class ContextPlan:
+    # Prompt tokens this request may use, context included
+    context_tokens: int
+    # Prompt tokens the context window allows, whatever the latency target
+    max_tokens: int
+    # Context window the request is sent with, so Ollama doesn't truncate the packed prompt
+    num_ctx: int
+    top_k: int
+    latency_target: object
+    target_seconds: float
+    prefill_tps: float
+
+class ContextPlanner:
+    def __init__(self, model, fetch_show, default_target=DEFAULT_LATENCY_TARGET, prefill_tps=PREFILL_TPS):
+        self.model = model
+        self._fetch_show = fetch_show
+        self.default_target = default_target
+        self.prefill_tps = prefill_tps
+        self.samples = 0
+        self.window = None
+        self._show_failed_at = None
+        self._lock = asyncio.Lock()
+        PREFILL_RATE_ESTIMATE.set(prefill_tps)
+
+    async def context_window(self):
+        if self.window is not None:
+            return self.window
+        if self._show_failed_at is not None and time.monotonic() - self._show_failed_at < SHOW_RETRY_SECONDS:
+            return FALLBACK_CONTEXT_WINDOW
+        async with self._lock:
+            if self.window is None:
+                try:
+                    self.window = context_window(await self._fetch_show(self.model)) or FALLBACK_CONTEXT_WINDOW
+                    print(f"Context window of {self.model}: {self.window} tokens")
+                except Exception as e:
+                    self._show_failed_at = time.monotonic()
+                    print(f"⚠️ Could not read the context window of {self.model} ({e}), using {FALLBACK_CONTEXT_WINDOW}")
+                    return FALLBACK_CONTEXT_WINDOW
+        return self.window
+
+    @staticmethod
+    def target_seconds(target):
+        if target == "fast":
+            return FAST_TARGET_SECONDS
+        if target == "thorough":
+            return THOROUGH_TARGET_SECONDS
+        try:
+            return max(0.0, float(target))
+        except (TypeError, ValueError):
+            raise ValueError(f"Unknown latency target '{target}', use 'fast', 'thorough' or seconds.")
+
+    async def plan(self, overrides=None):
+        """Plan a request's context from overrides {"latency_target": "fast"|"thorough"|seconds,
+        "num_ctx": tokens}, missing values use the configured defaults."""
+        overrides = overrides or {}
+        target = overrides.get("latency_target")
+        if target is None:
+            # An explicit 0 fills the whole window, only a missing target falls back to the default
+            target = self.default_target
+        seconds = self.target_seconds(target)
+        window = await self.context_window()
+        if overrides.get("num_ctx"):
+            window = min(window, int(overrides["num_ctx"]))
+        # The prompt and the answer have to share the window Ollama is sent, or it truncates the prompt
+        max_tokens = window - min(ANSWER_RESERVE_TOKENS, window // 4)
+        context_tokens = max_tokens
+        if seconds > 0:
+            context_tokens = min(max_tokens, max(MIN_CONTEXT_TOKENS, int(self.prefill_tps * seconds)))
+        top_k = min(MAX_TOP_K, math.ceil(context_tokens / TOKENS_PER_CHUNK_ESTIMATE * RETRIEVAL_OVERSAMPLE))
+        return ContextPlan(context_tokens, max_tokens, window, top_k, target, seconds, self.prefill_tps)
+
+    def observe(self, done_part):
+        """Update the prefill speed estimate from Ollama's final stream message."""
+        count = done_part.get("prompt_eval_count") or 0
+        duration = done_part.get("prompt_eval_duration") or 0
+        if count < MIN_PREFILL_SAMPLE_TOKENS or duration <= 0:
+            return
+        rate = count / (duration / 1e9)
+        if self.samples == 0:
+            self.prefill_tps = rate
+        else:
+            self.prefill_tps += PREFILL_TPS_SMOOTHING * (rate - self.prefill_tps)
+        self.samples += 1
+        PREFILL_RATE_ESTIMATE.set(self.prefill_tps)
+
+    def stats(self):
+        return {"model": self.model, "context_window": self.window, "prefill_tps": round(self.prefill_tps, 1),
+                "samples": self.samples, "default_latency_target": self.default_target}
+
+_planner = None
+
+def init_context_planner(model, fetch_show, **kwargs):
+    global _planner
+    if _planner is None:
+        _planner = ContextPlanner(model, fetch_show, **kwargs)
+    return _planner
+
+def get_context_planner():
+    if _planner is None:
+        raise RuntimeError("Context planner is not initialized, call init_context_planner() first.")
+    return _planner
+
+def close_context_planner():
+    global _planner
+    _planner = None
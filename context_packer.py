@@ -0,0 +1,113 @@
+import math
+
+# Packs retrieved chunks into the prompt's token budget without calling the tokenizer. Chunk
+# token counts and token ranges are stored at ingest, and neighbouring chunks of an article
+# share CHUNK_OVERLAP tokens, so chunks of the same article that overlap or touch are merged
+# into one span and the shared text is only sent (and counted) once.
+
+# Conservative bytes per token, only used for text that has no stored token count (the query)
+BYTES_PER_TOKEN_ESTIMATE = 3
+# Tokens for the "\n\n" that separates spans in the prompt
+SPAN_SEPARATOR_TOKENS = 1
+
+def estimate_tokens(text):
+    return math.ceil(len(text.encode("utf-8")) / BYTES_PER_TOKEN_ESTIMATE)
+
+def join_overlapping(left, right):
+    """Return left + right without the suffix of left that right starts with, or None unless
+    exactly one suffix of left is a prefix of right.
+
+    Repetitive text (lists, tables, infobox rows) can have several suffixes that match, and only
+    one of them is the real overlap, so an ambiguous join is refused rather than guessed.
+    """
+    if not right:
+        return left
+    first = right[0]
+    matches = []
+    idx = left.find(first, max(0, len(left) - len(right)))
+    while idx != -1:
+        if right.startswith(left[idx:]):
+            matches.append(idx)
+            if len(matches) > 1:
+                return None
+        idx = left.find(first, idx + 1)
+    if not matches:
+        return None
+    return left + right[len(left) - matches[0]:]
+
+def _chunk_tokens(chunk):
+    if chunk.get("token_count") is not None:
+        return chunk["token_count"]
+    if chunk.get("chunk_start_token") is not None and chunk.get("chunk_end_token") is not None:
+        return chunk["chunk_end_token"] - chunk["chunk_start_token"]
+    return estimate_tokens(chunk["content"])
+
+def _span(chunk, rank):
+    return {
+        "article_id": chunk["article_id"],
+        "chunk_ids": [chunk["chunk_id"]],
+        "start_token": chunk.get("chunk_start_token"),
+        "end_token": chunk.get("chunk_end_token"),
+        "content": chunk["content"],
+        "token_count": _chunk_tokens(chunk),
+        "rank": rank
+    }
+
+def _merge(spans):
+    """Merge spans of one article that overlap or touch, sorted by start_token. Returns None if
+    their text doesn't line up unambiguously (e.g. chunks written by an older chunker, or
+    repetitive text), the chunks are then packed as separate spans."""
+    merged = dict(spans[0], chunk_ids=list(spans[0]["chunk_ids"]))
+    for span in spans[1:]:
+        if span["end_token"] <= merged["end_token"]:
+            content = merged["content"]
+        elif span["start_token"] == merged["end_token"]:
+            content = merged["content"] + span["content"]
+        else:
+            content = join_overlapping(merged["content"], span["content"])
+            if content is None:
+                return None
+        merged["content"] = content
+        merged["end_token"] = max(merged["end_token"], span["end_token"])
+        merged["chunk_ids"] += span["chunk_ids"]
+        merged["rank"] = min(merged["rank"], span["rank"])
+    merged["token_count"] = merged["end_token"] - merged["start_token"]
+    return merged
+
+def pack_chunks(chunks, budget):
+    """Fill budget tokens with chunks, taken in relevance order.
+
+    Returns (spans, used_tokens). Each span is a dict with article_id, chunk_ids, start_token,
+    end_token, content, token_count and rank (the best rank among its chunks); spans come in
+    rank order. A chunk is only paid for with the tokens it adds to what is already packed, so
+    a chunk that is fully covered costs nothing and one that would not fit is skipped while
+    smaller additions further down the list can still be packed.
+    """
+    spans = []
+    used = 0
+    for rank, chunk in enumerate(chunks):
+        span = _span(chunk, rank)
+        touching = []
+        if span["start_token"] is not None and span["end_token"] is not None:
+            touching = [
+                other for other in spans
+                if other["article_id"] == span["article_id"] and other["start_token"] is not None
+                and other["start_token"] <= span["end_token"] and span["start_token"] <= other["end_token"]
+            ]
+        if touching:
+            merged = _merge(sorted(touching + [span], key=lambda s: (s["start_token"], -s["end_token"])))
+            if merged is not None:
+                added = merged["token_count"] - sum(other["token_count"] for other in touching)
+                added -= SPAN_SEPARATOR_TOKENS * (len(touching) - 1)
+                if used + added > budget:
+                    continue
+                spans = [other for other in spans if not any(other is t for t in touching)]
+                spans.append(merged)
+                used += added
+                continue
+        if used + span["token_count"] + SPAN_SEPARATOR_TOKENS > budget:
+            continue
+        spans.append(span)
+        used += span["token_count"] + SPAN_SEPARATOR_TOKENS
+    spans.sort(key=lambda s: s["rank"])
+    return spans, used
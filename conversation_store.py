@@ -0,0 +1,103 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+# Conversation-aware /api/chat, uvicorn_wrapper.py sets these from its command line arguments.
+# The messages sent to Ollama for a conversation are kept, so a follow-up question only appends
+# a user message (with the chunks that weren't in the context yet) to an unchanged prefix and
+# Ollama can reuse the KV cache of everything before it.
+CONVERSATIONS_ENABLED = os.environ.get("CONVERSATIONS_ENABLED", "0") == "1"
+# Conversations idle for longer than this (seconds) are dropped
+CONVERSATION_IDLE_TTL = float(os.environ.get("CONVERSATION_IDLE_TTL", "1800"))
+CONVERSATION_MAX_ENTRIES = int(os.environ.get("CONVERSATION_MAX_ENTRIES", "256"))
+# Context tokens packed on the first turn, the rest of the budget is left for follow-ups
+CONVERSATION_FIRST_TURN_TOKENS = int(os.environ.get("CONVERSATION_FIRST_TURN_TOKENS", "24000"))
+# New context tokens added by each follow-up question
+CONVERSATION_TURN_TOKENS = int(os.environ.get("CONVERSATION_TURN_TOKENS", "4000"))
+
+def conversation_key(wiki, messages):
+    """Key of a conversation from its messages so far, as sent by the chat client.
+
+    Clients resend the whole history every turn, so the history before the new question is the
+    key under which the previous turn was stored.
+    """
+    digest = hashlib.sha256(wiki.encode("utf-8"))
+    for message in messages:
+        digest.update(b"\0" + message["role"].encode("utf-8") + b"\0" + message["content"].strip().encode("utf-8"))
+    return digest.hexdigest()
+
+@dataclass
+class Conversation:
+    wiki: str
+    # Messages sent to Ollama so far, the system message with the first turn's context first
+    messages: list
+    chunk_ids: frozenset
+    # Estimated prompt tokens of messages
+    tokens: int
+    turns: int
+    last_used: float = field(default_factory=time.monotonic)
+
+class ConversationStore:
+    """LRU of conversations by key, dropping conversations idle for longer than idle_ttl.
+
+    Every turn is stored under its own key and the previous turn is kept, so a regenerated
+    answer continues from the same state as the original.
+    """
+
+    def __init__(self, max_entries=CONVERSATION_MAX_ENTRIES, idle_ttl=CONVERSATION_IDLE_TTL):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def _expire(self, now):
+        while self._entries:
+            key, conversation = next(iter(self._entries.items()))
+            if now - conversation.last_used <= self.idle_ttl:
+                break
+            del self._entries[key]
+            self.evictions += 1
+
+    def get(self, key):
+        now = time.monotonic()
+        self._expire(now)
+        conversation = self._entries.get(key)
+        if conversation is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        conversation.last_used = now
+        self._entries.move_to_end(key)
+        return conversation
+
+    def put(self, key, conversation):
+        self._expire(conversation.last_used)
+        self._entries[key] = conversation
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+_store = None
+
+def init_conversation_store(**kwargs):
+    global _store
+    if _store is None and CONVERSATIONS_ENABLED:
+        _store = ConversationStore(**kwargs)
+    return _store
+
+def get_conversation_store():
+    # Optional, /api/chat answers only the last message when it is disabled
+    return _store
+
+def close_conversation_store():
+    global _store
+    _store = None
@@ -0,0 +1,321 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+import numpy as np
+import psycopg2
+from chunk_writer import (ANN_COLUMN, ARTICLE_COLUMNS, CHUNK_COLUMNS, article_copy_buffer, chunk_copy_buffer,
+                          has_column, register_wiki)
+from vector_codec import decode_vector
+
+# Columnar snapshots of a corpus, for moving wikis between databases and for ingesting again
+# without re-embedding. A snapshot is a directory:
+#   manifest.json     format version, embedding model, dimensions, wikis and row counts
+#   articles.parquet  one row per article, metadata as a JSON string
+#   chunks.parquet    one row per chunk, row i of the table is row i of embeddings.f32
+#   embeddings.f32    count x dim little-endian float32 matrix, memory-mapped when read
+#   keys.npy          sorted embedding keys, sha256 of the model and the chunk text
+#   key_rows.npy      embeddings.f32 row of every key
+#
+# Ingest only needs the key index and the matrix, which are read with numpy. pyarrow is imported
+# when a snapshot is written or loaded into Postgres.
+
+SNAPSHOT_FORMAT = 1
+OLLAMA_EMBEDDING_MODEL = "dengcao/Qwen3-Embedding-8B:Q8_0"
+
+def embedding_key(model, text):
+    return hashlib.sha256(model.encode("utf-8") + b"\0" + text.encode("utf-8")).digest()
+
+def _files(path):
+    return {name: os.path.join(path, name) for name in
+            ("manifest.json", "articles.parquet", "chunks.parquet", "embeddings.f32", "keys.npy", "key_rows.npy")}
+
+def read_manifest(path):
+    with open(_files(path)["manifest.json"]) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format')} in {path}.")
+    return manifest
+
+def _schemas():
+    import pyarrow as pa
+    articles = pa.schema([
+        ("wiki", pa.string()), ("article_id", pa.int32()), ("title", pa.string()), ("full_content", pa.string()),
+        ("token_count", pa.int32()), ("metadata", pa.string())
+    ])
+    chunks = pa.schema([
+        ("wiki", pa.string()), ("chunk_id", pa.int64()), ("article_id", pa.int32()), ("chunk_index", pa.int32()),
+        ("chunk_start_token", pa.int32()), ("chunk_end_token", pa.int32()), ("content", pa.string()),
+        ("token_count", pa.int32()), ("embedding_key", pa.binary(32))
+    ])
+    return articles, chunks
+
+def export_snapshot(db_params, path, wikis=None, model=OLLAMA_EMBEDDING_MODEL, batch_size=2000):
+    """Write the articles and embedded chunks of wikis (every wiki when None) to a new snapshot at path.
+
+    The snapshot is written next to path and renamed into place once complete. model names the
+    embedding model the stored embeddings came from, ingest only reuses them for that model.
+    Returns the manifest.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if os.path.exists(path):
+        raise FileExistsError(f"Snapshot path {path} already exists.")
+    partial = path.rstrip(os.sep) + ".partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    files = _files(partial)
+    articles_schema, chunks_schema = _schemas()
+    started = time.perf_counter()
+
+    conn = psycopg2.connect(**db_params)
+    # Every read below sees one snapshot of the database, so an ingest committing in between
+    # can't add chunks whose article wasn't exported
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT wiki, title FROM wikis WHERE %s IS NULL OR wiki = ANY(%s) ORDER BY wiki",
+                        (wikis, wikis))
+            wiki_titles = dict(cur.fetchall())
+        missing = set(wikis or ()) - set(wiki_titles)
+        if missing:
+            raise ValueError(f"Unknown wiki(s): {', '.join(sorted(missing))}.")
+        selected = list(wiki_titles)
+
+        article_count = 0
+        with conn.cursor(name="snapshot_articles") as cur, \
+                pq.ParquetWriter(files["articles.parquet"], articles_schema) as writer:
+            cur.itersize = batch_size
+            cur.execute("""
+                SELECT wiki, article_id, title, full_content, token_count, metadata::text
+                FROM articles WHERE wiki = ANY(%s) ORDER BY wiki, article_id
+            """, (selected,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                writer.write_table(pa.Table.from_pylist(
+                    [dict(zip(articles_schema.names, row)) for row in rows], schema=articles_schema))
+                article_count += len(rows)
+                print(f"Exported {article_count} articles", end="\r")
+        print()
+
+        chunk_count = 0
+        dim = None
+        keys = []
+        with conn.cursor(name="snapshot_chunks") as cur, \
+                pq.ParquetWriter(files["chunks.parquet"], chunks_schema) as writer, \
+                open(files["embeddings.f32"], "wb") as emb_out:
+            cur.itersize = batch_size
+            cur.execute("""
+                SELECT wiki, chunk_id, article_id, chunk_index, chunk_start_token, chunk_end_token, content,
+                       token_count, vector_send(embedding)
+                FROM chunks WHERE wiki = ANY(%s) AND embedding IS NOT NULL ORDER BY wiki, chunk_id
+            """, (selected,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                vectors = np.stack([decode_vector(bytes(row[8])) for row in rows])
+                dim = dim or vectors.shape[1]
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"Embeddings of {vectors.shape[1]} and {dim} dimensions in one snapshot.")
+                emb_out.write(vectors.astype("<f4").tobytes())
+                batch_keys = [embedding_key(model, row[6]) for row in rows]
+                keys.extend(batch_keys)
+                writer.write_table(pa.Table.from_pylist(
+                    [dict(zip(chunks_schema.names, (*row[:8], key))) for row, key in zip(rows, batch_keys)],
+                    schema=chunks_schema))
+                chunk_count += len(rows)
+                print(f"Exported {chunk_count} chunks", end="\r")
+        print()
+    finally:
+        conn.close()
+
+    # Identical chunk texts share one key, the first row wins
+    keys = np.array(keys, dtype="S32")
+    keys, rows = np.unique(keys, return_index=True)
+    np.save(files["keys.npy"], keys)
+    np.save(files["key_rows.npy"], rows.astype(np.int64))
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "embedding_model": model,
+        "dim": dim,
+        "wikis": wiki_titles,
+        "articles": article_count,
+        "chunks": chunk_count,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    }
+    with open(files["manifest.json"], "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(partial, path)
+    print(f"✅ Snapshot of {len(wiki_titles)} wikis, {article_count} articles and {chunk_count} chunks written to "
+          f"{path} in {time.perf_counter() - started:.1f}s")
+    return manifest
+
+def _reserve_article_ids(cur, count):
+    cur.execute("SELECT nextval(pg_get_serial_sequence('articles', 'article_id')) FROM generate_series(1, %s)",
+                (count,))
+    return [article_id for article_id, in cur.fetchall()]
+
+def import_snapshot(db_params, path, wikis=None, replace=False, batch_size=2000):
+    """Load the wikis (every wiki when None) of the snapshot at path into Postgres with binary COPY.
+
+    Articles get new article_ids and chunks new chunk_ids. A wiki that already has articles is
+    refused unless replace is set, which deletes them first. Everything is loaded in a single
+    transaction. Returns {"articles": n, "chunks": n}.
+    """
+    import pyarrow.parquet as pq
+
+    manifest = read_manifest(path)
+    files = _files(path)
+    selected = set(wikis or manifest["wikis"])
+    missing = selected - set(manifest["wikis"])
+    if missing:
+        raise ValueError(f"Wiki(s) {', '.join(sorted(missing))} are not in snapshot {path}.")
+    started = time.perf_counter()
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        columns = CHUNK_COLUMNS + ((ANN_COLUMN,) if has_column(conn, "chunks", ANN_COLUMN) else ())
+        article_ids = {}  # (wiki, snapshot article_id) -> new article_id
+        counts = {"articles": 0, "chunks": 0}
+        with conn, conn.cursor() as cur:
+            for wiki in sorted(selected):
+                register_wiki(cur, wiki, manifest["wikis"][wiki])
+                cur.execute("SELECT count(*) FROM articles WHERE wiki = %s", (wiki,))
+                existing = cur.fetchone()[0]
+                if existing and not replace:
+                    raise ValueError(f"Wiki '{wiki}' already has {existing} articles, use replace to overwrite them.")
+                if existing:
+                    # Chunks go with them through ON DELETE CASCADE
+                    cur.execute("DELETE FROM articles WHERE wiki = %s", (wiki,))
+                    print(f"Deleted {existing} stored articles of {wiki}")
+
+            for batch in pq.ParquetFile(files["articles.parquet"]).iter_batches(batch_size=batch_size):
+                rows = [row for row in batch.to_pylist() if row["wiki"] in selected]
+                if not rows:
+                    continue
+                new_ids = _reserve_article_ids(cur, len(rows))
+                for row, article_id in zip(rows, new_ids):
+                    article_ids[row["wiki"], row["article_id"]] = article_id
+                for wiki, wiki_rows in itertools.groupby(zip(rows, new_ids), key=lambda pair: pair[0]["wiki"]):
+                    cur.copy_expert(
+                        f"COPY articles ({', '.join(ARTICLE_COLUMNS)}) FROM STDIN WITH (FORMAT binary)",
+                        article_copy_buffer(wiki, [(article_id, row["title"], row["full_content"], row["token_count"],
+                                                    row["metadata"]) for row, article_id in wiki_rows])
+                    )
+                counts["articles"] += len(rows)
+                print(f"Loaded {counts['articles']} articles", end="\r")
+            print()
+
+            embeddings = _open_embeddings(files["embeddings.f32"], manifest)
+            offset = 0
+            for batch in pq.ParquetFile(files["chunks.parquet"]).iter_batches(batch_size=batch_size):
+                rows = batch.to_pylist()
+                vectors = embeddings[offset:offset + len(rows)]
+                offset += len(rows)
+                rows = [(row, vector) for row, vector in zip(rows, vectors) if row["wiki"] in selected]
+                for wiki, wiki_rows in itertools.groupby(rows, key=lambda pair: pair[0]["wiki"]):
+                    cur.copy_expert(
+                        f"COPY chunks ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)",
+                        chunk_copy_buffer(wiki, (
+                            (article_ids[wiki, row["article_id"]], row["chunk_index"], row["chunk_start_token"],
+                             row["chunk_end_token"], row["content"], vector, row["token_count"])
+                            for row, vector in wiki_rows
+                        ), ANN_COLUMN in columns)
+                    )
+                counts["chunks"] += len(rows)
+                print(f"Loaded {counts['chunks']} chunks", end="\r")
+            print()
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"✅ Loaded {counts['articles']} articles and {counts['chunks']} chunks of {', '.join(sorted(selected))} "
+          f"in {elapsed:.1f}s ({counts['chunks'] / elapsed if elapsed > 0 else 0.0:.0f} chunks/sec)")
+    return counts
+
+def _open_embeddings(path, manifest):
+    if not manifest["chunks"]:
+        return np.empty((0, manifest["dim"] or 0), dtype="<f4")
+    return np.memmap(path, dtype="<f4", mode="r", shape=(manifest["chunks"], manifest["dim"]))
+
+class SnapshotEmbeddings:
+    """Embeddings of a snapshot by chunk text, for ingest to reuse instead of calling Ollama."""
+
+    def __init__(self, path):
+        self.path = path
+        manifest = read_manifest(path)
+        files = _files(path)
+        self.model = manifest["embedding_model"]
+        self.embeddings = _open_embeddings(files["embeddings.f32"], manifest)
+        self.keys = np.load(files["keys.npy"], mmap_mode="r")
+        self.rows = np.load(files["key_rows.npy"], mmap_mode="r")
+
+    def lookup(self, texts, model):
+        """Return the stored embedding of every text embedded with model, None where there is none."""
+        found = [None] * len(texts)
+        if model != self.model or not len(self.keys):
+            return found
+        keys = np.array([embedding_key(model, text) for text in texts], dtype="S32")
+        positions = np.searchsorted(self.keys, keys)
+        for i, (key, position) in enumerate(zip(keys, positions)):
+            if position < len(self.keys) and self.keys[position] == key:
+                found[i] = self.embeddings[self.rows[position]]
+        return found
+
+def find_embeddings(snapshots, texts, model):
+    """lookup() across several snapshots, the first snapshot holding a text wins."""
+    found = [None] * len(texts)
+    for snapshot in snapshots:
+        missing = [i for i, embedding in enumerate(found) if embedding is None]
+        if not missing:
+            break
+        for i, embedding in zip(missing, snapshot.lookup([texts[i] for i in missing], model)):
+            found[i] = embedding
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Export wikis to a columnar snapshot or load a snapshot into Postgres.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_db_args(p):
+        p.add_argument('--db-host', required=True, help='PostgreSQL host')
+        p.add_argument('--db-name', required=True, help='PostgreSQL database name')
+        p.add_argument('--db-user', required=True, help='PostgreSQL user')
+        p.add_argument('--db-pass', required=True, help='PostgreSQL password')
+        p.add_argument('--wiki', action='append', help='Only this wiki, repeat for several (defaults to every wiki)')
+        p.add_argument('--batch-size', type=int, default=2000, help='Rows read and written at a time')
+
+    export_parser = subparsers.add_parser("export", help="Write wikis to a new snapshot directory")
+    add_db_args(export_parser)
+    export_parser.add_argument('--embedding-model', default=OLLAMA_EMBEDDING_MODEL,
+                               help='Ollama model the stored embeddings were made with')
+    export_parser.add_argument('path', help='Snapshot directory to create')
+
+    import_parser = subparsers.add_parser("import", help="Load a snapshot into Postgres")
+    add_db_args(import_parser)
+    import_parser.add_argument('--replace', action='store_true', help='Delete the stored articles of wikis in the snapshot first')
+    import_parser.add_argument('path', help='Snapshot directory')
+
+    info_parser = subparsers.add_parser("info", help="Print a snapshot's manifest")
+    info_parser.add_argument('path', help='Snapshot directory')
+
+    args = parser.parse_args()
+    if args.command == "info":
+        print(json.dumps(read_manifest(args.path), indent=2))
+        return
+    db_params = dict(dbname=args.db_name, user=args.db_user, password=args.db_pass, host=args.db_host)
+    if args.command == "export":
+        export_snapshot(db_params, args.path, wikis=args.wiki, model=args.embedding_model, batch_size=args.batch_size)
+    else:
+        import_snapshot(db_params, args.path, wikis=args.wiki, replace=args.replace, batch_size=args.batch_size)
+        print("Chunk ids are new, rebuild any vector index of these wikis with vector_index.py --full.")
+
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,17 @@ END$$;
 -- Table and permission logic (from create_tables.sql)
 CREATE EXTENSION IF NOT EXISTS vector;
 
+-- One row per ingested wiki, each is served as a model named after wiki
+CREATE TABLE IF NOT EXISTS wikis (
+    wiki TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    chunk_partition TEXT NOT NULL UNIQUE,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE TABLE IF NOT EXISTS articles (
     article_id SERIAL PRIMARY KEY,
+    wiki TEXT NOT NULL REFERENCES wikis(wiki) ON DELETE CASCADE,
     title TEXT NOT NULL,
     full_content TEXT NOT NULL,
     token_count INTEGER,
@@ -20,17 +29,32 @@ CREATE TABLE IF NOT EXISTS articles (
     created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE INDEX IF NOT EXISTS articles_wiki_title_idx ON articles (wiki, title);
+
+-- Partitioned by wiki, chunk_embed_insert.py creates a chunks_<wiki> partition for every new wiki
+CREATE SEQUENCE IF NOT EXISTS chunks_chunk_id_seq;
 CREATE TABLE IF NOT EXISTS chunks (
-    chunk_id SERIAL PRIMARY KEY,
+    chunk_id INTEGER NOT NULL DEFAULT nextval('chunks_chunk_id_seq'),
+    wiki TEXT NOT NULL,
     article_id INTEGER NOT NULL REFERENCES articles(article_id) ON DELETE CASCADE,
     chunk_index INTEGER NOT NULL,
     chunk_start_token INTEGER,
     chunk_end_token INTEGER,
     content TEXT NOT NULL,
     embedding VECTOR(4096),
+    -- First 1024 dimensions of embedding, re-normalized; small enough for an HNSW index
+    embedding_ann HALFVEC(1024),
     token_count INTEGER,
-    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
-);
+    -- Lexical side of hybrid retrieval, kept up to date by postgres
+    content_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', content)) STORED,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (wiki, chunk_id)
+) PARTITION BY LIST (wiki);
+ALTER SEQUENCE chunks_chunk_id_seq OWNED BY chunks.chunk_id;
+
+CREATE INDEX IF NOT EXISTS chunks_embedding_ann_idx ON chunks USING hnsw (embedding_ann halfvec_cosine_ops);
+CREATE INDEX IF NOT EXISTS chunks_content_tsv_idx ON chunks USING gin (content_tsv);
+CREATE INDEX IF NOT EXISTS chunks_article_id_idx ON chunks (article_id);
 
 DO $$
 BEGIN
@@ -41,6 +65,9 @@ END$$;
 
 DO $$
 BEGIN
+  IF EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = 'wikis') THEN
+    EXECUTE 'ALTER TABLE wikis OWNER TO "$DB_USER"';
+  END IF;
   IF EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = 'articles') THEN
     EXECUTE 'ALTER TABLE articles OWNER TO "$DB_USER"';
   END IF;
@@ -51,5 +78,6 @@ END$$;
 
 GRANT CONNECT ON DATABASE "$DB_NAME" TO "$DB_USER";
 GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA public TO "$DB_USER";
+GRANT SELECT, INSERT, UPDATE, DELETE ON wikis TO "$DB_USER";
 GRANT SELECT, INSERT, UPDATE, DELETE ON articles TO "$DB_USER";
 GRANT SELECT, INSERT, UPDATE, DELETE ON chunks TO "$DB_USER";
@@ -0,0 +1,162 @@
+import argparse
+import time
+import psycopg2
+from psycopg2 import sql
+from vector_codec import ANN_DIMENSIONS
+from chunk_writer import partition_name
+
+# Schema migrations for databases created before a feature was added to db/init_db.sql.
+# Every step is idempotent, so re-running a migration after an interruption picks up where it left off.
+
+def migrate_ann(conn, batch_size=1000, build_index=True):
+    with conn, conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE chunks ADD COLUMN IF NOT EXISTS embedding_ann HALFVEC({ANN_DIMENSIONS})")
+    backfill_ann(conn, batch_size)
+    if build_index:
+        print("Building HNSW index on chunks.embedding_ann (this can take a while)...")
+        with conn, conn.cursor() as cur:
+            cur.execute("CREATE INDEX IF NOT EXISTS chunks_embedding_ann_idx ON chunks USING hnsw (embedding_ann halfvec_cosine_ops)")
+    print("✅ ANN migration complete.")
+
+def backfill_ann(conn, batch_size=1000):
+    # Same reduction as vector_codec.reduce_embedding, computed server side
+    total = 0
+    started = time.perf_counter()
+    while True:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"""
+                UPDATE chunks
+                SET embedding_ann = l2_normalize(subvector(embedding, 1, {ANN_DIMENSIONS}))::halfvec({ANN_DIMENSIONS})
+                WHERE chunk_id IN (
+                    SELECT chunk_id FROM chunks
+                    WHERE embedding_ann IS NULL AND embedding IS NOT NULL
+                    LIMIT %s
+                )
+            """, (batch_size,))
+            updated = cur.rowcount
+        if not updated:
+            break
+        total += updated
+        print(f"Backfilled {total} chunks ({total / (time.perf_counter() - started):.0f} chunks/sec)", end="\r")
+    print(f"\nBackfilled {total} chunks.")
+
+def migrate_fts(conn):
+    # Adding a stored generated column rewrites the table, the GIN index is built afterwards
+    print("Adding chunks.content_tsv (this rewrites the chunks table)...")
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_tsv TSVECTOR
+            GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
+        """)
+    print("Building GIN index on chunks.content_tsv...")
+    with conn, conn.cursor() as cur:
+        cur.execute("CREATE INDEX IF NOT EXISTS chunks_content_tsv_idx ON chunks USING gin (content_tsv)")
+        cur.execute("CREATE INDEX IF NOT EXISTS chunks_article_id_idx ON chunks (article_id)")
+    print("✅ Full-text migration complete.")
+
+def migrate_wiki(conn, wiki, title=None):
+    """Assign every stored article and chunk to wiki and turn chunks into a table partitioned by wiki.
+
+    The old chunks table is kept as is and attached as the wiki's partition, so nothing is copied.
+    """
+    partition = partition_name(wiki)
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS wikis (
+                wiki TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                chunk_partition TEXT NOT NULL UNIQUE,
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            INSERT INTO wikis (wiki, title, chunk_partition) VALUES (%s, %s, %s)
+            ON CONFLICT (wiki) DO NOTHING
+        """, (wiki, title or wiki, partition))
+        cur.execute("ALTER TABLE articles ADD COLUMN IF NOT EXISTS wiki TEXT REFERENCES wikis(wiki) ON DELETE CASCADE")
+        cur.execute("UPDATE articles SET wiki = %s WHERE wiki IS NULL", (wiki,))
+        print(f"Assigned {cur.rowcount} articles to {wiki}.")
+        cur.execute("ALTER TABLE articles ALTER COLUMN wiki SET NOT NULL")
+        cur.execute("CREATE INDEX IF NOT EXISTS articles_wiki_title_idx ON articles (wiki, title)")
+
+        cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'chunks'::regclass")
+        if cur.fetchone():
+            print("chunks is already partitioned.")
+            return
+        print(f"Partitioning chunks, the existing rows become partition {partition}...")
+        ident = sql.Identifier(partition)
+        cur.execute(sql.SQL("ALTER TABLE chunks RENAME TO {}").format(ident))
+        # Free the names the partitioned table's constraints and indexes are going to use
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME CONSTRAINT chunks_pkey TO {}").format(
+            ident, sql.Identifier(f"{partition}_chunk_id_key")))
+        cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT IF EXISTS chunks_article_id_fkey").format(ident))
+        for index in ("chunks_embedding_ann_idx", "chunks_content_tsv_idx", "chunks_article_id_idx"):
+            cur.execute(sql.SQL("ALTER INDEX IF EXISTS {} RENAME TO {}").format(
+                sql.Identifier(index), sql.Identifier(index.replace("chunks", partition, 1))))
+        # A constant default doesn't rewrite the table, the check constraint lets ATTACH skip its validation scan
+        cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN wiki TEXT NOT NULL DEFAULT {}").format(ident, sql.Literal(wiki)))
+        cur.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN wiki DROP DEFAULT").format(ident))
+        cur.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} CHECK (wiki = {})").format(
+            ident, sql.Identifier(f"{partition}_wiki_check"), sql.Literal(wiki)))
+        cur.execute(sql.SQL(f"ALTER TABLE {{}} ADD COLUMN IF NOT EXISTS embedding_ann HALFVEC({ANN_DIMENSIONS})").format(ident))
+        cur.execute(sql.SQL("""
+            ALTER TABLE {} ADD COLUMN IF NOT EXISTS content_tsv TSVECTOR
+            GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
+        """).format(ident))
+        cur.execute(f"""
+            CREATE TABLE chunks (
+                chunk_id INTEGER NOT NULL DEFAULT nextval('chunks_chunk_id_seq'),
+                wiki TEXT NOT NULL,
+                article_id INTEGER NOT NULL REFERENCES articles(article_id) ON DELETE CASCADE,
+                chunk_index INTEGER NOT NULL,
+                chunk_start_token INTEGER,
+                chunk_end_token INTEGER,
+                content TEXT NOT NULL,
+                embedding VECTOR(4096),
+                embedding_ann HALFVEC({ANN_DIMENSIONS}),
+                token_count INTEGER,
+                content_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', content)) STORED,
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (wiki, chunk_id)
+            ) PARTITION BY LIST (wiki)
+        """)
+        cur.execute(sql.SQL("ALTER TABLE chunks ATTACH PARTITION {} FOR VALUES IN ({})").format(ident, sql.Literal(wiki)))
+        cur.execute("ALTER SEQUENCE chunks_chunk_id_seq OWNED BY chunks.chunk_id")
+        # Existing indexes on the partition are attached instead of being rebuilt
+        print("Creating indexes on the partitioned table (missing partition indexes are built now)...")
+        cur.execute("CREATE INDEX IF NOT EXISTS chunks_embedding_ann_idx ON chunks USING hnsw (embedding_ann halfvec_cosine_ops)")
+        cur.execute("CREATE INDEX IF NOT EXISTS chunks_content_tsv_idx ON chunks USING gin (content_tsv)")
+        cur.execute("CREATE INDEX IF NOT EXISTS chunks_article_id_idx ON chunks (article_id)")
+    print(f"✅ Wiki migration complete, existing data belongs to {wiki}.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate an existing fandom-rag database.")
+    parser.add_argument('--db-host', required=True, help='PostgreSQL host')
+    parser.add_argument('--db-name', required=True, help='PostgreSQL database name')
+    parser.add_argument('--db-user', required=True, help='PostgreSQL user')
+    parser.add_argument('--db-pass', required=True, help='PostgreSQL password')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ann = subparsers.add_parser('ann', help='Add and backfill chunks.embedding_ann and its HNSW index')
+    ann.add_argument('--batch-size', type=int, default=1000, help='Rows updated per backfill transaction')
+    ann.add_argument('--skip-index', action='store_true', help='Backfill only, do not build the HNSW index')
+    subparsers.add_parser('fts', help='Add chunks.content_tsv and its GIN index for hybrid retrieval')
+    wiki = subparsers.add_parser('wiki', help='Partition chunks by wiki, assigning the existing data to one wiki')
+    wiki.add_argument('--wiki', required=True, help='Wiki the existing articles belong to (e.g. clair-obscur)')
+    wiki.add_argument('--title', help='Name of the wiki used in prompts (defaults to --wiki)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    conn = psycopg2.connect(dbname=args.db_name, user=args.db_user, password=args.db_pass, host=args.db_host)
+    try:
+        if args.command == 'ann':
+            migrate_ann(conn, batch_size=args.batch_size, build_index=not args.skip_index)
+        elif args.command == 'fts':
+            migrate_fts(conn)
+        elif args.command == 'wiki':
+            migrate_wiki(conn, args.wiki, args.title)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
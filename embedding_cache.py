@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+# Cache settings, uvicorn_wrapper.py sets these from its command line arguments
+EMBED_CACHE_MAX_BYTES = int(os.environ.get("EMBED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Leave unset to keep the cache in memory only
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH")
+
+def normalize_query(text):
+    # Case, unicode form and whitespace differences should not cost another embedding call
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+def cache_key(text, model):
+    return hashlib.sha256(f"{model}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+class LRUByteCache:
+    """In-process LRU of float32 vectors, evicting least recently used entries by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        vector = self._entries.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vector
+
+    def put(self, key, vector):
+        if vector.nbytes > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old.nbytes
+        self._entries[key] = vector
+        self.bytes += vector.nbytes
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class DiskEmbeddingCache:
+    """Persistent SQLite store of float32 vectors that survives restarts."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put(self, key, model, vector):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                               (key, model, vector.tobytes()))
+            self._conn.commit()
+
+    def stats(self):
+        return {"path": self.path, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class EmbeddingCache:
+    """Two-level cache in front of the query embedding model: memory LRU, then optional disk."""
+
+    def __init__(self, max_bytes=EMBED_CACHE_MAX_BYTES, path=EMBED_CACHE_PATH):
+        self.memory = LRUByteCache(max_bytes)
+        self.disk = DiskEmbeddingCache(path) if path else None
+
+    async def get_or_compute(self, text, model, compute):
+        key = cache_key(text, model)
+        vector = self.memory.get(key)
+        if vector is not None:
+            return vector
+        if self.disk is not None:
+            vector = await asyncio.to_thread(self.disk.get, key)
+            if vector is not None:
+                self.memory.put(key, vector)
+                return vector
+        vector = np.asarray(await compute(text), dtype=np.float32)
+        self.memory.put(key, vector)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, model, vector)
+        return vector
+
+    def stats(self):
+        return {"memory": self.memory.stats(), "disk": self.disk.stats() if self.disk is not None else None}
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+_cache = None
+
+def init_embedding_cache(**kwargs):
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache(**kwargs)
+    return _cache
+
+def get_embedding_cache():
+    # The cache is optional, callers embed directly when it was never initialized
+    return _cache
+
+def close_embedding_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
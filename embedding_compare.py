@@ -1,33 +1,73 @@
 #!/usr/bin/env python3
-import sys
+import argparse
 import json
 import requests
 import numpy as np
+from ollama_pool import OllamaPool
 
 OLLAMA_EMBEDDING_MODEL = "dengcao/Qwen3-Embedding-8B:Q8_0"
-OLLAMA_HOST = "http://fnordstation.home.arpa:11434"
+# Hosts come from OLLAMA_HOSTS (or OLLAMA_HOST), see ollama_pool.py
+OLLAMA_POOL = OllamaPool()
+# Longest phrase label printed in the similarity matrix
+LABEL_WIDTH = 24
 
-def get_embedding(text):
+def _post_embeddings(host, texts, model):
     resp = requests.post(
-        f"{OLLAMA_HOST}/api/embeddings",
+        f"{host}/api/embed",
         headers={"Content-Type": "application/json"},
-        data=json.dumps({"model": OLLAMA_EMBEDDING_MODEL, "prompt": text})
+        data=json.dumps({"model": model, "input": texts})
     )
     resp.raise_for_status()
-    return np.array(resp.json()["embedding"], dtype=np.float32)
+    return np.array(resp.json()["embeddings"], dtype=np.float32)
+
+def get_embeddings(texts, model=OLLAMA_EMBEDDING_MODEL, batch_size=32):
+    """Embed texts with batched /api/embed requests, returns a len(texts) x dim matrix."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    return np.concatenate([OLLAMA_POOL.call("embed", lambda host: _post_embeddings(host, batch, model))
+                           for batch in batches])
+
+def get_embedding(text):
+    return get_embeddings([text])[0]
 
 def cosine_similarity(a, b):
     return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
 
+def similarity_matrix(embeddings, metric="cosine"):
+    """Pairwise similarities of the rows of embeddings, as one matrix product."""
+    if metric == "cosine":
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms > 0, norms, 1)
+    return embeddings @ embeddings.T
+
+def _label(text):
+    return text if len(text) <= LABEL_WIDTH else text[:LABEL_WIDTH - 1] + "…"
+
+def print_matrix(phrases, matrix):
+    labels = [_label(phrase) for phrase in phrases]
+    width = max(len(label) for label in labels)
+    print(" " * (width + 2) + "".join(f"{n:>10}" for n in range(1, len(labels) + 1)))
+    for n, (label, row) in enumerate(zip(labels, matrix), start=1):
+        print(f"{n:>2} {label:<{width}}" + "".join(f"{value:>10.6f}" for value in row))
+
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python embedding_compare.py <phrase1> <phrase2>")
-        sys.exit(1)
-    phrase1, phrase2 = sys.argv[1], sys.argv[2]
-    emb1 = get_embedding(phrase1)
-    emb2 = get_embedding(phrase2)
-    cos_sim = cosine_similarity(emb1, emb2)
-    print(f"Cosine similarity: {cos_sim:.6f}")
+    parser = argparse.ArgumentParser(description="Compare the embeddings of words, phrases or sentences.")
+    parser.add_argument('phrases', nargs='*', help='Phrases to compare, two print one similarity, more print a matrix')
+    parser.add_argument('--file', help='Also compare the phrases in this file, one per line')
+    parser.add_argument('--metric', choices=['cosine', 'dot'], default='cosine', help='Similarity measure')
+    parser.add_argument('--model', default=OLLAMA_EMBEDDING_MODEL, help='Ollama embedding model')
+    parser.add_argument('--batch-size', type=int, default=32, help='Phrases embedded per Ollama request')
+    args = parser.parse_args()
+    phrases = list(args.phrases)
+    if args.file:
+        with open(args.file) as f:
+            phrases += [line.strip() for line in f if line.strip()]
+    if len(phrases) < 2:
+        parser.error("give at least two phrases")
+    matrix = similarity_matrix(get_embeddings(phrases, args.model, args.batch_size), args.metric)
+    if len(phrases) == 2:
+        print(f"{'Cosine similarity' if args.metric == 'cosine' else 'Dot product'}: {matrix[0, 1]:.6f}")
+    else:
+        print_matrix(phrases, matrix)
 
 if __name__ == "__main__":
     main()
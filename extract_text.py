@@ -0,0 +1,152 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote
+import lxml.html
+
+# Streaming html -> text stage between scrape_fandom_wiki.py and chunk_embed_insert.py.
+# Raw scraped records are parsed with lxml on a process pool, boilerplate is removed, stubs are
+# detected, and the cleaned records are written in input order with a bounded amount in flight.
+
+# Elements that repeat across pages or only make sense in the browser
+BOILERPLATE_CLASSES = (
+    "navbox", "toc", "mw-editsection", "reference", "references", "reflist", "noprint",
+    "navigation-not-searchable", "printfooter", "catlinks", "mw-empty-elt", "mbox", "notice"
+)
+INFOBOX_CLASSES = ("portable-infobox", "infobox")
+BOILERPLATE_TAGS = ("script", "style", "noscript")
+
+# Stub templates on any wiki link to a stub category, e.g. /wiki/Category:Stubs or Category:Character_stubs.
+# "stub" has to be a whole word of the category name, Category:Stubborn_bosses is not a stub notice.
+STUB_CATEGORY_RE = re.compile(r"Category:(?:[^/?#]*[_ ])?stubs?(?=$|[_ /?#])", re.IGNORECASE)
+
+def _class_xpath(classes):
+    return " | ".join(f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {c} ')]" for c in classes)
+
+BOILERPLATE_XPATH = _class_xpath(BOILERPLATE_CLASSES) + " | " + " | ".join(f"//{tag}" for tag in BOILERPLATE_TAGS)
+INFOBOX_XPATH = _class_xpath(INFOBOX_CLASSES)
+
+def parse_html(html):
+    return lxml.html.fragment_fromstring(html or "<div></div>", create_parent="div")
+
+def is_stub_tree(tree):
+    for link in tree.iter("a"):
+        target = unquote(link.get("href", "")) + " " + link.get("title", "")
+        if STUB_CATEGORY_RE.search(target):
+            return True
+    return False
+
+def is_stub_html(html):
+    return is_stub_tree(parse_html(html))
+
+def strip_boilerplate(tree, keep_infobox=False):
+    xpath = BOILERPLATE_XPATH if keep_infobox else f"{BOILERPLATE_XPATH} | {INFOBOX_XPATH}"
+    for element in tree.xpath(xpath):
+        # drop_tree keeps the element's tail text, which belongs to the parent
+        if element.getparent() is not None:
+            element.drop_tree()
+
+def tree_to_text(tree):
+    # Same spacing as BeautifulSoup's get_text(separator=" ", strip=True), used before this stage
+    return " ".join(piece.strip() for piece in tree.itertext() if piece.strip())
+
+def extract_lines(lines, keep_infobox=False, keep_html=False):
+    """Clean a batch of raw JSONL lines. Returns (status, output line or error) per line."""
+    results = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+            tree = parse_html(record.get("html", ""))
+            stub = is_stub_tree(tree)
+            strip_boilerplate(tree, keep_infobox=keep_infobox)
+            record["text"] = tree_to_text(tree)
+            if stub:
+                record["stub"] = True
+            if not keep_html:
+                record.pop("html", None)
+            results.append(("stub" if stub else "ok", json.dumps(record, ensure_ascii=False) + "\n"))
+        except Exception as e:
+            results.append(("error", str(e)))
+    return results
+
+def extract_file(input_path, output_path, workers=0, batch_size=64, keep_stubs=False, keep_infobox=False,
+                 keep_html=False):
+    counts = {"total": 0, "written": 0, "stubs": 0, "errors": 0}
+
+    def batches(infile):
+        batch = []
+        for line in infile:
+            if line.strip():
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def write(outfile, results):
+        for status, payload in results:
+            counts["total"] += 1
+            if status == "error":
+                counts["errors"] += 1
+                print(f"❌ Skipping record {counts['total']} due to error: {payload}")
+                continue
+            if status == "stub":
+                counts["stubs"] += 1
+                if not keep_stubs:
+                    continue
+            outfile.write(payload)
+            counts["written"] += 1
+        print(f"Progress: {counts['total']} records", end="\r")
+
+    options = dict(keep_infobox=keep_infobox, keep_html=keep_html)
+    with open(input_path, encoding="utf-8") as infile, open(output_path, "w", encoding="utf-8") as outfile:
+        if workers <= 0:
+            for batch in batches(infile):
+                write(outfile, extract_lines(batch, **options))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                in_flight = deque()
+                for batch in batches(infile):
+                    in_flight.append(pool.submit(extract_lines, batch, **options))
+                    if len(in_flight) >= workers * 2:
+                        write(outfile, in_flight.popleft().result())
+                while in_flight:
+                    write(outfile, in_flight.popleft().result())
+    return counts
+
+def get_output_path(input_path: Path) -> Path:
+    # Insert '-text' before the file extension
+    if input_path.suffix:
+        return input_path.with_name(input_path.stem + "-text" + input_path.suffix)
+    return input_path.with_name(input_path.name + "-text")
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract clean article text from a scraped JSONL file.")
+    parser.add_argument("input_file", help="JSONL written by scrape_fandom_wiki.py")
+    parser.add_argument("--output", help="Output JSONL (defaults to <input>-text.jsonl)")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Parser processes (0 parses in this process)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Records per worker task")
+    parser.add_argument("--keep-stubs", action="store_true", help="Write stub articles too (marked with \"stub\": true)")
+    parser.add_argument("--keep-infobox", action="store_true", help="Keep infobox text instead of removing it")
+    parser.add_argument("--keep-html", action="store_true", help="Keep the raw html in the output records")
+    args = parser.parse_args()
+
+    input_path = Path(args.input_file)
+    if not input_path.exists():
+        print(f"❌ Input file not found: {input_path}")
+        sys.exit(1)
+    output_path = Path(args.output) if args.output else get_output_path(input_path)
+    counts = extract_file(input_path, output_path, workers=args.workers, batch_size=args.batch_size,
+                          keep_stubs=args.keep_stubs, keep_infobox=args.keep_infobox, keep_html=args.keep_html)
+    print(f"\n✅ Extracted {counts['written']} of {counts['total']} articles ({counts['stubs']} stubs, "
+          f"{counts['errors']} errors) to {output_path}")
+
+if __name__ == "__main__":
+    main()
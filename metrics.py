@@ -0,0 +1,109 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from prometheus_client import Counter, Gauge, Histogram
+
+# Per-request latency instrumentation. Every rag query records how long each stage took, the
+# stages are observed into Prometheus histograms (served on rag_api.py /metrics) and summarized
+# in one JSON log line per request.
+
+# "0" turns off the per-request log line, the metrics are always collected
+REQUEST_LOG_ENABLED = os.environ.get("REQUEST_LOG_ENABLED", "1") == "1"
+
+# Embedding and retrieval take milliseconds, generation can take minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100, 250, 500, 1000, 2500, 5000)
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each stage of a rag query",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("rag_request_seconds", "Time from receiving a rag query to its last token",
+                            ["wiki", "outcome"], buckets=LATENCY_BUCKETS)
+FIRST_TOKEN_SECONDS = Histogram("rag_time_to_first_token_seconds",
+                                "Time from receiving a rag query to the first generated token",
+                                buckets=LATENCY_BUCKETS)
+EVAL_RATE = Histogram("rag_eval_tokens_per_second", "Generation speed reported by Ollama", buckets=RATE_BUCKETS)
+PROMPT_EVAL_RATE = Histogram("rag_prompt_eval_tokens_per_second", "Prompt processing speed reported by Ollama",
+                             buckets=RATE_BUCKETS)
+REQUESTS = Counter("rag_requests_total", "Rag queries by outcome (ok, cached, error, cancelled)", ["wiki", "outcome"])
+PROMPT_TOKENS = Counter("rag_prompt_tokens_total", "Prompt tokens evaluated by Ollama")
+COMPLETION_TOKENS = Counter("rag_completion_tokens_total", "Tokens generated by Ollama")
+CONTEXT_TOKENS = Histogram("rag_context_tokens", "Estimated prompt tokens per query",
+                           buckets=(500, 1000, 2500, 5000, 10000, 20000, 30000, 40000, 65000, 130000))
+# Scheduler queues (scheduler.py), stage is embed or generate
+QUEUE_WAIT_SECONDS = Histogram("rag_queue_wait_seconds", "Time spent waiting for an embed or generate slot",
+                               ["stage"], buckets=LATENCY_BUCKETS)
+QUEUE_WAITING = Gauge("rag_queue_waiting", "Requests currently waiting for a slot", ["stage"])
+QUEUE_REJECTED = Counter("rag_queue_rejected_total", "Requests turned away because the queue was full", ["stage"])
+PREFILL_RATE_ESTIMATE = Gauge("rag_prefill_tokens_per_second_estimate",
+                              "Learned prompt processing speed used to size contexts (context_budget.py)")
+COALESCED_REQUESTS = Counter("rag_coalesced_requests_total", "Queries answered by an identical query already in flight")
+
+def _rate(count, duration_ns):
+    return count / (duration_ns / 1e9) if count and duration_ns else None
+
+class RequestTimings:
+    """Stage timings of one rag query. finish() records the metrics and writes the log line."""
+
+    def __init__(self, wiki):
+        self.wiki = wiki
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.first_token = None
+        self.fields = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            STAGE_SECONDS.labels(name).observe(elapsed)
+
+    def mark_first_token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.started
+            FIRST_TOKEN_SECONDS.observe(self.first_token)
+
+    def record_generation(self, done_part):
+        """Take token counts and speeds from Ollama's final stream message."""
+        prompt_eval_count = done_part.get("prompt_eval_count")
+        eval_count = done_part.get("eval_count")
+        eval_rate = _rate(eval_count, done_part.get("eval_duration"))
+        prompt_eval_rate = _rate(prompt_eval_count, done_part.get("prompt_eval_duration"))
+        if prompt_eval_count:
+            PROMPT_TOKENS.inc(prompt_eval_count)
+        if eval_count:
+            COMPLETION_TOKENS.inc(eval_count)
+        if eval_rate:
+            EVAL_RATE.observe(eval_rate)
+        if prompt_eval_rate:
+            PROMPT_EVAL_RATE.observe(prompt_eval_rate)
+        self.fields.update(prompt_eval_count=prompt_eval_count, eval_count=eval_count,
+                           eval_tokens_per_second=eval_rate, prompt_eval_tokens_per_second=prompt_eval_rate)
+
+    def elapsed_ns(self):
+        """Nanoseconds since the request started, the unit of Ollama's durations."""
+        return round((time.perf_counter() - self.started) * 1e9)
+
+    def breakdown(self):
+        """Stage durations in milliseconds, plus time to first token and the total so far."""
+        timings = {f"{name}_ms": round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+        if self.first_token is not None:
+            timings["first_token_ms"] = round(self.first_token * 1000, 3)
+        timings["total_ms"] = round((time.perf_counter() - self.started) * 1000, 3)
+        return timings
+
+    def finish(self, outcome, **fields):
+        total = time.perf_counter() - self.started
+        REQUESTS.labels(self.wiki, outcome).inc()
+        REQUEST_SECONDS.labels(self.wiki, outcome).observe(total)
+        if fields.get("tokens_used"):
+            CONTEXT_TOKENS.observe(fields["tokens_used"])
+        if REQUEST_LOG_ENABLED:
+            line = {"ts": datetime.now(timezone.utc).isoformat(), "event": "rag_query", "wiki": self.wiki,
+                    "outcome": outcome, **self.breakdown(), **self.fields, **fields}
+            print(json.dumps(line), flush=True)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import httpx
+from ollama_pool import OllamaPool
+
+# Client settings, uvicorn_wrapper.py sets these from its command line arguments.
+# The Ollama hosts themselves come from OLLAMA_HOSTS (or OLLAMA_HOST), see ollama_pool.py
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "600"))
+OLLAMA_MAX_RETRIES = int(os.environ.get("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.environ.get("OLLAMA_RETRY_BACKOFF", "0.5"))
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "32"))
+# How long Ollama keeps the model (and its prompt cache) loaded after a request, e.g. "30m".
+# Unset leaves it to the server's OLLAMA_KEEP_ALIVE
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE")
+# Seconds between health checks of pooled hosts, 0 relies on request failures alone
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "10"))
+
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+def _raise(failure):
+    # The last failure of a request is either a transport error or a retryable response
+    if isinstance(failure, httpx.Response):
+        failure.raise_for_status()
+    raise failure
+
+class OllamaClient:
+    """Async Ollama client sharing one keep-alive connection pool across requests.
+
+    Requests go to the least busy host of their role in the OllamaPool. Connection failures
+    and 502/503/504 responses fail over to the other hosts straight away, and once every host
+    has failed the request is retried with exponential backoff. Streams only fail over before
+    the first message has been yielded.
+    """
+
+    def __init__(self, hosts=None, connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT,
+                 max_retries=OLLAMA_MAX_RETRIES, retry_backoff=OLLAMA_RETRY_BACKOFF,
+                 max_connections=OLLAMA_MAX_CONNECTIONS, keep_alive=OLLAMA_KEEP_ALIVE,
+                 health_interval=OLLAMA_HEALTH_INTERVAL):
+        self.pool = OllamaPool(hosts)
+        self.keep_alive = keep_alive
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._health_task = None
+        if health_interval > 0 and len(self.pool.endpoints) > 1:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_checks(health_interval))
+
+    async def _backoff(self, attempt):
+        await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+    async def _check(self, endpoint):
+        try:
+            resp = await self._client.get(f"{endpoint.url}/api/version", timeout=OLLAMA_CONNECT_TIMEOUT)
+            ok = resp.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        self.pool.record_health(endpoint, ok)
+
+    async def _health_checks(self, interval):
+        while True:
+            await asyncio.gather(*(self._check(endpoint) for endpoint in self.pool.endpoints))
+            await asyncio.sleep(interval)
+
+    async def post_json(self, path, payload, role="generate"):
+        for attempt in range(self.max_retries + 1):
+            tried = []
+            while (endpoint := self.pool.acquire(role, exclude=tried)) is not None:
+                tried.append(endpoint)
+                # Stays None if the request is cancelled, which says nothing about the host
+                ok = None
+                try:
+                    resp = await self._client.post(f"{endpoint.url}{path}", json=payload)
+                    ok = resp.status_code not in RETRYABLE_STATUS_CODES
+                    failure = resp
+                except httpx.TransportError as e:
+                    ok = False
+                    failure = e
+                finally:
+                    self.pool.release(endpoint, ok)
+                if ok:
+                    resp.raise_for_status()
+                    return resp.json()
+            if attempt == self.max_retries:
+                _raise(failure)
+            await self._backoff(attempt)
+
+    async def stream_json(self, path, payload, role="generate", affinity=None):
+        """Yield each NDJSON line of a streaming endpoint as a dict."""
+        for attempt in range(self.max_retries + 1):
+            tried = []
+            while (endpoint := self.pool.acquire(role, exclude=tried, affinity=affinity)) is not None:
+                tried.append(endpoint)
+                started = False
+                # Stays None if the consumer goes away before the host answered
+                ok = None
+                try:
+                    async with self._client.stream("POST", f"{endpoint.url}{path}", json=payload) as resp:
+                        if resp.status_code in RETRYABLE_STATUS_CODES:
+                            ok = False
+                            await resp.aread()
+                            failure = resp
+                            continue
+                        # The host answered, so errors from here on are about the request
+                        ok = True
+                        if resp.is_error:
+                            await resp.aread()
+                            resp.raise_for_status()
+                        async for line in resp.aiter_lines():
+                            if line:
+                                started = True
+                                yield json.loads(line)
+                        return
+                except httpx.TransportError as e:
+                    ok = False
+                    if started:
+                        raise
+                    failure = e
+                finally:
+                    self.pool.release(endpoint, ok)
+            if attempt == self.max_retries:
+                _raise(failure)
+            await self._backoff(attempt)
+
+    async def embed(self, texts, model):
+        data = await self.post_json("/api/embed", {"model": model, "input": texts}, role="embed")
+        return data["embeddings"]
+
+    async def show(self, model):
+        return await self.post_json("/api/show", {"model": model})
+
+    def _generation_payload(self, payload, num_ctx):
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        if num_ctx:
+            # Without it Ollama runs at its default context and silently truncates longer prompts
+            payload["options"] = {"num_ctx": num_ctx}
+        return payload
+
+    def generate_stream(self, prompt, model, num_ctx=None):
+        return self.stream_json("/api/generate", self._generation_payload({"model": model, "prompt": prompt}, num_ctx))
+
+    def chat_stream(self, messages, model, affinity=None, num_ctx=None):
+        """affinity (e.g. a conversation key) sends requests with the same key to the same host
+        when the hosts are equally busy, so its prompt cache can be reused."""
+        return self.stream_json("/api/chat", self._generation_payload({"model": model, "messages": messages}, num_ctx),
+                                affinity=affinity)
+
+    async def aclose(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        await self._client.aclose()
+
+_client = None
+
+def init_ollama_client(**kwargs):
+    global _client
+    if _client is None:
+        _client = OllamaClient(**kwargs)
+    return _client
+
+def get_ollama_client():
+    if _client is None:
+        raise RuntimeError("Ollama client is not initialized, call init_ollama_client() first.")
+    return _client
+
+async def close_ollama_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
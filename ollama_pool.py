@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass
+import requests
+
+# A pool of Ollama servers. Each endpoint serves embedding, generation or both, every request
+# goes to the least busy healthy endpoint of its role, and an endpoint that fails is ejected for
+# a backoff that doubles with each consecutive failure. Hosts are given as "url" (both roles)
+# or "url=embed", "url=generate", "url=embed+generate", comma separated in OLLAMA_HOSTS or
+# repeated --ollama-host arguments.
+
+ROLES = ("embed", "generate")
+DEFAULT_OLLAMA_HOST = "http://fnordstation.home.arpa:11434"
+# Seconds a failing endpoint is ejected for, doubling per consecutive failure up to the maximum
+EJECT_BASE_SECONDS = float(os.environ.get("OLLAMA_EJECT_BASE_SECONDS", "5"))
+EJECT_MAX_SECONDS = float(os.environ.get("OLLAMA_EJECT_MAX_SECONDS", "300"))
+
+def parse_host(spec):
+    url, _, roles = spec.strip().partition("=")
+    roles = frozenset(role.strip() for role in roles.split("+") if role.strip()) or frozenset(ROLES)
+    unknown = roles - set(ROLES)
+    if unknown:
+        raise ValueError(f"Unknown Ollama role(s) {', '.join(sorted(unknown))} in '{spec}', use embed and/or generate.")
+    return url.strip().rstrip("/"), roles
+
+def is_host_failure(error):
+    """Whether a requests error means the host is unwell (no connection, a timeout or a 5xx) rather
+    than that the request itself was bad, which another host would refuse just the same."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code >= 500
+
+def hosts_from_env():
+    # OLLAMA_HOSTS lists the pool, a single OLLAMA_HOST is still accepted
+    return os.environ.get("OLLAMA_HOSTS") or os.environ.get("OLLAMA_HOST", DEFAULT_OLLAMA_HOST)
+
+@dataclass(eq=False)
+class Endpoint:
+    url: str
+    roles: frozenset
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+
+    def stats(self, now):
+        return {"url": self.url, "roles": sorted(self.roles), "in_flight": self.in_flight, "requests": self.requests,
+                "errors": self.errors, "healthy": self.ejected_until <= now,
+                "ejected_for": round(max(0.0, self.ejected_until - now), 1)}
+
+class OllamaPool:
+    """Endpoint selection and health state, shared by threads (ingest) and the event loop (API)."""
+
+    def __init__(self, hosts=None, eject_base=EJECT_BASE_SECONDS, eject_max=EJECT_MAX_SECONDS):
+        if hosts is None:
+            hosts = hosts_from_env()
+        if isinstance(hosts, str):
+            hosts = hosts.split(",")
+        self.endpoints = [Endpoint(*parse_host(spec)) for spec in hosts if spec.strip()]
+        if not self.endpoints:
+            raise ValueError("No Ollama hosts configured.")
+        self.eject_base = eject_base
+        self.eject_max = eject_max
+        self._lock = threading.Lock()
+
+    def with_role(self, role):
+        return [endpoint for endpoint in self.endpoints if role in endpoint.roles]
+
+    @staticmethod
+    def _affinity_rank(affinity, endpoint):
+        # Rendezvous hashing, a key keeps its endpoint as long as that endpoint is in the running
+        return hashlib.blake2b(f"{affinity}\0{endpoint.url}".encode("utf-8"), digest_size=8).digest()
+
+    def acquire(self, role, exclude=(), affinity=None):
+        """Pick the least busy healthy endpoint of role that isn't in exclude and count a request
+        on it. Ties go to the endpoint with fewer requests so far, or with an affinity key, to the
+        same endpoint every time. When all of them are ejected, the one whose ejection ends first
+        is still tried. Returns None when every endpoint of role is excluded."""
+        now = time.monotonic()
+        endpoints = self.with_role(role)
+        if not endpoints:
+            raise LookupError(f"No Ollama host serves {role} requests.")
+        with self._lock:
+            candidates = [endpoint for endpoint in endpoints if endpoint not in exclude]
+            if not candidates:
+                return None
+            healthy = [endpoint for endpoint in candidates if endpoint.ejected_until <= now]
+            if healthy:
+                least = min(endpoint.in_flight for endpoint in healthy)
+                healthy = [endpoint for endpoint in healthy if endpoint.in_flight == least]
+                if affinity is None:
+                    endpoint = min(healthy, key=lambda e: e.requests)
+                else:
+                    endpoint = max(healthy, key=lambda e: self._affinity_rank(affinity, e))
+            else:
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, ok):
+        """Give back an acquired endpoint. ok is True or False when the host did or didn't answer,
+        None when the request ended before that was known (e.g. it was cancelled), which leaves
+        the endpoint's health alone."""
+        with self._lock:
+            endpoint.in_flight -= 1
+            if ok:
+                self._mark_healthy(endpoint)
+            elif ok is not None:
+                self._mark_failed(endpoint)
+
+    def _mark_healthy(self, endpoint):
+        endpoint.consecutive_failures = 0
+        endpoint.ejected_until = 0.0
+
+    def _mark_failed(self, endpoint):
+        endpoint.errors += 1
+        endpoint.consecutive_failures += 1
+        backoff = min(self.eject_max, self.eject_base * 2 ** (endpoint.consecutive_failures - 1))
+        endpoint.ejected_until = time.monotonic() + backoff
+
+    def record_health(self, endpoint, ok):
+        # Health checks don't count as requests, but eject and readmit like them
+        with self._lock:
+            if ok:
+                self._mark_healthy(endpoint)
+            elif endpoint.ejected_until <= time.monotonic():
+                self._mark_failed(endpoint)
+
+    def call(self, role, fn):
+        """Call fn(url) on the least busy endpoint of role, failing over to the others when the
+        host fails (see is_host_failure). Other errors, like a 4xx or an unexpected response,
+        are raised right away without counting against the host."""
+        tried = []
+        while True:
+            endpoint = self.acquire(role, exclude=tried)
+            if endpoint is None:
+                raise last_error
+            tried.append(endpoint)
+            try:
+                result = fn(endpoint.url)
+            except Exception as e:
+                if not is_host_failure(e):
+                    self.release(endpoint, ok=None)
+                    raise
+                self.release(endpoint, ok=False)
+                last_error = e
+                continue
+            except BaseException:
+                self.release(endpoint, ok=None)
+                raise
+            self.release(endpoint, ok=True)
+            return result
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [endpoint.stats(now) for endpoint in self.endpoints]
@@ -1,21 +1,65 @@
 from fastapi import FastAPI, HTTPException, Request
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 import os
-from rag_query import rag_query, get_pg_conn, get_query_embedding
+from chunk_selection import DEFAULT_SETTINGS
+from rag_query import (rag_query, rag_query_stream, rag_chat, rag_chat_stream, get_pg_conn, get_query_embedding,
+                       init_planner, OLLAMA_STATS_FIELDS)
+from context_budget import get_context_planner, close_context_planner, ContextPlanner, MIN_NUM_CTX
+from rag_db import init_pool, close_pool, list_wikis, get_wiki, RETRIEVAL_MODE
+from vector_index import init_vector_index, close_vector_index
+from ollama_client import init_ollama_client, get_ollama_client, close_ollama_client
+from embedding_cache import init_embedding_cache, get_embedding_cache, close_embedding_cache
+from answer_cache import init_answer_cache, get_answer_cache, close_answer_cache
+from scheduler import init_scheduler, get_scheduler, close_scheduler, QueueFull
+from conversation_store import init_conversation_store, get_conversation_store, close_conversation_store
 from fastapi.responses import StreamingResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import json
 
-app = FastAPI()
-wiki = "Clair Obscur"
+@asynccontextmanager
+async def lifespan(app):
+    # One database pool and one keep-alive Ollama client for the lifetime of the app
+    await init_pool(get_pg_conn())
+    init_ollama_client()
+    init_planner()
+    init_embedding_cache()
+    init_answer_cache()
+    init_scheduler()
+    init_conversation_store()
+    if RETRIEVAL_MODE == "mmap":
+        init_vector_index()
+    try:
+        yield
+    finally:
+        close_vector_index()
+        close_conversation_store()
+        close_scheduler()
+        close_context_planner()
+        close_answer_cache()
+        close_embedding_cache()
+        await close_ollama_client()
+        await close_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 class RAGRequest(BaseModel):
     query: str
     wiki: str
+    # chunk_selection.SelectionSettings overrides, e.g. {"enabled": true, "mmr_lambda": 0.5}
+    selection: Optional[dict] = None
+    # Return the per-stage timing breakdown (milliseconds) with the answer
+    timings: bool = False
+    # context_budget overrides, e.g. {"latency_target": "fast"} or {"latency_target": 3, "num_ctx": 16384}
+    budget: Optional[dict] = None
 
 class OllamaGenerateRequest(BaseModel):
     model: str
     prompt: str
+    stream: bool = False
+    options: Optional[dict] = None
 
 class OllamaChatMessage(BaseModel): 
     role: str
@@ -24,21 +68,90 @@ class OllamaChatMessage(BaseModel):
 class OllamaChatRequest(BaseModel):
     model: str
     messages: List[OllamaChatMessage]
+    stream: bool = False
+    options: Optional[dict] = None
+
+def checked_selection(selection):
+    # A bad setting is the client's 400, not a 500 from inside the query
+    try:
+        DEFAULT_SETTINGS.with_overrides(selection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return selection
+
+def selection_overrides(options):
+    # Ollama clients can pass selection overrides as options={"selection": {...}}
+    return checked_selection((options or {}).get("selection"))
+
+def budget_overrides(options):
+    # options={"latency_target": "fast"} picks a quick answer, Ollama's own num_ctx caps the window.
+    # Checked here so a bad value is the client's 400, not a 500 from inside the query
+    options = options or {}
+    budget = {"latency_target": options.get("latency_target"), "num_ctx": options.get("num_ctx")}
+    if budget["latency_target"] is not None:
+        try:
+            ContextPlanner.target_seconds(budget["latency_target"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if budget["num_ctx"] is not None and (not isinstance(budget["num_ctx"], int) or budget["num_ctx"] < MIN_NUM_CTX):
+        raise HTTPException(status_code=400, detail=f"num_ctx must be an integer of at least {MIN_NUM_CTX}.")
+    return budget
 
 def normalize_model_name(model):
     # Remove any :tag suffix (e.g., :latest)
     return model.split(":")[0]
 
+def ollama_timestamp():
+    return datetime.now(timezone.utc).isoformat()
+
+def client_id(http_request):
+    # OpenWebUI forwards its user (ENABLE_FORWARD_USER_INFO_HEADERS), otherwise queue per address
+    return http_request.headers.get("x-openwebui-user-id") or (http_request.client.host if http_request.client else None)
+
+def busy(e):
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def require_wiki(model):
+    # Every ingested wiki is served as a model named after it, with or without a :tag
+    name = normalize_model_name(model or "")
+    if await get_wiki(name) is None:
+        raise HTTPException(status_code=404, detail=f"Model '{model}' not found.")
+    return name
+
+async def ndjson_response(parts, to_message):
+    """Stream rag_query_stream parts as Ollama-style NDJSON, mapped through to_message.
+
+    The first part is awaited before the response starts so retrieval errors still become a 500.
+    """
+    first = await anext(parts)
+
+    async def event_stream():
+        part = first
+        try:
+            while True:
+                message = to_message(part)
+                if part.get("done"):
+                    message["done_reason"] = part.get("done_reason", "stop")
+                    message.update({k: part[k] for k in OLLAMA_STATS_FIELDS if k in part})
+                yield json.dumps(message) + "\n"
+                part = await anext(parts)
+        except StopAsyncIteration:
+            pass
+        except Exception as e:
+            # Headers are already sent, report the failure the way Ollama does
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
 @app.get("/api/ps")
-def ollama_ps():
-    return {"models": [{"model": f"{wiki}:latest", "name": f"{wiki}:latest"}]}
+async def ollama_ps():
+    return {"models": [{"model": f"{w['wiki']}:latest", "name": f"{w['wiki']}:latest"} for w in await list_wikis()]}
 
 @app.post("/api/pull")
 async def ollama_pull(request: Request):
     data = await request.json()
     model = data.get("name")
-    if model != wiki:
-        raise HTTPException(status_code=404, detail=f"Model '{model}' not found.")
+    await require_wiki(model)
 
     async def event_stream():
         # Progress message (optional, but helps)
@@ -79,64 +192,124 @@ async def ollama_delete(request: Request):
 @app.post("/api/show")
 async def ollama_show(request: Request):
     data = await request.json()
-    model = data.get("name")
-    if model != wiki:
-        raise HTTPException(status_code=404, detail=f"Model '{model}' not found.")
-    
+    model = data.get("name") or data.get("model")
+    info = await get_wiki(await require_wiki(model))
+
     # Return minimal model info
     return {
         "name": model,
         "modelfile": "RAG",
         "parameters": {},
-        "details": f"RAG-backed model for wiki: {model}"
+        "details": f"RAG-backed model for wiki: {info['title']}"
     }
 
 @app.get("/api/tags")
-def list_models():
+async def list_models():
     return {
         "models": [
             {
-                "model": f"{wiki}:latest",
-                "name": f"{wiki}:latest",
-                "size": 100000,
+                "model": f"{w['wiki']}:latest",
+                "name": f"{w['wiki']}:latest",
+                "modified_at": w["created_at"].isoformat() if w["created_at"] else None,
+                "size": w["size"],
                 "tags": ["latest"]  # Add tags here
             }
+            for w in await list_wikis()
         ]
     }
 
 @app.post("/rag_query")
-def rag_query_endpoint(request: RAGRequest):
+async def rag_query_endpoint(request: RAGRequest, http_request: Request):
+    wiki = await require_wiki(request.wiki)
+    selection = checked_selection(request.selection)
+    budget = budget_overrides(request.budget)
     try:
-        pg_conn = get_pg_conn()
-        result = rag_query(request.query, request.wiki, pg_conn)
+        result = await rag_query(request.query, wiki, selection, include_timings=request.timings,
+                                 client=client_id(http_request), budget=budget)
         return result
+    except QueueFull as e:
+        raise busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/generate")
-def ollama_generate(request: OllamaGenerateRequest):
+async def ollama_generate(request: OllamaGenerateRequest, http_request: Request):
+    wiki = await require_wiki(request.model)
+    client = client_id(http_request)
+    selection = selection_overrides(request.options)
+    budget = budget_overrides(request.options)
     try:
-        pg_conn = get_pg_conn()
-        result = rag_query(request.prompt, wiki, pg_conn)
+        if request.stream:
+            return await ndjson_response(
+                rag_query_stream(request.prompt, wiki, selection, client=client, budget=budget),
+                lambda part: {
+                    "model": request.model,
+                    "created_at": ollama_timestamp(),
+                    "response": part.get("response", ""),
+                    "done": bool(part.get("done"))
+                }
+            )
+        result = await rag_query(request.prompt, wiki, selection, client=client, budget=budget)
         return {"response": result["answer"]}
+    except QueueFull as e:
+        raise busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/api/chat")
-async def ollama_chat(request: OllamaChatRequest):
+async def ollama_chat(request: OllamaChatRequest, http_request: Request):
+    wiki = await require_wiki(request.model)
+    client = client_id(http_request)
+    selection = selection_overrides(request.options)
+    budget = budget_overrides(request.options)
     try:
-        pg_conn = get_pg_conn()
-        result = rag_query(request.messages[-1].content, wiki, pg_conn)
+        messages = [{"role": message.role, "content": message.content} for message in request.messages]
+        if request.stream:
+            return await ndjson_response(
+                rag_chat_stream(messages, wiki, selection, client=client, budget=budget),
+                lambda part: {
+                    "model": request.model,
+                    "created_at": ollama_timestamp(),
+                    "message": {"role": "assistant", "content": part.get("response", "")},
+                    "done": bool(part.get("done"))
+                }
+            )
+        result = await rag_chat(messages, wiki, selection, client=client, budget=budget)
         return {
-            "model": wiki,
-            "message": { "role": "user", "content": result["answer"] },
+            "model": request.model,
+            "message": { "role": "assistant", "content": result["answer"] },
             "done_reason": "stop",
             "done": True,
             }
-        return {"response": result["answer"]}
+    except QueueFull as e:
+        raise busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.get("/cache_stats")
+def cache_stats():
+    embedding_cache = get_embedding_cache()
+    answer_cache = get_answer_cache()
+    conversation_store = get_conversation_store()
+    return {
+        "embedding": embedding_cache.stats() if embedding_cache is not None else None,
+        "answer": answer_cache.stats() if answer_cache is not None else None,
+        "conversations": conversation_store.stats() if conversation_store is not None else None
+    }
+
+@app.get("/scheduler_stats")
+def scheduler_stats():
+    scheduler = get_scheduler()
+    return {
+        "queues": scheduler.stats() if scheduler is not None else None,
+        "context": get_context_planner().stats(),
+        "ollama": get_ollama_client().pool.stats()
+    }
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/api/version")
 def ollama_version():
     # Return a static version string or your own versioning
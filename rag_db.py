@@ -0,0 +1,221 @@
+import asyncio
+import os
+import asyncpg
+from vector_codec import encode_vector, decode_vector, encode_halfvec, decode_halfvec, reduce_embedding
+from vector_index import get_vector_index
+
+# Pool settings, uvicorn_wrapper.py sets these from its command line arguments
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+DB_COMMAND_TIMEOUT = float(os.environ.get("DB_COMMAND_TIMEOUT", "60"))
+
+# "exact" scans every 4096-dim embedding, "ann" takes candidates from the HNSW index on
+# embedding_ann and re-ranks them exactly (see db_migrate.py ann), "mmap" searches the
+# memory-mapped index from vector_index.py and only fetches content from Postgres
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "exact")
+ANN_CANDIDATES = int(os.environ.get("ANN_CANDIDATES", "1000"))
+# pgvector caps hnsw.ef_search at 1000, and an HNSW scan returns at most ef_search rows
+ANN_EF_SEARCH = int(os.environ.get("ANN_EF_SEARCH", "1000"))
+
+# Hybrid retrieval (see db_migrate.py fts): "rrf" fuses a full-text ranking with the vector
+# ranking, "prefilter" only computes vector distances for chunks that match the query's words or
+# belong to an article whose title is in the query, and falls back to the vector ranking when
+# fewer than PREFILTER_MIN_MATCHES chunks match
+HYBRID_MODE = os.environ.get("HYBRID_MODE", "off")
+LEXICAL_CANDIDATES = int(os.environ.get("LEXICAL_CANDIDATES", "200"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+PREFILTER_MIN_MATCHES = int(os.environ.get("PREFILTER_MIN_MATCHES", "20"))
+
+# asyncpg prepares every distinct query once per connection and keeps it in the statement
+# cache, so each pooled connection parses and plans these statements a single time. {columns}
+# is CHUNK_FIELDS, plus the embedding when the caller re-ranks the chunks itself (chunk_selection.py).
+# chunks is list-partitioned by wiki and every query filters on it, so only the requested
+# wiki's partition (and its indexes) is read.
+CHUNK_FIELDS = "chunk_id, content, article_id, chunk_index, chunk_start_token, chunk_end_token, token_count"
+
+RETRIEVE_CHUNKS_SQL = """
+    SELECT {columns}
+    FROM chunks
+    WHERE wiki = $3
+    ORDER BY embedding <=> $1
+    LIMIT $2
+"""
+
+# Stage one walks the HNSW index on the reduced halfvec column, stage two re-ranks the
+# candidates against the full embedding
+RETRIEVE_CHUNKS_ANN_SQL = """
+    WITH candidates AS (
+        SELECT {fields}, embedding
+        FROM chunks
+        WHERE wiki = $5
+        ORDER BY embedding_ann <=> $2
+        LIMIT $3
+    )
+    SELECT {columns}
+    FROM candidates
+    ORDER BY embedding <=> $1
+    LIMIT $4
+"""
+
+# plainto_tsquery ANDs the words of the query, a question rarely has all of them in one chunk
+# so they are OR'ed instead (and re-parsed with 'simple', the lexemes are already stemmed).
+# ts_rank_cd then ranks chunks matching more, and closer, words first.
+LEXICAL_QUERY_SQL = "to_tsquery('simple', replace(plainto_tsquery('english', $1)::text, '&', '|'))"
+
+RETRIEVE_CHUNKS_LEXICAL_SQL = f"""
+    SELECT {{columns}}
+    FROM chunks, {LEXICAL_QUERY_SQL} AS query
+    WHERE wiki = $3 AND content_tsv @@ query
+    ORDER BY ts_rank_cd(content_tsv, query) DESC
+    LIMIT $2
+"""
+
+# Candidates are the best lexical matches plus the chunks of articles whose whole title appears
+# in the query (articles is small enough to test every title)
+RETRIEVE_CHUNKS_PREFILTER_SQL = f"""
+    WITH lexical AS (
+        SELECT chunk_id
+        FROM chunks, {LEXICAL_QUERY_SQL} AS query
+        WHERE wiki = $5 AND content_tsv @@ query
+        ORDER BY ts_rank_cd(content_tsv, query) DESC
+        LIMIT $2
+    ),
+    titled AS (
+        SELECT c.chunk_id
+        FROM articles a
+        JOIN chunks c ON c.article_id = a.article_id AND c.wiki = $5
+        WHERE a.wiki = $5
+          AND plainto_tsquery('simple', a.title) <> ''::tsquery
+          AND to_tsvector('simple', $1) @@ plainto_tsquery('simple', a.title)
+        LIMIT $2
+    )
+    SELECT {{columns}}
+    FROM chunks
+    WHERE wiki = $5 AND chunk_id IN (SELECT chunk_id FROM lexical UNION SELECT chunk_id FROM titled)
+    ORDER BY embedding <=> $3
+    LIMIT $4
+"""
+
+FETCH_CHUNKS_BY_ID_SQL = """
+    SELECT {columns}
+    FROM chunks
+    WHERE wiki = $2 AND chunk_id = ANY($1::int[])
+"""
+
+# Every ingested wiki, served as a model, with the on-disk size of its chunks partition
+LIST_WIKIS_SQL = """
+    SELECT wiki, title, chunk_partition, created_at,
+           COALESCE(pg_total_relation_size(to_regclass(quote_ident(chunk_partition))), 0) AS size
+    FROM wikis
+    ORDER BY wiki
+"""
+
+# Write counters for chunks and any partitions of it, used to notice that the corpus changed
+CHUNKS_VERSION_SQL = """
+    SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)
+    FROM pg_stat_user_tables
+    WHERE relid = 'chunks'::regclass
+       OR relid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'chunks'::regclass)
+"""
+
+_pool = None
+
+def _columns(with_embeddings):
+    return CHUNK_FIELDS + ", embedding" if with_embeddings else CHUNK_FIELDS
+
+async def _init_connection(conn):
+    # Send and receive pgvector values in binary instead of '[0.1, 0.2, ...]' text
+    await conn.set_type_codec(
+        "vector", schema="public", encoder=encode_vector, decoder=decode_vector, format="binary"
+    )
+    try:
+        await conn.set_type_codec(
+            "halfvec", schema="public", encoder=encode_halfvec, decoder=decode_halfvec, format="binary"
+        )
+    except ValueError:
+        # pgvector older than 0.7 has no halfvec, only exact retrieval is available
+        pass
+
+async def init_pool(pg_conn, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                    command_timeout=DB_COMMAND_TIMEOUT):
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            database=pg_conn["dbname"],
+            user=pg_conn["user"],
+            password=pg_conn["password"],
+            host=pg_conn["host"],
+            min_size=min_size,
+            max_size=max_size,
+            command_timeout=command_timeout,
+            init=_init_connection
+        )
+    return _pool
+
+def get_pool():
+    if _pool is None:
+        raise RuntimeError("Database pool is not initialized, call init_pool() first.")
+    return _pool
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+async def fetch_chunks_by_id(chunk_ids, wiki, with_embeddings=False):
+    """Fetch chunks by id, returned in the order of chunk_ids (ids that no longer exist are skipped)."""
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        rows = await conn.fetch(FETCH_CHUNKS_BY_ID_SQL.format(columns=_columns(with_embeddings)), chunk_ids, wiki)
+    by_id = {row["chunk_id"]: dict(row) for row in rows}
+    return [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+
+async def retrieve_relevant_chunks(embedding, top_k, wiki, mode=None, candidates=None, ef_search=None,
+                                   with_embeddings=False):
+    mode = mode or RETRIEVAL_MODE
+    columns = _columns(with_embeddings)
+    if mode == "mmap":
+        # The matrix scan is CPU bound, numpy releases the GIL so a worker thread keeps the loop free
+        chunk_ids, _ = await asyncio.to_thread(get_vector_index(wiki).search, embedding, top_k)
+        return await fetch_chunks_by_id(chunk_ids.tolist(), wiki, with_embeddings)
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        if mode == "exact":
+            rows = await conn.fetch(RETRIEVE_CHUNKS_SQL.format(columns=columns), embedding, top_k, wiki)
+        elif mode == "ann":
+            candidates = max(candidates or ANN_CANDIDATES, top_k)
+            ef_search = min(max(ef_search or ANN_EF_SEARCH, candidates), 1000)
+            async with conn.transaction():
+                await conn.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(ef_search))
+                rows = await conn.fetch(RETRIEVE_CHUNKS_ANN_SQL.format(fields=CHUNK_FIELDS, columns=columns),
+                                        embedding, reduce_embedding(embedding), candidates, top_k, wiki)
+        else:
+            raise ValueError(f"Unknown retrieval mode '{mode}'.")
+    return [dict(row) for row in rows]
+
+async def retrieve_lexical_chunks(query, limit, wiki, with_embeddings=False):
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        rows = await conn.fetch(RETRIEVE_CHUNKS_LEXICAL_SQL.format(columns=_columns(with_embeddings)),
+                                query, limit, wiki)
+    return [dict(row) for row in rows]
+
+async def retrieve_prefiltered_chunks(query, embedding, top_k, wiki, candidates=None, with_embeddings=False):
+    """Vector-rank only the chunks matching the query text, see RETRIEVE_CHUNKS_PREFILTER_SQL."""
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        rows = await conn.fetch(RETRIEVE_CHUNKS_PREFILTER_SQL.format(columns=_columns(with_embeddings)),
+                                query, candidates or LEXICAL_CANDIDATES, embedding, top_k, wiki)
+    return [dict(row) for row in rows]
+
+async def list_wikis():
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        return [dict(row) for row in await conn.fetch(LIST_WIKIS_SQL)]
+
+async def get_wiki(name):
+    """Return the wikis row of name, or None if no such wiki was ingested."""
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        row = await conn.fetchrow("SELECT wiki, title, chunk_partition, created_at FROM wikis WHERE wiki = $1", name)
+    return dict(row) if row else None
+
+async def chunks_version():
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        return await conn.fetchval(CHUNKS_VERSION_SQL)
@@ -1,18 +1,25 @@
-import json
-import requests
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from transformers import AutoTokenizer
 import argparse
+import asyncio
 import os
+from rag_db import (init_pool, close_pool, retrieve_relevant_chunks, retrieve_lexical_chunks,
+                    retrieve_prefiltered_chunks, get_wiki, chunks_version, RETRIEVAL_MODE, HYBRID_MODE,
+                    LEXICAL_CANDIDATES, RRF_K, PREFILTER_MIN_MATCHES)
+from vector_index import init_vector_index, close_vector_index
+from ollama_client import init_ollama_client, get_ollama_client, close_ollama_client
+from embedding_cache import init_embedding_cache, get_embedding_cache, close_embedding_cache, normalize_query
+from answer_cache import init_answer_cache, get_answer_cache, close_answer_cache
+from conversation_store import (get_conversation_store, conversation_key, Conversation, CONVERSATION_FIRST_TURN_TOKENS,
+                                CONVERSATION_TURN_TOKENS)
+from context_packer import pack_chunks, estimate_tokens
+from chunk_selection import DEFAULT_SETTINGS, select_chunks
+from metrics import RequestTimings
+from scheduler import get_scheduler, slot
+from context_budget import init_context_planner, get_context_planner, close_context_planner, MAX_TOP_K
 
 OLLAMA_EMBEDDING_MODEL = "dengcao/Qwen3-Embedding-8B:Q8_0"
 OLLAMA_LLM_MODEL = "hf.co/Qwen/Qwen3-32B-GGUF:Q8_0"
-OLLAMA_HOST = "http://fnordstation.home.arpa:11434"
-MAX_CONTEXT_TOKENS = 39000
-MAX_TOP_K = 300
-
-tokenizer = AutoTokenizer.from_pretrained("Qwen/Qwen3-Embedding-8B")
+# Tokens reserved for the prompt template around the context and question
+PROMPT_OVERHEAD_TOKENS = 300
 
 def get_pg_conn(args=None):
 
@@ -32,91 +39,421 @@ def get_pg_conn(args=None):
         
     return PG_CONN
 
-def get_query_embedding(text):
-    resp = requests.post(
-        f"{OLLAMA_HOST}/api/embeddings",
-        headers={"Content-Type": "application/json"},
-        data=json.dumps({"model": OLLAMA_EMBEDDING_MODEL, "prompt": text})
-    )
-    resp.raise_for_status()
-    return resp.json()["embedding"]
-
-def retrieve_relevant_chunks(embedding, top_k, pg_conn):
-    conn = psycopg2.connect(**pg_conn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT content, article_id, chunk_index
-        FROM chunks
-        ORDER BY embedding <=> %s::vector
-        LIMIT %s;
-    """, (embedding, top_k))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return rows
-
-def trim_chunks_to_fit(chunks, query, max_tokens=MAX_CONTEXT_TOKENS):
-    used_tokens = len(tokenizer.encode(query, add_special_tokens=False)) + 300
-    selected = []
-    for chunk in chunks:
-        chunk_tokens = tokenizer.encode(chunk["content"], add_special_tokens=False)
-        if used_tokens + len(chunk_tokens) > max_tokens:
-            break
-        selected.append(chunk)
-        used_tokens += len(chunk_tokens)
-    return selected, used_tokens
+async def embed_query(text, client=None):
+    async with slot("embed", client):
+        embeddings = await get_ollama_client().embed([text], OLLAMA_EMBEDDING_MODEL)
+    return embeddings[0]
+
+async def get_query_embedding(text, client=None):
+    cache = get_embedding_cache()
+    if cache is None:
+        return await embed_query(text, client)
+    return await cache.get_or_compute(text, OLLAMA_EMBEDDING_MODEL, lambda t: embed_query(t, client))
+
+def reciprocal_rank_fusion(rankings, limit, k=RRF_K):
+    """Merge ranked chunk lists, scoring each chunk by the sum of 1 / (k + rank) over the lists."""
+    scores = {}
+    chunks = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            scores[chunk["chunk_id"]] = scores.get(chunk["chunk_id"], 0.0) + 1.0 / (k + rank)
+            chunks.setdefault(chunk["chunk_id"], chunk)
+    fused = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [chunks[chunk_id] for chunk_id in fused]
+
+async def retrieve_chunks(query, query_embedding, wiki, top_k=MAX_TOP_K, hybrid=None, with_embeddings=False,
+                          mode=None, candidates=None):
+    """Retrieve chunks of wiki for a query, by vector similarity alone or combined with full-text search (HYBRID_MODE).
+
+    mode and candidates override RETRIEVAL_MODE and ANN_CANDIDATES of the vector ranking."""
+    hybrid = hybrid or HYBRID_MODE
+    if hybrid == "rrf":
+        # Separate pooled connections, so both queries run at the same time
+        vector, lexical = await asyncio.gather(
+            retrieve_relevant_chunks(query_embedding, top_k, wiki, mode=mode, candidates=candidates,
+                                     with_embeddings=with_embeddings),
+            retrieve_lexical_chunks(query, LEXICAL_CANDIDATES, wiki, with_embeddings=with_embeddings)
+        )
+        return reciprocal_rank_fusion([vector, lexical], top_k)
+    if hybrid == "prefilter":
+        chunks = await retrieve_prefiltered_chunks(query, query_embedding, top_k, wiki, with_embeddings=with_embeddings)
+        if len(chunks) >= PREFILTER_MIN_MATCHES:
+            return chunks
+    elif hybrid != "off":
+        raise ValueError(f"Unknown hybrid mode '{hybrid}'.")
+    return await retrieve_relevant_chunks(query_embedding, top_k, wiki, mode=mode, candidates=candidates,
+                                          with_embeddings=with_embeddings)
+
+def trim_chunks_to_fit(chunks, query, max_tokens):
+    """Pack retrieved chunks into max_tokens using their stored token counts, see context_packer.py.
+
+    Returns (spans, used_tokens), overlapping chunks of an article come back merged into one span.
+    """
+    reserved = estimate_tokens(query) + PROMPT_OVERHEAD_TOKENS
+    spans, packed_tokens = pack_chunks(chunks, max_tokens - reserved)
+    return spans, reserved + packed_tokens
+
+def format_context(chunks):
+    return "\n\n".join(chunk["content"] for chunk in chunks)
 
 def build_prompt(chunks, query, wiki):
-    context = "\n\n".join(chunk["content"] for chunk in chunks)
     return f"""You are an expert assistant helping answer questions about the world of {wiki}.
 
 Use only the context provided below. If the answer is not present, say so.
 
 ### Context:
-{context}
+{format_context(chunks)}
 
 ### Question:
 {query}
 
 ### Answer:"""
 
-def generate_answer(prompt):
-    resp = requests.post(
-        f"{OLLAMA_HOST}/api/generate",
-        headers={"Content-Type": "application/json"},
-        data=json.dumps({"model": OLLAMA_LLM_MODEL, "prompt": prompt})
-    )
-    resp.raise_for_status()
-    output = ""
-    for line in resp.iter_lines():
-        if line:
-            output += json.loads(line)["response"]
-    return output
-
-def rag_query(query, wiki, pg_conn):
-    query_embedding = get_query_embedding(query)
-    raw_chunks = retrieve_relevant_chunks(query_embedding, MAX_TOP_K, pg_conn)
-    chunks, used_tokens = trim_chunks_to_fit(raw_chunks, query)
-    rag_prompt = build_prompt(chunks, query, wiki)
-    answer = generate_answer(rag_prompt)
-    return {
-        "answer": answer,
-        "chunks_used": len(chunks),
-        "tokens_used": used_tokens
+def build_chat_messages(chunks, query, wiki):
+    # The first turn's context lives in the system message, the prefix every later turn shares
+    return [
+        {"role": "system", "content": f"""You are an expert assistant helping answer questions about the world of {wiki}.
+
+Use only the context provided below and in the user's messages. If the answer is not present, say so.
+
+### Context:
+{format_context(chunks)}"""},
+        {"role": "user", "content": query}
+    ]
+
+def follow_up_message(chunks, query):
+    if not chunks:
+        return {"role": "user", "content": query}
+    return {"role": "user", "content": f"""### Additional context:
+{format_context(chunks)}
+
+### Question:
+{query}"""}
+
+# Ollama's final stream message carries these timing stats, all durations in nanoseconds
+OLLAMA_STATS_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration",
+                       "eval_count", "eval_duration")
+
+async def generate_answer_stream(prompt, client=None, num_ctx=None):
+    async with slot("generate", client):
+        async for part in get_ollama_client().generate_stream(prompt, OLLAMA_LLM_MODEL, num_ctx):
+            yield part
+
+async def generate_answer(prompt, client=None, num_ctx=None):
+    return "".join([part.get("response", "") async for part in generate_answer_stream(prompt, client, num_ctx)])
+
+async def chat_answer_stream(messages, client=None, affinity=None, num_ctx=None):
+    async with slot("generate", client):
+        async for part in get_ollama_client().chat_stream(messages, OLLAMA_LLM_MODEL, affinity, num_ctx):
+            yield part
+
+async def _retrieve_and_select(query, query_embedding, wiki, settings, hybrid, top_k, timings):
+    """Return (retrieved, selected) chunks, the same list when selection is disabled."""
+    with timings.stage("retrieve"):
+        raw_chunks = await retrieve_chunks(query, query_embedding, wiki, top_k=top_k, hybrid=hybrid,
+                                           with_embeddings=settings.enabled)
+    if not settings.enabled:
+        return raw_chunks, raw_chunks
+    with timings.stage("select"):
+        return raw_chunks, select_chunks(raw_chunks, query_embedding, settings)
+
+def answer_cache_scope(wiki, settings, hybrid, plan):
+    # Everything besides the question that changes the answer. The requested latency target and
+    # window rather than the planned tokens, which move with the learned prefill speed
+    return (wiki, settings, hybrid or HYBRID_MODE, plan.latency_target, plan.num_ctx)
+
+def plan_fields(plan):
+    return {"context_budget": plan.context_tokens, "latency_target": plan.latency_target}
+
+async def rag_query_stream(query, wiki, selection=None, hybrid=None, client=None, budget=None):
+    """Yield Ollama /api/generate stream messages as they arrive, answering from the chunks of wiki.
+
+    The final message (done=True) also carries chunks_used, spans_used, tokens_used and retrieval_duration,
+    and its total_duration covers retrieval as well as generation. Answers served from the
+    semantic answer cache arrive as a single message and are marked cached=True. Its timings
+    field breaks the request down by stage (see metrics.RequestTimings).
+
+    selection is a dict of chunk_selection.SelectionSettings overrides for this query. When
+    selection is enabled the final message also reports candidates, selected and tokens_saved
+    (compared to packing the retrieved chunks as they came). hybrid overrides HYBRID_MODE.
+
+    client identifies the caller for fair queueing (see scheduler.py). With a scheduler, a query
+    identical to one already in flight follows that run instead of starting its own, its final
+    message is marked coalesced=True. scheduler.QueueFull is raised when the server is too busy.
+
+    budget is a dict of context_budget.ContextPlanner.plan overrides ("latency_target", "num_ctx")
+    that size the retrieval and the context, the final message reports the context_budget used.
+    """
+    settings = DEFAULT_SETTINGS.with_overrides(selection)
+    plan = await get_context_planner().plan(budget)
+    scheduler = get_scheduler()
+    run = lambda: _rag_query_stream(query, wiki, settings, hybrid, client, plan)
+    if scheduler is None:
+        parts = run()
+    else:
+        key = (wiki, normalize_query(query), settings, hybrid or HYBRID_MODE, plan.context_tokens, plan.top_k)
+        parts = scheduler.single_flight(key, run)
+    async for part in parts:
+        yield part
+
+async def _timed_request(wiki, answer):
+    """Yield the parts of answer(timings, wiki_info, log_fields) and record the request's outcome.
+
+    answer adds what should be logged to log_fields as soon as it is known. The outcome is ok once
+    the final part (done=True) has been yielded, cached when that part is marked cached.
+    """
+    timings = RequestTimings(wiki)
+    outcome = "cancelled"
+    log_fields = {}
+    try:
+        wiki_info = await get_wiki(wiki)
+        if wiki_info is None:
+            raise LookupError(f"Wiki '{wiki}' has not been ingested.")
+        async for part in answer(timings, wiki_info, log_fields):
+            if part.get("done"):
+                outcome = "cached" if part.get("cached") else "ok"
+            yield part
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        timings.finish(outcome, **log_fields)
+
+async def _stream_answer(parts, timings, log_fields, on_answer):
+    """Yield generate stream parts, the final one also carrying log_fields, the durations and timings.
+
+    on_answer is called with the whole answer text before the final part is yielded.
+    """
+    retrieval_duration = timings.elapsed_ns()
+    answer = []
+    with timings.stage("generate"):
+        async for part in parts:
+            if part.get("response"):
+                timings.mark_first_token()
+            answer.append(part.get("response", ""))
+            if part.get("done"):
+                timings.record_generation(part)
+                get_context_planner().observe(part)
+                on_answer("".join(answer))
+                part = dict(part, **log_fields, retrieval_duration=retrieval_duration,
+                            total_duration=timings.elapsed_ns(), timings=timings.breakdown())
+            yield part
+
+async def _as_generate_parts(parts):
+    # /api/chat puts the text in message.content where /api/generate has response
+    async for part in parts:
+        part["response"] = part.pop("message", {}).get("content", "")
+        yield part
+
+def _rag_query_stream(query, wiki, settings, hybrid, client, plan):
+    return _timed_request(wiki, lambda timings, wiki_info, log_fields: _answer_query(
+        query, wiki_info, settings, hybrid, client, plan, timings, log_fields))
+
+async def _answer_query(query, wiki_info, settings, hybrid, client, plan, timings, log_fields):
+    wiki = wiki_info["wiki"]
+    with timings.stage("embed"):
+        query_embedding = await get_query_embedding(query, client)
+    answer_cache = get_answer_cache()
+    cache_scope = answer_cache_scope(wiki, settings, hybrid, plan)
+    if answer_cache is not None:
+        await answer_cache.check_corpus_version(chunks_version)
+        cached = answer_cache.lookup(query_embedding, cache_scope)
+        if cached is not None:
+            timings.mark_first_token()
+            yield {"response": cached["answer"], "done": False}
+            log_fields.update(chunks_used=len(cached["chunk_ids"]), similarity=cached["similarity"])
+            yield {
+                "response": "",
+                "done": True,
+                "done_reason": "stop",
+                "cached": True,
+                "similarity": cached["similarity"],
+                "chunks_used": len(cached["chunk_ids"]),
+                "tokens_used": 0,
+                "retrieval_duration": timings.elapsed_ns(),
+                "total_duration": timings.elapsed_ns(),
+                "timings": timings.breakdown()
+            }
+            return
+    raw_chunks, selected = await _retrieve_and_select(query, query_embedding, wiki, settings, hybrid, plan.top_k,
+                                                      timings)
+    selection_stats = {}
+    if settings.enabled:
+        with timings.stage("pack"):
+            spans, used_tokens = trim_chunks_to_fit(selected, query, plan.context_tokens)
+        _, unselected_tokens = trim_chunks_to_fit(raw_chunks, query, plan.context_tokens)
+        selection_stats = {
+            "candidates": len(raw_chunks),
+            "selected": len(selected),
+            "tokens_saved": unselected_tokens - used_tokens
+        }
+    else:
+        with timings.stage("pack"):
+            spans, used_tokens = trim_chunks_to_fit(raw_chunks, query, plan.context_tokens)
+    chunk_ids = [chunk_id for span in spans for chunk_id in span["chunk_ids"]]
+    rag_prompt = build_prompt(spans, query, wiki_info["title"])
+    log_fields.update(chunks_used=len(chunk_ids), spans_used=len(spans), tokens_used=used_tokens,
+                      **plan_fields(plan), **selection_stats)
+
+    def cache_answer(answer):
+        if answer_cache is not None:
+            answer_cache.put(query_embedding, cache_scope, query, chunk_ids, answer)
+
+    async for part in _stream_answer(generate_answer_stream(rag_prompt, client, plan.num_ctx), timings, log_fields,
+                                     cache_answer):
+        yield part
+
+async def rag_chat_stream(messages, wiki, selection=None, hybrid=None, client=None, budget=None):
+    """Answer the last of a chat's messages ({"role", "content"} dicts), yielding the same
+    parts as rag_query_stream.
+
+    Without a conversation store (CONVERSATIONS_ENABLED) only the last message is answered. With
+    one, the first turn packs CONVERSATION_FIRST_TURN_TOKENS of context into a system message and
+    the messages sent to Ollama are kept. A follow-up retrieves for its own question, but only
+    chunks not yet in the conversation are added, at most CONVERSATION_TURN_TOKENS of them, in a
+    new user message after the unchanged earlier ones, so Ollama only prefills the new tokens.
+    The final message also reports the conversation turn and reused_tokens, the estimated
+    prompt tokens shared with the previous turn. The latency target of budget bounds the new
+    tokens of a turn, and a conversation that has outgrown the context window starts over with
+    a fresh context.
+    """
+    store = get_conversation_store()
+    query = messages[-1]["content"]
+    if store is None:
+        async for part in rag_query_stream(query, wiki, selection, hybrid, client, budget):
+            yield part
+        return
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        scheduler.admit()
+    settings = DEFAULT_SETTINGS.with_overrides(selection)
+    plan = await get_context_planner().plan(budget)
+    async for part in _timed_request(wiki, lambda timings, wiki_info, log_fields: _answer_chat(
+            messages, store, wiki_info, settings, hybrid, client, plan, timings, log_fields)):
+        yield part
+
+async def _answer_chat(messages, store, wiki_info, settings, hybrid, client, plan, timings, log_fields):
+    wiki = wiki_info["wiki"]
+    query = messages[-1]["content"]
+    query_tokens = estimate_tokens(query) + PROMPT_OVERHEAD_TOKENS
+    conversation = store.get(conversation_key(wiki, messages[:-1])) if len(messages) > 1 else None
+    if conversation is not None:
+        context_tokens = min(CONVERSATION_TURN_TOKENS, plan.context_tokens,
+                             plan.max_tokens - conversation.tokens) - query_tokens
+        if context_tokens <= 0:
+            conversation = None
+    if conversation is None:
+        context_tokens = min(CONVERSATION_FIRST_TURN_TOKENS, plan.context_tokens) - query_tokens
+    with timings.stage("embed"):
+        query_embedding = await get_query_embedding(query, client)
+    _, candidates = await _retrieve_and_select(query, query_embedding, wiki, settings, hybrid, plan.top_k, timings)
+    if conversation is not None:
+        candidates = [chunk for chunk in candidates if chunk["chunk_id"] not in conversation.chunk_ids]
+    with timings.stage("pack"):
+        spans, packed_tokens = pack_chunks(candidates, context_tokens)
+        # Ordered by position, not relevance, so the same chunks always produce the same text
+        spans.sort(key=lambda span: (span["article_id"], span["start_token"]))
+    chunk_ids = [chunk_id for span in spans for chunk_id in span["chunk_ids"]]
+    if conversation is None:
+        chat_messages = build_chat_messages(spans, query, wiki_info["title"])
+        reused_tokens, known_chunk_ids, turn = 0, frozenset(), 1
+    else:
+        chat_messages = conversation.messages + [follow_up_message(spans, query)]
+        reused_tokens, known_chunk_ids, turn = conversation.tokens, conversation.chunk_ids, conversation.turns + 1
+    used_tokens = reused_tokens + query_tokens + packed_tokens
+    log_fields.update(chunks_used=len(chunk_ids), spans_used=len(spans), tokens_used=used_tokens,
+                      turn=turn, reused_tokens=reused_tokens, **plan_fields(plan))
+
+    def keep_conversation(answer):
+        reply = {"role": "assistant", "content": answer}
+        store.put(conversation_key(wiki, messages + [reply]), Conversation(
+            wiki=wiki,
+            messages=chat_messages + [reply],
+            chunk_ids=known_chunk_ids | frozenset(chunk_ids),
+            tokens=used_tokens + estimate_tokens(answer),
+            turns=turn
+        ))
+
+    # Every turn of a conversation starts with the same message, keep them on one Ollama host
+    parts = chat_answer_stream(chat_messages, client, conversation_key(wiki, messages[:1]), plan.num_ctx)
+    async for part in _stream_answer(_as_generate_parts(parts), timings, log_fields, keep_conversation):
+        yield part
+
+async def _collect(parts, include_timings):
+    answer = []
+    final = {}
+    async for part in parts:
+        answer.append(part.get("response", ""))
+        if part.get("done"):
+            final = part
+    result = {
+        "answer": "".join(answer),
+        "chunks_used": final.get("chunks_used", 0),
+        "tokens_used": final.get("tokens_used", 0),
+        "tokens_saved": final.get("tokens_saved", 0),
+        "context_budget": final.get("context_budget")
     }
+    if include_timings:
+        result["timings"] = final.get("timings", {})
+    return result
+
+async def rag_query(query, wiki, selection=None, hybrid=None, include_timings=False, client=None, budget=None):
+    return await _collect(rag_query_stream(query, wiki, selection, hybrid, client, budget), include_timings)
+
+async def rag_chat(messages, wiki, selection=None, hybrid=None, include_timings=False, client=None, budget=None):
+    return await _collect(rag_chat_stream(messages, wiki, selection, hybrid, client, budget), include_timings)
+
+def init_planner():
+    # Resolves the client on every call, so the window is read from whichever Ollama serves it
+    return init_context_planner(OLLAMA_LLM_MODEL, lambda model: get_ollama_client().show(model))
+
+async def run_query(query, wiki, pg_conn, selection=None, hybrid=None, budget=None):
+    # Two connections so the lexical and vector queries of hybrid retrieval can run together
+    await init_pool(pg_conn, min_size=1, max_size=2)
+    init_ollama_client()
+    init_planner()
+    init_embedding_cache()
+    init_answer_cache()
+    if RETRIEVAL_MODE == "mmap":
+        init_vector_index()
+    try:
+        return await rag_query(query, wiki, selection, hybrid, budget=budget)
+    finally:
+        close_vector_index()
+        close_answer_cache()
+        close_embedding_cache()
+        close_context_planner()
+        await close_ollama_client()
+        await close_pool()
 
 def main():
     parser = argparse.ArgumentParser(description="RAG query fandom wiki.")
-    parser.add_argument('--wiki', required=True, help='the name of the wiki')
+    parser.add_argument('--wiki', required=True, help='the wiki to query, as passed to chunk_embed_insert.py --wiki')
     parser.add_argument('--query', required=True, help='The user query/question')
     parser.add_argument('--db-host', help='Database host')
     parser.add_argument('--db-name', help='Database name')
     parser.add_argument('--db-user', help='Database user')
     parser.add_argument('--db-pass', help='Database password')
+    parser.add_argument('--hybrid', choices=['off', 'rrf', 'prefilter'], help='Combine vector retrieval with full-text search')
+    parser.add_argument('--select', action='store_true', default=None, help='Diversify retrieved chunks with MMR and an adaptive cutoff')
+    parser.add_argument('--mmr-lambda', type=float, help='MMR trade-off, 1.0 ranks by relevance only')
+    parser.add_argument('--min-relative-similarity', type=float, help='Drop chunks below this fraction of the best similarity')
+    parser.add_argument('--score-gap', type=float, help='Cut the ranking at the first similarity drop larger than this')
+    parser.add_argument('--max-selected', type=int, help='Maximum number of selected chunks')
+    parser.add_argument('--latency-target', help="'fast', 'thorough' or seconds to the first token, sizes the context")
+    parser.add_argument('--num-ctx', type=int, help='Use at most this much of the model context window')
     args = parser.parse_args()
     pg_conn = get_pg_conn(args)
-    result = rag_query(args.query, args.wiki, pg_conn)
-    print(f"\n[debug] Using {result['chunks_used']} chunks and total prompt tokens = {result['tokens_used']} / {MAX_CONTEXT_TOKENS}")
+    selection = {
+        "enabled": args.select,
+        "mmr_lambda": args.mmr_lambda,
+        "min_relative_similarity": args.min_relative_similarity,
+        "score_gap": args.score_gap,
+        "max_selected": args.max_selected
+    }
+    budget = {"latency_target": args.latency_target, "num_ctx": args.num_ctx}
+    result = asyncio.run(run_query(args.query, args.wiki, pg_conn, selection, args.hybrid, budget))
+    print(f"\n[debug] Using {result['chunks_used']} chunks and total prompt tokens = {result['tokens_used']} / {result['context_budget']} ({result['tokens_saved']} saved by selection)")
     print(result["answer"])
 
 if __name__ == "__main__":
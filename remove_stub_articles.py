@@ -2,15 +2,7 @@ import json
 from pathlib import Path
 import argparse
 import sys
-
-STUB_PHRASE = (
-    "This article is a <a href=\"/wiki/Category:Stubs\" title=\"Category:Stubs\">stub</a>. You can help Clair Obscur Wiki by"
-)
-
-
-def is_stub_html(html: str) -> bool:
-    # Minimal exact-match approach; can be improved later
-    return STUB_PHRASE in html
+from extract_text import is_stub_html
 
 
 def get_output_path(input_path: Path) -> Path:
@@ -47,8 +39,9 @@ def main():
             total += 1
             try:
                 record = json.loads(line)
-                html = record.get("html", "")
-                if not is_stub_html(html):
+                # extract_text.py --keep-stubs marks stubs and drops the html unless --keep-html
+                stub = record.get("stub") or is_stub_html(record.get("html", ""))
+                if not stub:
                     outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
                     kept += 1
             except Exception as e:
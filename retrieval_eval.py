@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+from rag_db import init_pool, close_pool, get_pool, DB_POOL_TIMEOUT, RETRIEVAL_MODE
+from rag_query import get_pg_conn, retrieve_chunks, trim_chunks_to_fit, OLLAMA_EMBEDDING_MODEL
+from vector_index import init_vector_index, close_vector_index, SEARCH_BLOCK_ROWS, VECTOR_INDEX_PATH
+from ollama_client import init_ollama_client, get_ollama_client, close_ollama_client
+from chunk_selection import DEFAULT_SETTINGS, select_chunks
+from context_budget import FALLBACK_CONTEXT_WINDOW, ANSWER_RESERVE_TOKENS, MAX_TOP_K
+
+# Measures what a retrieval configuration gives up in recall for the latency and context it
+# saves. Every query is embedded once, the exact top k of every wiki is computed by brute force
+# over all of its embeddings, and each strategy is scored against that and against the gold
+# chunks and articles of the query set.
+#
+# Query set, one JSON object per line:
+#   {"query": "...", "wiki": "clair-obscur", "gold_chunk_ids": [...], "gold_article_ids": [...], "gold_titles": [...]}
+# wiki defaults to --wiki, the gold fields are optional. Titles survive a re-ingest, ids don't.
+#
+# A strategy is "name:key=value,...", with keys mode (exact, ann, mmap), hybrid (off, rrf,
+# prefilter), top_k, candidates (ann), select (1 applies chunk_selection.py), context (prompt
+# tokens the chunks are packed into) and wiki, to compare wikis ingested with different chunk sizes.
+
+STRATEGY_KEYS = {"mode": str, "hybrid": str, "top_k": int, "candidates": int, "select": lambda v: v == "1",
+                 "context": int, "wiki": str}
+
+def parse_strategy(spec):
+    name, _, options = spec.partition(":")
+    strategy = {"name": name, "mode": None, "hybrid": None, "top_k": MAX_TOP_K, "candidates": None,
+                "select": False, "context": FALLBACK_CONTEXT_WINDOW - ANSWER_RESERVE_TOKENS, "wiki": None}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        if key not in STRATEGY_KEYS:
+            raise ValueError(f"Unknown strategy option '{key}' in '{spec}', use {', '.join(STRATEGY_KEYS)}.")
+        strategy[key] = STRATEGY_KEYS[key](value)
+    return strategy
+
+def load_queries(path, default_wiki=None):
+    queries = []
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            query = json.loads(line)
+            query.setdefault("wiki", default_wiki)
+            if not query["wiki"]:
+                raise ValueError(f"Query on line {number} of {path} has no wiki and --wiki is not set.")
+            queries.append(query)
+    return queries
+
+async def embed_queries(texts, batch_size=32):
+    """Embed the queries with batched /api/embed requests, returns a normalized len(texts) x dim matrix."""
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        embeddings += await get_ollama_client().embed(texts[start:start + batch_size], OLLAMA_EMBEDDING_MODEL)
+    return _normalize(np.asarray(embeddings, dtype=np.float32))
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+async def wiki_embedding_blocks(wiki):
+    """Yield (chunk_ids, normalized embedding matrix) of the embedded chunks of wiki, SEARCH_BLOCK_ROWS at a time."""
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor(
+                "SELECT chunk_id, embedding FROM chunks WHERE wiki = $1 AND embedding IS NOT NULL ORDER BY chunk_id", wiki)
+            while rows := await cursor.fetch(SEARCH_BLOCK_ROWS):
+                yield (np.array([row["chunk_id"] for row in rows], dtype=np.int64),
+                       _normalize(np.stack([row["embedding"] for row in rows])))
+
+async def resolve_titles(wiki, titles):
+    async with get_pool().acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        rows = await conn.fetch("SELECT article_id FROM articles WHERE wiki = $1 AND title = ANY($2)", wiki, titles)
+    return [row["article_id"] for row in rows]
+
+class RunningTopK:
+    """Exact top k chunk ids of every query row, fed one block of embeddings at a time.
+
+    Only the best k of every query are carried from block to block, so memory stays at
+    queries x (k + block rows) scores however many chunks there are.
+    """
+
+    def __init__(self, query_matrix, k):
+        self.query_matrix = query_matrix
+        self.k = k
+        self.rows = 0
+        self.scores = np.empty((len(query_matrix), 0), dtype=np.float32)
+        self.ids = np.empty((len(query_matrix), 0), dtype=np.int64)
+
+    def add(self, ids, block):
+        scores = np.concatenate([self.scores, self.query_matrix @ block.T], axis=1)
+        ids = np.concatenate([self.ids, np.broadcast_to(ids, (len(self.query_matrix), len(ids)))], axis=1)
+        if scores.shape[1] > self.k:
+            top = np.argpartition(-scores, self.k - 1, axis=1)[:, :self.k]
+            scores = np.take_along_axis(scores, top, axis=1)
+            ids = np.take_along_axis(ids, top, axis=1)
+        self.scores, self.ids = scores, ids
+        self.rows += len(block)
+
+    def result(self):
+        """queries x min(k, rows) chunk ids, best first."""
+        return np.take_along_axis(self.ids, np.argsort(-self.scores, axis=1), axis=1)
+
+
+def percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 1) if values else None
+
+async def evaluate(queries, strategies, k=10, embed_batch_size=32, warmup=1):
+    """Score every strategy on queries, returns a summary dict per strategy."""
+    started = time.perf_counter()
+    query_matrix = await embed_queries([query["query"] for query in queries], embed_batch_size)
+    print(f"Embedded {len(queries)} queries in {time.perf_counter() - started:.1f}s")
+
+    # Gold articles by title are resolved per wiki, a strategy can run against another wiki
+    gold_articles = {}
+
+    async def gold_for(i, wiki):
+        query = queries[i]
+        if (i, wiki) not in gold_articles:
+            article_ids = set(query.get("gold_article_ids") or ())
+            if query.get("gold_titles"):
+                article_ids.update(await resolve_titles(wiki, query["gold_titles"]))
+            gold_articles[i, wiki] = article_ids
+        return set(query.get("gold_chunk_ids") or ()), gold_articles[i, wiki]
+
+    exact = {}
+    for wiki in sorted({strategy["wiki"] or query["wiki"] for strategy in strategies for query in queries}):
+        started = time.perf_counter()
+        rows = [i for i, query in enumerate(queries) if any((s["wiki"] or query["wiki"]) == wiki for s in strategies)]
+        top = RunningTopK(query_matrix[rows], k)
+        async for ids, block in wiki_embedding_blocks(wiki):
+            top.add(ids, block)
+        if not top.rows:
+            raise ValueError(f"Wiki '{wiki}' has no embedded chunks.")
+        for i, best in zip(rows, top.result()):
+            exact[i, wiki] = set(best.tolist())
+        print(f"Exact top {k} over {top.rows} chunks of {wiki} in {time.perf_counter() - started:.1f}s")
+
+    async def retrieve(strategy, i):
+        query, embedding = queries[i], query_matrix[i]
+        started = time.perf_counter()
+        chunks = await retrieve_chunks(query["query"], embedding, strategy["wiki"] or query["wiki"],
+                                       top_k=strategy["top_k"], hybrid=strategy["hybrid"],
+                                       with_embeddings=strategy["select"], mode=strategy["mode"],
+                                       candidates=strategy["candidates"])
+        if strategy["select"]:
+            chunks = select_chunks(chunks, embedding, DEFAULT_SETTINGS)
+        return chunks, time.perf_counter() - started
+
+    summaries = []
+    for strategy in strategies:
+        # Untimed, so the first measured query doesn't pay for cold connections and page cache
+        for i in range(min(warmup, len(queries))):
+            await retrieve(strategy, i)
+        latencies, recalls, context_recalls, gold_recalls, reciprocal_ranks, tokens = [], [], [], [], [], []
+        for i, query in enumerate(queries):
+            wiki = strategy["wiki"] or query["wiki"]
+            chunks, elapsed = await retrieve(strategy, i)
+            spans, used = trim_chunks_to_fit(chunks, query["query"], strategy["context"])
+            context_ids = {chunk_id for span in spans for chunk_id in span["chunk_ids"]}
+            context_articles = {span["article_id"] for span in spans}
+            truth = exact[i, wiki]
+            latencies.append(elapsed)
+            tokens.append(used)
+            recalls.append(len(truth & {chunk["chunk_id"] for chunk in chunks[:k]}) / len(truth))
+            context_recalls.append(len(truth & context_ids) / len(truth))
+            gold_chunks, gold_article_ids = await gold_for(i, wiki)
+            if gold_chunks or gold_article_ids:
+                found = len(gold_chunks & context_ids) + len(gold_article_ids & context_articles)
+                gold_recalls.append(found / (len(gold_chunks) + len(gold_article_ids)))
+                rank = next((rank for rank, chunk in enumerate(chunks, start=1)
+                             if chunk["chunk_id"] in gold_chunks or chunk["article_id"] in gold_article_ids), None)
+                reciprocal_ranks.append(1 / rank if rank else 0.0)
+        summaries.append({
+            "strategy": strategy["name"],
+            "options": {key: value for key, value in strategy.items() if key != "name"},
+            "queries": len(latencies),
+            f"recall@{k}": round(float(np.mean(recalls)), 4),
+            "context_recall": round(float(np.mean(context_recalls)), 4),
+            "gold_recall": round(float(np.mean(gold_recalls)), 4) if gold_recalls else None,
+            "mrr": round(float(np.mean(reciprocal_ranks)), 4) if reciprocal_ranks else None,
+            "p50_ms": percentile_ms(latencies, 50),
+            "p95_ms": percentile_ms(latencies, 95),
+            "context_tokens": round(float(np.mean(tokens))),
+        })
+        print(f"Evaluated {strategy['name']}")
+    return summaries
+
+def print_table(summaries, k):
+    columns = ["strategy", f"recall@{k}", "context_recall", "gold_recall", "mrr", "p50_ms", "p95_ms", "context_tokens"]
+    rows = [["-" if summary[column] is None else str(summary[column]) for column in columns] for summary in summaries]
+    widths = [max(len(column), *(len(row[n]) for row in rows)) for n, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+async def run_eval(args, pg_conn):
+    queries = load_queries(args.queries, args.wiki)
+    strategies = [parse_strategy(spec) for spec in args.strategy or [f"{RETRIEVAL_MODE}:"]]
+    if args.limit:
+        queries = queries[:args.limit]
+    await init_pool(pg_conn, min_size=1, max_size=2)
+    init_ollama_client()
+    if any((strategy["mode"] or RETRIEVAL_MODE) == "mmap" for strategy in strategies):
+        init_vector_index(args.vector_index or VECTOR_INDEX_PATH)
+    try:
+        return await evaluate(queries, strategies, k=args.k, embed_batch_size=args.embed_batch_size,
+                              warmup=args.warmup)
+    finally:
+        close_vector_index()
+        await close_ollama_client()
+        await close_pool()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare retrieval strategies by recall, MRR, latency and context size.")
+    parser.add_argument('--queries', required=True, help='JSONL query set with optional gold chunk ids, article ids or titles')
+    parser.add_argument('--wiki', help='Wiki of queries that don\'t name one')
+    parser.add_argument('--strategy', action='append', help="name:key=value,... repeat to compare (e.g. ann200:mode=ann,candidates=200)")
+    parser.add_argument('--k', type=int, default=10, help='Chunks compared with the exact top k')
+    parser.add_argument('--warmup', type=int, default=1, help='Queries run before timing starts, per strategy')
+    parser.add_argument('--limit', type=int, help='Only evaluate the first N queries')
+    parser.add_argument('--embed-batch-size', type=int, default=32, help='Queries embedded per Ollama request')
+    parser.add_argument('--vector-index', help='Base directory of the mmap vector index (defaults to VECTOR_INDEX_PATH)')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--db-host', help='Database host')
+    parser.add_argument('--db-name', help='Database name')
+    parser.add_argument('--db-user', help='Database user')
+    parser.add_argument('--db-pass', help='Database password')
+    args = parser.parse_args()
+    summaries = asyncio.run(run_eval(args, get_pg_conn(args)))
+    print()
+    print_table(summaries, args.k)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"k": args.k, "queries": args.queries, "results": summaries}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from metrics import QUEUE_WAIT_SECONDS, QUEUE_WAITING, QUEUE_REJECTED, COALESCED_REQUESTS
+
+# Scheduling in front of Ollama, uvicorn_wrapper.py sets these from its command line arguments.
+# Embedding and generation each get a concurrency limit; requests over the limit wait in a
+# bounded queue that hands out free slots round-robin between clients, so one user sending many
+# chats can't starve the others. Identical queries in flight at the same time share one run.
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+# Match OLLAMA_NUM_PARALLEL, more concurrent prompts only make every prefill slower
+GENERATE_CONCURRENCY = int(os.environ.get("GENERATE_CONCURRENCY", "1"))
+# Requests waiting for a slot beyond this are rejected straight away
+MAX_QUEUED = int(os.environ.get("MAX_QUEUED", "16"))
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "1") == "1"
+
+class QueueFull(Exception):
+    """Raised when a request can't be queued, rag_api.py answers it with a 503."""
+
+    def __init__(self, stage, queued, retry_after):
+        super().__init__(f"Server busy: {queued} requests are already waiting for {stage}, try again in {retry_after}s.")
+        self.stage = stage
+        self.queued = queued
+        self.retry_after = retry_after
+
+class FairLimiter:
+    """Concurrency limit with a bounded wait queue served round-robin by client.
+
+    Waiters are kept in one FIFO per client; when a slot frees up the client at the front of the
+    rotation gets it and moves to the back, so clients take turns whatever their queue lengths.
+    """
+
+    def __init__(self, stage, concurrency, max_queued=MAX_QUEUED):
+        self.stage = stage
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self._waiters = OrderedDict()  # client -> deque of futures, in rotation order
+        self._hold_seconds = None  # moving average of how long a slot is held
+
+    def full(self):
+        return self.active >= self.concurrency and self.queued >= self.max_queued
+
+    def retry_after(self):
+        """Seconds until the queue has likely drained enough for one more request."""
+        hold = self._hold_seconds or 1.0
+        return max(1, math.ceil(hold * (self.queued + 1) / self.concurrency))
+
+    def reject(self):
+        self.rejected += 1
+        QUEUE_REJECTED.labels(self.stage).inc()
+        raise QueueFull(self.stage, self.queued, self.retry_after())
+
+    async def acquire(self, client):
+        if self.active < self.concurrency and not self.queued:
+            self.active += 1
+            return
+        if self.queued >= self.max_queued:
+            self.reject()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(client, deque()).append(future)
+        self._set_queued(self.queued + 1)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the waiter gave up, pass it on
+                self.release()
+            else:
+                self._remove(client, future)
+            raise
+
+    def release(self):
+        while self._waiters:
+            client, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiters.move_to_end(client)
+            else:
+                del self._waiters[client]
+            self._set_queued(self.queued - 1)
+            if not future.done():
+                future.set_result(None)  # the slot passes to the waiter, active is unchanged
+                return
+        self.active -= 1
+
+    def _remove(self, client, future):
+        waiters = self._waiters.get(client)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._waiters[client]
+            self._set_queued(self.queued - 1)
+
+    def _set_queued(self, queued):
+        self.queued = queued
+        QUEUE_WAITING.labels(self.stage).set(queued)
+
+    @asynccontextmanager
+    async def slot(self, client=None):
+        started = time.perf_counter()
+        await self.acquire(client)
+        acquired = time.perf_counter()
+        QUEUE_WAIT_SECONDS.labels(self.stage).observe(acquired - started)
+        try:
+            yield
+        finally:
+            held = time.perf_counter() - acquired
+            self._hold_seconds = held if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * held
+            self.release()
+
+    def stats(self):
+        return {"active": self.active, "queued": self.queued, "concurrency": self.concurrency,
+                "max_queued": self.max_queued, "rejected": self.rejected,
+                "clients_waiting": len(self._waiters)}
+
+class _Flight:
+    """One shared run of a stream: the parts produced so far and who is still listening."""
+
+    def __init__(self):
+        self.parts = []
+        self.finished = False
+        self.error = None
+        self.listeners = 0
+        self.changed = asyncio.Condition()
+        self.task = None
+
+class Scheduler:
+    def __init__(self, embed_concurrency=EMBED_CONCURRENCY, generate_concurrency=GENERATE_CONCURRENCY,
+                 max_queued=MAX_QUEUED, coalesce=COALESCE_ENABLED):
+        self.embed = FairLimiter("embed", embed_concurrency, max_queued)
+        self.generate = FairLimiter("generate", generate_concurrency, max_queued)
+        self.coalesce = coalesce
+        self.coalesced = 0
+        self._flights = {}
+
+    def admit(self):
+        # Refuse new work up front rather than after embedding and retrieval have been paid for
+        if self.generate.full():
+            self.generate.reject()
+
+    async def _run(self, key, flight, stream):
+        try:
+            async for part in stream():
+                async with flight.changed:
+                    flight.parts.append(part)
+                    flight.changed.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._flights.pop(key, None)
+            async with flight.changed:
+                flight.finished = True
+                flight.changed.notify_all()
+
+    async def single_flight(self, key, stream):
+        """Yield the parts of stream(), sharing one run between all callers with the same key.
+
+        Later callers replay the parts produced so far and then follow the live run. The run is
+        cancelled if every caller goes away before it finishes.
+        """
+        if not self.coalesce:
+            self.admit()
+            async for part in stream():
+                yield part
+            return
+        flight = self._flights.get(key)
+        follower = flight is not None
+        if follower:
+            self.coalesced += 1
+            COALESCED_REQUESTS.inc()
+        else:
+            self.admit()
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._run(key, flight, stream))
+        flight.listeners += 1
+        try:
+            seen = 0
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: len(flight.parts) > seen or flight.finished)
+                    parts = flight.parts[seen:]
+                    finished = flight.finished
+                seen += len(parts)
+                for part in parts:
+                    yield dict(part, coalesced=True) if follower and part.get("done") else part
+                if finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            flight.listeners -= 1
+            if flight.listeners == 0 and not flight.finished:
+                flight.task.cancel()
+
+    def stats(self):
+        return {"embed": self.embed.stats(), "generate": self.generate.stats(), "coalesced": self.coalesced,
+                "in_flight": len(self._flights)}
+
+_scheduler = None
+
+def init_scheduler(**kwargs):
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler(**kwargs)
+    return _scheduler
+
+def get_scheduler():
+    # Only rag_api.py schedules, single queries from the command line run unscheduled
+    return _scheduler
+
+def close_scheduler():
+    global _scheduler
+    _scheduler = None
+
+@asynccontextmanager
+async def slot(stage, client=None):
+    """Hold an embed or generate slot of the scheduler, or nothing when there is no scheduler."""
+    if _scheduler is None:
+        yield
+        return
+    async with getattr(_scheduler, stage).slot(client):
+        yield
@@ -1,107 +1,286 @@
+import asyncio
 import json
+import os
+import random
 import time
 from pathlib import Path
-from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright
 import argparse
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
 
-SLEEP_BETWEEN_REQUESTS = 0.5
 RETRY_DELAY = 5
 MAX_RETRIES = 3
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 4.0
+USER_AGENT = "fandom-rag scraper (https://github.com/thefnordling/fandom-rag)"
 
 
-def get_all_article_titles(page):
-    titles = []
-    apcontinue = None
-    print("🔍 Collecting article titles using API in browser context...")
+class TokenBucket:
+    """Async token bucket, allows `rate` requests per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HttpFetcher:
+    """Plain HTTP client, for wikis (or local stand-ins) that do not serve a browser challenge."""
+
+    async def start(self, workers):
+        import httpx
+        self._client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=30,
+            limits=httpx.Limits(max_connections=workers)
+        )
+
+    async def get_json(self, url):
+        resp = await self._client.get(url)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def close(self):
+        await self._client.aclose()
 
-    while True:
-        url = f"{API_URL}?action=query&list=allpages&aplimit=max&format=json"
-        if apcontinue:
-            url += f"&apcontinue={apcontinue}"
 
-        page.goto(url)
-        content = page.locator("body").text_content()
+class BrowserFetcher:
+    """A pool of Playwright pages in one browser context, one page per worker."""
+
+    async def start(self, workers):
+        from playwright.async_api import async_playwright
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        context = await self._browser.new_context()
+        self._pages = asyncio.Queue()
+        for _ in range(workers):
+            self._pages.put_nowait(await context.new_page())
+
+    async def get_json(self, url):
+        page = await self._pages.get()
         try:
-            data = json.loads(content)
-        except Exception as e:
-            print(f"❌ Failed to parse JSON from API: {e}")
-            print(content[:500])
-            break
+            await page.goto(url)
+            content = await page.locator("body").text_content()
+        finally:
+            self._pages.put_nowait(page)
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            raise ValueError(f"Response is not JSON: {content[:200]}")
+
+    async def close(self):
+        await self._browser.close()
+        await self._playwright.stop()
+
+
+async def get_all_article_titles(fetcher, limiter):
+    """Return {title: {"revid", "timestamp"}} for every article.
 
-        pages = data.get("query", {}).get("allpages", [])
-        titles.extend(page["title"] for page in pages)
+    The allpages generator is combined with prop=revisions, so each listing request also returns
+    the latest revision id of up to 500 pages instead of needing a request per title.
+    """
+    pages = {}
+    params = {
+        "action": "query",
+        "generator": "allpages",
+        "gapnamespace": 0,
+        "gaplimit": "max",
+        "prop": "revisions",
+        "rvprop": "ids|timestamp",
+        "format": "json",
+        "formatversion": 2
+    }
+    cont = {}
+    print("🔍 Collecting article titles using API...")
 
-        apcontinue = data.get("continue", {}).get("apcontinue")
-        if not apcontinue:
+    while True:
+        url = f"{API_URL}?{urlencode({**params, **cont})}"
+        for attempt in range(1, MAX_RETRIES + 1):
+            await limiter.acquire()
+            try:
+                data = await fetcher.get_json(url)
+                break
+            except Exception as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                print(f"❌ Attempt {attempt} to list titles failed: {e}")
+                await asyncio.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+        for page in data.get("query", {}).get("pages", []):
+            revision = (page.get("revisions") or [{}])[0]
+            pages[page["title"]] = {"revid": revision.get("revid"), "timestamp": revision.get("timestamp")}
+        cont = data.get("continue")
+        if not cont:
             break
 
-        time.sleep(SLEEP_BETWEEN_REQUESTS)
+    print(f"✅ Found {len(pages)} articles.")
+    return pages
 
-    print(f"✅ Found {len(titles)} articles.")
-    return titles
 
+async def fetch_article_content(fetcher, title):
+    # action=parse renders one page per request, MediaWiki has no batched HTML rendering
+    encoded_title = quote(title, safe="")
+    url = f"{API_URL}?action=parse&page={encoded_title}&format=json&prop=text|revid&formatversion=2"
+    data = await fetcher.get_json(url)
+    if "error" in data:
+        raise ValueError(data["error"].get("info", data["error"]))
+    parsed = data.get("parse", {})
+    html = parsed.get("text", "")
+    if not html:
+        raise ValueError("empty parse result")
+    return {
+        "title": title,
+        "url": f"{BASE_URL}/wiki/{encoded_title}",
+        "revid": parsed.get("revid"),
+        "html": html
+    }
 
-def fetch_article_content(page, title):
-    for attempt in range(1, MAX_RETRIES + 1):
-        encoded_title = quote(title, safe="")
-        url = f"{API_URL}?action=parse&page={encoded_title}&format=json&prop=text&formatversion=2"
-        try:
-            page.goto(url)
-            content = page.locator("body").text_content()
-            data = json.loads(content)
-            html = data.get("parse", {}).get("text", "")
-            if html:
-                return {
-                    "title": title,
-                    "url": f"{BASE_URL}/wiki/{encoded_title}",
-                    "html": html
-                }
-        except Exception as e:
-            print(f"❌ Attempt {attempt} failed for {title}: {e}")
-            time.sleep(RETRY_DELAY)
-
-    return None
-
-
-def fetch_article_text_from_html(html):
-    soup = BeautifulSoup(html, "html.parser")
-    return soup.get_text(separator=" ", strip=True)
-
-def main(wiki_name, output_file):
-    global BASE_URL, API_URL
-    BASE_URL = f"https://{wiki_name}.fandom.com"
-    API_URL = f"{BASE_URL}/api.php"
 
-    with sync_playwright() as playwright:
-        browser = playwright.chromium.launch(headless=True)
-        context = browser.new_context()
-        page = context.new_page()
+async def scrape_titles(fetcher, limiter, titles, workers, out, fetched=None):
+    """Fetch titles with `workers` concurrent workers, writing each article as soon as it arrives.
+
+    A failed title is re-queued after an exponential backoff instead of holding up its worker.
+    Titles written are added to fetched. Returns (written, skipped).
+    """
+    loop = asyncio.get_running_loop()
+    work = asyncio.Queue()
+    for title in titles:
+        work.put_nowait((title, 1))
+    remaining = len(titles)
+    written = skipped = 0
+    finished = asyncio.Event()
+    if not remaining:
+        finished.set()
+
+    async def worker():
+        nonlocal remaining, written, skipped
+        while True:
+            title, attempt = await work.get()
+            await limiter.acquire()
+            try:
+                result = await fetch_article_content(fetcher, title)
+            except Exception as e:
+                if attempt < MAX_RETRIES:
+                    delay = RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+                    print(f"❌ Attempt {attempt} failed for {title}: {e} (retrying in {delay:.0f}s)")
+                    loop.call_later(delay, work.put_nowait, (title, attempt + 1))
+                    continue
+                print(f"⚠️ Skipped: {title} ({e})")
+                result = None
+            if result:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                written += 1
+                if fetched is not None:
+                    fetched.add(title)
+            else:
+                skipped += 1
+            remaining -= 1
+            print(f"Progress: {len(titles) - remaining}/{len(titles)}", end="\r")
+            if not remaining:
+                finished.set()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    waiter = asyncio.create_task(finished.wait())
+    try:
+        done, _ = await asyncio.wait([waiter, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            # A worker only returns early when it crashed, surface the error
+            task.result()
+    finally:
+        waiter.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return written, skipped
 
-        titles = get_all_article_titles(page)
 
-        print(f"\n🚀 Fetching {len(titles)} pages serially...\n")
+def load_previous_revisions(output_file):
+    """Return {title: revid} from an earlier scrape, empty when there is none."""
+    revisions = {}
+    if not os.path.exists(output_file):
+        return revisions
+    with open(output_file, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            revisions[record["title"]] = record.get("revid")
+    return revisions
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            for i, title in enumerate(titles, 1):
-                result = fetch_article_content(page, title)
-                if result:
-                    result["text"] = fetch_article_text_from_html(result["html"])
-                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                else:
-                    print(f"⚠️ Skipped: {title}")
-                print(f"Progress: {i}/{len(titles)}", end="\r")
-                time.sleep(SLEEP_BETWEEN_REQUESTS)
 
-        browser.close()
-        print(f"\n🎉 Done! Scraped articles written to {output_file}")
+def merge_previous(output_file, partial_file, pages, fetched):
+    """Append the unchanged records of the previous scrape to partial_file and swap it into place.
+
+    Pages that no longer exist are dropped. Changed pages that failed to fetch keep their old record.
+    """
+    kept = 0
+    with open(partial_file, "a", encoding="utf-8") as out, open(output_file, encoding="utf-8") as previous:
+        for line in previous:
+            title = json.loads(line)["title"]
+            if title in pages and title not in fetched:
+                out.write(line)
+                kept += 1
+    os.replace(partial_file, output_file)
+    return kept
+
+
+async def run(output_file, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, use_http=False, incremental=False):
+    fetcher = HttpFetcher() if use_http else BrowserFetcher()
+    limiter = TokenBucket(rate)
+    previous = load_previous_revisions(output_file) if incremental else {}
+    await fetcher.start(workers)
+    try:
+        pages = await get_all_article_titles(fetcher, limiter)
+        titles = list(pages)
+        if previous:
+            # Only pages that are new or have a newer revision than the last scrape are fetched
+            titles = [t for t in titles if previous.get(t) is None or previous[t] != pages[t]["revid"]]
+            removed = len(set(previous) - set(pages))
+            print(f"🔁 {len(titles)} pages changed, {len(pages) - len(titles)} unchanged, {removed} removed since the last scrape")
+        target = f"{output_file}.partial" if previous else output_file
+        print(f"\n🚀 Fetching {len(titles)} pages with {workers} workers at up to {rate:g} requests/sec...\n")
+        fetched = set()
+        with open(target, "w", encoding="utf-8") as f:
+            written, skipped = await scrape_titles(fetcher, limiter, titles, workers, f, fetched)
+    finally:
+        await fetcher.close()
+    if previous:
+        kept = merge_previous(output_file, target, pages, fetched)
+        print(f"\nKept {kept} unchanged articles from the previous scrape")
+    print(f"\n🎉 Done! {written} articles written to {output_file}, {skipped} skipped")
+
+
+def main(wiki_name, output_file, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, use_http=False, api_url=None,
+         incremental=False):
+    global BASE_URL, API_URL
+    BASE_URL = f"https://{wiki_name}.fandom.com"
+    API_URL = api_url or f"{BASE_URL}/api.php"
+    if api_url:
+        BASE_URL = api_url.rsplit("/", 1)[0]
+    asyncio.run(run(output_file, workers=workers, rate=rate, use_http=use_http, incremental=incremental))
 
 if __name__ == "__main__":
-    # Remove output file if it exists from previous runs
     parser = argparse.ArgumentParser(description="Scrape a Fandom wiki by name.")
     parser.add_argument("wiki_name", help="The subdomain name of the fandom wiki (e.g. 'pokemon' for pokemon.fandom.com)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of pages fetched concurrently")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Maximum API requests per second across all workers")
+    parser.add_argument("--http", action="store_true", help="Use a plain HTTP client instead of a headless browser")
+    parser.add_argument("--api-url", help="Override the api.php url, e.g. a local stand-in (http://localhost:8080/api.php)")
+    parser.add_argument("--incremental", action="store_true", help="Update an earlier scrape, only fetching pages whose revision changed")
     args = parser.parse_args()
     output_file = f"{args.wiki_name}.jsonl"
-    Path(output_file).unlink(missing_ok=True)
-    main(args.wiki_name, output_file)
+    if not args.incremental:
+        # Remove output file if it exists from previous runs
+        Path(output_file).unlink(missing_ok=True)
+    main(args.wiki_name, output_file, workers=args.workers, rate=args.rate, use_http=args.http, api_url=args.api_url,
+         incremental=args.incremental)
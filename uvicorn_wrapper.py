@@ -8,6 +8,55 @@ def parse_args():
     parser.add_argument('--db-name', required=True)
     parser.add_argument('--db-user', required=True)
     parser.add_argument('--db-pass', required=True)
+    parser.add_argument('--db-pool-min', type=int, default=1, help='Minimum pooled database connections')
+    parser.add_argument('--db-pool-max', type=int, default=10, help='Maximum pooled database connections')
+    parser.add_argument('--db-pool-timeout', type=float, default=10, help='Seconds to wait for a pooled connection')
+    parser.add_argument('--db-command-timeout', type=float, default=60, help='Seconds before a database query is cancelled')
+    parser.add_argument('--ollama-host', action='append', help='Ollama base url, repeat for a pool. Append =embed or =generate to limit a host to one role')
+    parser.add_argument('--ollama-health-interval', type=float, default=10, help='Seconds between health checks of pooled Ollama hosts (0 disables)')
+    parser.add_argument('--ollama-eject-seconds', type=float, default=5, help='Seconds a failing Ollama host is left out, doubling per consecutive failure')
+    parser.add_argument('--ollama-connect-timeout', type=float, default=5, help='Seconds to wait for a connection to Ollama')
+    parser.add_argument('--ollama-read-timeout', type=float, default=600, help='Seconds to wait for data from Ollama')
+    parser.add_argument('--ollama-retries', type=int, default=2, help='Retries for failed Ollama requests')
+    parser.add_argument('--ollama-max-connections', type=int, default=32, help='Maximum open connections to Ollama')
+    parser.add_argument('--ollama-keep-alive', help='How long Ollama keeps the model and its prompt cache loaded, e.g. 30m')
+    parser.add_argument('--embed-cache-max-bytes', type=int, default=64 * 1024 * 1024, help='Memory budget of the query embedding LRU cache')
+    parser.add_argument('--embed-cache-path', help='SQLite file for the persistent query embedding cache (memory only when omitted)')
+    parser.add_argument('--answer-cache', action='store_true', help='Serve cached answers for paraphrased questions')
+    parser.add_argument('--answer-cache-threshold', type=float, default=0.95, help='Cosine similarity needed to reuse a cached answer')
+    parser.add_argument('--answer-cache-ttl', type=float, default=3600, help='Seconds a cached answer stays valid')
+    parser.add_argument('--answer-cache-max-entries', type=int, default=512, help='Maximum number of cached answers')
+    parser.add_argument('--retrieval-mode', choices=['exact', 'ann', 'mmap'], default='exact', help='exact scans every embedding, ann re-ranks HNSW candidates, mmap searches a local vector index')
+    parser.add_argument('--ann-candidates', type=int, default=1000, help='Candidates taken from the HNSW index in ann mode')
+    parser.add_argument('--ann-ef-search', type=int, default=1000, help='hnsw.ef_search used in ann mode (max 1000)')
+    parser.add_argument('--vector-index', help='Directory of the vector index exported by vector_index.py (mmap mode)')
+    parser.add_argument('--hybrid', choices=['off', 'rrf', 'prefilter'], default='off', help='rrf fuses full-text and vector rankings, prefilter only vector-ranks full-text/title matches')
+    parser.add_argument('--lexical-candidates', type=int, default=200, help='Chunks taken from the full-text search in hybrid modes')
+    parser.add_argument('--rrf-k', type=int, default=60, help='Reciprocal rank fusion constant')
+    parser.add_argument('--prefilter-min-matches', type=int, default=20, help='Fewer matching chunks than this falls back to the vector ranking')
+    parser.add_argument('--select', action='store_true', help='Diversify retrieved chunks with MMR and an adaptive cutoff by default')
+    parser.add_argument('--mmr-lambda', type=float, default=0.7, help='MMR trade-off, 1.0 ranks by relevance only')
+    parser.add_argument('--min-relative-similarity', type=float, default=0.8, help='Drop chunks below this fraction of the best similarity')
+    parser.add_argument('--score-gap', type=float, default=0.1, help='Cut the ranking at the first similarity drop larger than this')
+    parser.add_argument('--min-selected', type=int, default=5, help='Chunks always kept by the cutoffs')
+    parser.add_argument('--max-selected', type=int, default=0, help='Maximum selected chunks (0 for no limit)')
+    parser.add_argument('--conversations', action='store_true', help='Keep chat context between turns so follow-ups reuse the prompt prefix')
+    parser.add_argument('--conversation-idle-ttl', type=float, default=1800, help='Seconds before an idle conversation is dropped')
+    parser.add_argument('--conversation-max-entries', type=int, default=256, help='Maximum number of kept conversation turns')
+    parser.add_argument('--conversation-first-turn-tokens', type=int, default=24000, help='Context tokens packed on the first turn of a conversation')
+    parser.add_argument('--conversation-turn-tokens', type=int, default=4000, help='New context tokens added by each follow-up')
+    parser.add_argument('--latency-target', default='thorough', help="Default context size: 'fast', 'thorough' or seconds to the first token")
+    parser.add_argument('--fast-target', type=float, default=5, help="Seconds to the first token aimed for by the 'fast' target")
+    parser.add_argument('--thorough-target', type=float, default=0, help="Seconds aimed for by the 'thorough' target, 0 fills the context window")
+    parser.add_argument('--prefill-tps', type=float, default=1000, help='Prompt tokens/second assumed until generations have been measured')
+    parser.add_argument('--answer-reserve-tokens', type=int, default=2000, help='Tokens of the context window kept free for the answer')
+    parser.add_argument('--fallback-context-window', type=int, default=40960, help='Context window used when ollama /api/show reports none')
+    parser.add_argument('--max-top-k', type=int, default=300, help='Maximum chunks retrieved per query')
+    parser.add_argument('--embed-concurrency', type=int, default=4, help='Query embeddings sent to Ollama at the same time')
+    parser.add_argument('--generate-concurrency', type=int, default=1, help='Answers generated at the same time, match OLLAMA_NUM_PARALLEL')
+    parser.add_argument('--max-queued', type=int, default=16, help='Requests waiting for a slot before new ones get a 503')
+    parser.add_argument('--no-coalesce', action='store_true', help='Run identical concurrent queries separately')
+    parser.add_argument('--no-request-log', action='store_true', help='Do not print a JSON log line per rag query')
     parser.add_argument('--host', default='0.0.0.0')
     parser.add_argument('--port', type=int, default=8000)
     return parser.parse_args()
@@ -19,5 +68,57 @@ if __name__ == "__main__":
     os.environ["DB_NAME"] = args.db_name
     os.environ["DB_USER"] = args.db_user
     os.environ["DB_PASS"] = args.db_pass
+    os.environ["DB_POOL_MIN_SIZE"] = str(args.db_pool_min)
+    os.environ["DB_POOL_MAX_SIZE"] = str(args.db_pool_max)
+    os.environ["DB_POOL_TIMEOUT"] = str(args.db_pool_timeout)
+    os.environ["DB_COMMAND_TIMEOUT"] = str(args.db_command_timeout)
+    os.environ["OLLAMA_HOSTS"] = ",".join(args.ollama_host or ['http://fnordstation.home.arpa:11434'])
+    os.environ["OLLAMA_HEALTH_INTERVAL"] = str(args.ollama_health_interval)
+    os.environ["OLLAMA_EJECT_BASE_SECONDS"] = str(args.ollama_eject_seconds)
+    os.environ["OLLAMA_CONNECT_TIMEOUT"] = str(args.ollama_connect_timeout)
+    os.environ["OLLAMA_READ_TIMEOUT"] = str(args.ollama_read_timeout)
+    os.environ["OLLAMA_MAX_RETRIES"] = str(args.ollama_retries)
+    os.environ["OLLAMA_MAX_CONNECTIONS"] = str(args.ollama_max_connections)
+    if args.ollama_keep_alive:
+        os.environ["OLLAMA_KEEP_ALIVE"] = args.ollama_keep_alive
+    os.environ["EMBED_CACHE_MAX_BYTES"] = str(args.embed_cache_max_bytes)
+    if args.embed_cache_path:
+        os.environ["EMBED_CACHE_PATH"] = args.embed_cache_path
+    os.environ["ANSWER_CACHE_ENABLED"] = "1" if args.answer_cache else "0"
+    os.environ["ANSWER_CACHE_THRESHOLD"] = str(args.answer_cache_threshold)
+    os.environ["ANSWER_CACHE_TTL"] = str(args.answer_cache_ttl)
+    os.environ["ANSWER_CACHE_MAX_ENTRIES"] = str(args.answer_cache_max_entries)
+    os.environ["RETRIEVAL_MODE"] = args.retrieval_mode
+    os.environ["ANN_CANDIDATES"] = str(args.ann_candidates)
+    os.environ["ANN_EF_SEARCH"] = str(args.ann_ef_search)
+    if args.vector_index:
+        os.environ["VECTOR_INDEX_PATH"] = args.vector_index
+    os.environ["HYBRID_MODE"] = args.hybrid
+    os.environ["LEXICAL_CANDIDATES"] = str(args.lexical_candidates)
+    os.environ["RRF_K"] = str(args.rrf_k)
+    os.environ["PREFILTER_MIN_MATCHES"] = str(args.prefilter_min_matches)
+    os.environ["SELECTION_ENABLED"] = "1" if args.select else "0"
+    os.environ["MMR_LAMBDA"] = str(args.mmr_lambda)
+    os.environ["MIN_RELATIVE_SIMILARITY"] = str(args.min_relative_similarity)
+    os.environ["SCORE_GAP"] = str(args.score_gap)
+    os.environ["MIN_SELECTED"] = str(args.min_selected)
+    os.environ["MAX_SELECTED"] = str(args.max_selected)
+    os.environ["CONVERSATIONS_ENABLED"] = "1" if args.conversations else "0"
+    os.environ["CONVERSATION_IDLE_TTL"] = str(args.conversation_idle_ttl)
+    os.environ["CONVERSATION_MAX_ENTRIES"] = str(args.conversation_max_entries)
+    os.environ["CONVERSATION_FIRST_TURN_TOKENS"] = str(args.conversation_first_turn_tokens)
+    os.environ["CONVERSATION_TURN_TOKENS"] = str(args.conversation_turn_tokens)
+    os.environ["DEFAULT_LATENCY_TARGET"] = args.latency_target
+    os.environ["FAST_TARGET_SECONDS"] = str(args.fast_target)
+    os.environ["THOROUGH_TARGET_SECONDS"] = str(args.thorough_target)
+    os.environ["PREFILL_TPS"] = str(args.prefill_tps)
+    os.environ["ANSWER_RESERVE_TOKENS"] = str(args.answer_reserve_tokens)
+    os.environ["FALLBACK_CONTEXT_WINDOW"] = str(args.fallback_context_window)
+    os.environ["MAX_TOP_K"] = str(args.max_top_k)
+    os.environ["EMBED_CONCURRENCY"] = str(args.embed_concurrency)
+    os.environ["GENERATE_CONCURRENCY"] = str(args.generate_concurrency)
+    os.environ["MAX_QUEUED"] = str(args.max_queued)
+    os.environ["COALESCE_ENABLED"] = "0" if args.no_coalesce else "1"
+    os.environ["REQUEST_LOG_ENABLED"] = "0" if args.no_request_log else "1"
 
     uvicorn.run("rag_api:app", host=args.host, port=args.port, reload=True)
\ No newline at end of file
@@ -0,0 +1,33 @@
+import struct
+import numpy as np
+
+# pgvector binary wire format: uint16 dimensions, uint16 unused, then big-endian float4 values
+# (float2 for halfvec). Sending this instead of a '[0.1, 0.2, ...]' literal avoids formatting
+# and parsing 4096 floats as text.
+
+# Leading dimensions kept for the indexed chunks.embedding_ann column. Qwen3-Embedding is trained
+# with Matryoshka representation learning, so a truncated, re-normalized prefix is still a usable
+# embedding, and at 1024 dimensions it fits pgvector's HNSW limit.
+ANN_DIMENSIONS = 1024
+
+def encode_vector(values) -> bytes:
+    arr = np.asarray(values, dtype=">f4")
+    return struct.pack(">HH", arr.shape[0], 0) + arr.tobytes()
+
+def decode_vector(data) -> np.ndarray:
+    dim, _ = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=">f4", count=dim, offset=4).astype(np.float32)
+
+def encode_halfvec(values) -> bytes:
+    arr = np.asarray(values, dtype=">f2")
+    return struct.pack(">HH", arr.shape[0], 0) + arr.tobytes()
+
+def decode_halfvec(data) -> np.ndarray:
+    dim, _ = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=">f2", count=dim, offset=4).astype(np.float32)
+
+def reduce_embedding(values, dimensions=ANN_DIMENSIONS) -> np.ndarray:
+    # Matches l2_normalize(subvector(embedding, 1, dimensions)) used by db_migrate.py backfills
+    arr = np.asarray(values, dtype=np.float32)[:dimensions]
+    norm = np.linalg.norm(arr)
+    return arr / norm if norm > 0 else arr
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import numpy as np
+import psycopg2
+from vector_codec import decode_vector
+
+# An in-process alternative to scanning chunks.embedding in Postgres. The normalized embeddings
+# are exported into one contiguous row-major matrix file that is memory-mapped read-only, so
+# every uvicorn worker on the box shares the same pages through the OS page cache.
+#
+# Every wiki has its own index directory under VECTOR_INDEX_PATH (see wiki_index_path), so a
+# search only scans the rows of the requested wiki. Layout, where N is the generation written
+# by the last export:
+#   meta.json          dtype, dimensions, row count, highest chunk_id and current generation
+#   embeddings-N.bin   count x dim matrix, float16 or int8
+#   scales-N.bin       per-row float32 scale factors (int8 only)
+#   ids-N.npy          chunk_id of every matrix row
+
+VECTOR_INDEX_PATH = os.environ.get("VECTOR_INDEX_PATH")
+# Minimum seconds between checks of meta.json for a newer generation
+VECTOR_INDEX_RELOAD_INTERVAL = float(os.environ.get("VECTOR_INDEX_RELOAD_INTERVAL", "5"))
+# Rows converted to float32 at a time while scoring, bounds the temporary memory per query
+SEARCH_BLOCK_ROWS = 4096
+
+DTYPES = {"float16": "<f2", "int8": "i1"}
+# Names of the files _files() writes, anything else in an index directory is left alone
+GENERATION_FILE_RE = re.compile(r"^(?:embeddings|scales)-\d+\.bin$|^ids-\d+\.npy$")
+
+def wiki_index_path(base, wiki):
+    return os.path.join(base, wiki)
+
+def _meta_path(path):
+    return os.path.join(path, "meta.json")
+
+def _read_meta(path):
+    try:
+        with open(_meta_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _files(path, generation):
+    return {
+        "embeddings": os.path.join(path, f"embeddings-{generation}.bin"),
+        "scales": os.path.join(path, f"scales-{generation}.bin"),
+        "ids": os.path.join(path, f"ids-{generation}.npy")
+    }
+
+def _encode_rows(vectors, dtype):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1)
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(DTYPES["int8"]), scales.astype("<f4")
+    return vectors.astype(DTYPES["float16"]), None
+
+def _count_embedded(db_params, wiki, max_chunk_id):
+    conn = psycopg2.connect(**db_params)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT count(*) FROM chunks
+                WHERE chunk_id <= %s AND embedding IS NOT NULL AND (%s IS NULL OR wiki = %s)
+            """, (max_chunk_id, wiki, wiki))
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+def export_index(db_params, path, wiki=None, dtype="float16", full=False, batch_size=2000):
+    """Write the chunk embeddings of wiki (every wiki when None) to a new index generation under path.
+
+    Unless full is set, rows of the previous generation are copied over and only chunks with a
+    higher chunk_id are fetched, so refreshing after an ingest reads just the new chunks. When
+    chunks the previous generation covers have been deleted since (remove_stub_articles.py, a
+    sync with --prune, db_migrate.py) or embedded late, the index is rebuilt instead.
+    Returns the new meta dict, or None when there is nothing to index.
+    """
+    os.makedirs(path, exist_ok=True)
+    old = _read_meta(path)
+    generation = old["generation"] + 1 if old else 1
+    if old and (full or old["dtype"] != dtype):
+        old = None
+    if old:
+        indexed = _count_embedded(db_params, wiki, old["max_chunk_id"])
+        if indexed != old["count"]:
+            print(f"⚠️ {old['count']} chunks indexed but {indexed} in the database now, rebuilding the index")
+            old = None
+    files = _files(path, generation)
+    ids = []
+    count = old["count"] if old else 0
+    dim = old["dim"] if old else None
+    max_chunk_id = old["max_chunk_id"] if old else 0
+
+    with open(files["embeddings"], "wb") as emb_out, open(files["scales"], "wb") as scale_out:
+        if old:
+            old_files = _files(path, old["generation"])
+            with open(old_files["embeddings"], "rb") as f:
+                shutil.copyfileobj(f, emb_out)
+            if dtype == "int8":
+                with open(old_files["scales"], "rb") as f:
+                    shutil.copyfileobj(f, scale_out)
+            ids.append(np.load(old_files["ids"]))
+
+        conn = psycopg2.connect(**db_params)
+        try:
+            with conn.cursor(name="vector_index_export") as cur:
+                cur.itersize = batch_size
+                cur.execute("""
+                    SELECT chunk_id, vector_send(embedding)
+                    FROM chunks
+                    WHERE chunk_id > %s AND embedding IS NOT NULL AND (%s IS NULL OR wiki = %s)
+                    ORDER BY chunk_id
+                """, (max_chunk_id, wiki, wiki))
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    vectors = np.stack([decode_vector(bytes(row[1])) for row in rows])
+                    dim = dim or vectors.shape[1]
+                    encoded, scales = _encode_rows(vectors, dtype)
+                    emb_out.write(encoded.tobytes())
+                    if scales is not None:
+                        scale_out.write(scales.tobytes())
+                    ids.append(np.array([row[0] for row in rows], dtype=np.int64))
+                    count += len(rows)
+                    max_chunk_id = rows[-1][0]
+                    print(f"Exported {count} embeddings", end="\r")
+        finally:
+            conn.close()
+
+    if not count:
+        for f in files.values():
+            if os.path.exists(f):
+                os.remove(f)
+        print("No embeddings to index.")
+        return None
+
+    np.save(files["ids"], np.concatenate(ids))
+    meta = {"dtype": dtype, "dim": dim, "count": count, "max_chunk_id": max_chunk_id,
+            "generation": generation, "created_at": time.time()}
+    tmp = _meta_path(path) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    # Readers switch to the new generation when meta.json changes. Files of older generations
+    # can be unlinked right away, processes that still map them keep them alive until they reload.
+    os.replace(tmp, _meta_path(path))
+    current = {os.path.basename(f) for f in files.values()}
+    for stale in os.listdir(path):
+        if GENERATION_FILE_RE.match(stale) and stale not in current:
+            os.remove(os.path.join(path, stale))
+    print(f"\n✅ Vector index generation {generation} written with {count} rows to {path}")
+    return meta
+
+class VectorIndex:
+    """Read-only, memory-mapped view of an exported index that follows new generations."""
+
+    def __init__(self, path, reload_interval=VECTOR_INDEX_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._stat = None
+        self._checked = 0.0
+        self._load()
+
+    def _load(self):
+        stat = os.stat(_meta_path(self.path))
+        meta = _read_meta(self.path)
+        files = _files(self.path, meta["generation"])
+        matrix = np.memmap(files["embeddings"], dtype=DTYPES[meta["dtype"]], mode="r",
+                           shape=(meta["count"], meta["dim"]))
+        scales = None
+        if meta["dtype"] == "int8":
+            scales = np.memmap(files["scales"], dtype="<f4", mode="r", shape=(meta["count"],))
+        ids = np.load(files["ids"], mmap_mode="r")
+        # Swap everything at once so a concurrent search sees one consistent generation
+        self._state = (meta, matrix, scales, ids)
+        self._stat = (stat.st_ino, stat.st_mtime_ns)
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            stat = os.stat(_meta_path(self.path))
+            if (stat.st_ino, stat.st_mtime_ns) != self._stat:
+                self._load()
+
+    @property
+    def meta(self):
+        return self._state[0]
+
+    def search(self, embedding, top_k):
+        """Return (chunk_ids, cosine similarities) of the top_k rows, best first."""
+        self.maybe_reload()
+        meta, matrix, scales, ids = self._state
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = np.empty(meta["count"], dtype=np.float32)
+        for start in range(0, meta["count"], SEARCH_BLOCK_ROWS):
+            block = matrix[start:start + SEARCH_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if scales is not None:
+            scores *= scales
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # argpartition finds the top_k in linear time, only those are sorted
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return np.asarray(ids[top]), scores[top]
+
+_base_path = None
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def init_vector_index(path=VECTOR_INDEX_PATH):
+    global _base_path
+    if not path:
+        raise ValueError("VECTOR_INDEX_PATH is not set.")
+    _base_path = path
+    return path
+
+def get_vector_index(wiki):
+    """Return the index of wiki, mapped on first use."""
+    if _base_path is None:
+        raise RuntimeError("Vector index is not loaded, call init_vector_index() first.")
+    index = _indexes.get(wiki)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(wiki)
+            if index is None:
+                path = wiki_index_path(_base_path, wiki)
+                if _read_meta(path) is None:
+                    raise RuntimeError(f"No vector index for wiki '{wiki}' in {_base_path}.")
+                index = _indexes[wiki] = VectorIndex(path)
+    return index
+
+def close_vector_index():
+    global _base_path
+    _base_path = None
+    _indexes.clear()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export chunk embeddings into a memory-mapped vector index.")
+    parser.add_argument('--db-host', required=True, help='PostgreSQL host')
+    parser.add_argument('--db-name', required=True, help='PostgreSQL database name')
+    parser.add_argument('--db-user', required=True, help='PostgreSQL user')
+    parser.add_argument('--db-pass', required=True, help='PostgreSQL password')
+    parser.add_argument('--path', required=True, help='Base index directory, the index is written to <path>/<wiki>')
+    parser.add_argument('--wiki', required=True, help='Wiki to export')
+    parser.add_argument('--dtype', choices=sorted(DTYPES), default='float16', help='Storage type of the matrix')
+    parser.add_argument('--full', action='store_true', help='Rebuild from scratch instead of appending new chunks')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    pg_conn_params = dict(dbname=args.db_name, user=args.db_user, password=args.db_pass, host=args.db_host)
+    export_index(pg_conn_params, wiki_index_path(args.path, args.wiki), wiki=args.wiki, dtype=args.dtype, full=args.full)